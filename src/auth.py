@@ -7,50 +7,43 @@ import smtplib
 import ssl
 import jwt
 import data
+import locks
 from error import InputError
 
+@locks.users_writes
 def auth_login(email, password):
     """Logs in the user using their email and password"""
 
-    u_id = ''
-
-    token = ''
-
-    email_exists = False
-
-    # Checks the list of users for a user with a matching email
-    for user in data.users:
-        if email == user['email']:
-            # If the correct password was given, a token is issued if the user doesn't have one
-            # Otherwise, an input error is raised
-            if password == user['password']:
-                u_id = user['u_id']
-                token = jwt.encode({'u_id': user['u_id']}, data.SECRET,
-                                   algorithm='HS256').decode('utf-8')
-                if token not in data.tokens:
-                    data.tokens.append(token)
-            else:
-                raise InputError(description='Incorrect password')
-            email_exists = True
-
+    # Looks up the user with a matching email
     # If no user with a matching email is found, an Input error is raised
-    if email_exists is False:
+    user = data.get_user_by_email(email)
+    if user is None:
         raise InputError(description='Email not registered')
 
+    # If the correct password was given, a token is issued if the user doesn't have one
+    # Otherwise, an input error is raised
+    if password != user['password']:
+        raise InputError(description='Incorrect password')
+
+    u_id = user['u_id']
+    token = jwt.encode({'u_id': user['u_id']}, data.SECRET,
+                       algorithm='HS256').decode('utf-8')
+    data.add_token(token)
 
     return {
         'u_id': u_id,
         'token': token,
     }
 
+@locks.users_writes
 def auth_logout(token):
     """Logs out the user given their token"""
 
     # Checks the token list for the token and then removes it and returns true
     # Otherwise, returns false
 
-    if token in data.tokens:
-        data.tokens.remove(token)
+    if data.has_token(token):
+        data.remove_token(token)
         return {
             'is_success': True,
         }
@@ -59,6 +52,7 @@ def auth_logout(token):
         'is_success': False,
     }
 
+@locks.users_writes
 def auth_register(email, password, name_first, name_last):
     """Registers the user if their emal isn't taken
     otherwise, return an error"""
@@ -69,9 +63,8 @@ def auth_register(email, password, name_first, name_last):
         raise InputError(description='Invalid email')
 
     # Input error if a user already has the given email
-    for user in data.users:
-        if email == user['email']:
-            raise InputError(description='Email already taken')
+    if data.get_user_by_email(email) is not None:
+        raise InputError(description='Email already taken')
 
     # Input error if the password is less than 6 characters long
     if len(password) < 6:
@@ -91,7 +84,7 @@ def auth_register(email, password, name_first, name_last):
     handle_str = handle_modify(handle_str)
 
     user = {
-        'u_id': len(data.users) + 1,
+        'u_id': data.count_users() + 1,
         'email': email,
         'name_first': name_first,
         'name_last': name_last,
@@ -104,13 +97,13 @@ def auth_register(email, password, name_first, name_last):
     token = jwt.encode({'u_id': user['u_id']}, data.SECRET,
                        algorithm='HS256').decode('utf-8')
 
-    data.tokens.append(token)
+    data.add_token(token)
 
     # Gives the first user global owner permissions
     if user['u_id'] == 1:
         user['permission_id'] = 1
 
-    data.users.append(user)
+    data.add_user(user)
 
     return {
         'u_id': user['u_id'],
@@ -120,60 +113,60 @@ def auth_register(email, password, name_first, name_last):
 def auth_passwordreset_request(email): # pragma: no cover
     '''Sends a reset code to the given email if valid'''
 
-    for user in data.users:
-        if email == user['email']:
-            # Generates a reset code that doesn't already exist
+    # The users are only locked while the code is stored, not while it is emailed
+    with locks.users_writing():
+        if data.get_user_by_email(email) is None:
+            return {}
+
+        # Generates a reset code that doesn't already exist
+        reset_code = ''.join(random.choices(string.ascii_letters + string.digits, k=20))
+        while data.get_reset_email(reset_code) is not None:
             reset_code = ''.join(random.choices(string.ascii_letters + string.digits, k=20))
-            while reset_code in data.reset_codes:
-                reset_code = ''.join(random.choices(string.ascii_letters + string.digits, k=20))
-
-            # Removes previous reset code for that user if unused
-            old_code = ''
-            for code in data.reset_codes:
-                if data.reset_codes[code] == email:
-                    old_code = code
-
-            if old_code != '':
-                del data.reset_codes[old_code]
-
-            # Stores the reset code
-            data.reset_codes[reset_code] = email
-
-            # Sends the email
-            port = 465
-            smtp_server = "smtp.gmail.com"
-            sender_email = "flockrtestuser@gmail.com"
-            receiver_email = email
-            password = "FlockrTestUser"
-            message = """\
+
+        # Removes previous reset code for that user if unused
+        old_code = data.find_reset_code(email)
+        if old_code is not None:
+            data.remove_reset_code(old_code)
+
+        # Stores the reset code
+        data.add_reset_code(reset_code, email)
+
+    # Sends the email
+    port = 465
+    smtp_server = "smtp.gmail.com"
+    sender_email = "flockrtestuser@gmail.com"
+    receiver_email = email
+    password = "FlockrTestUser"
+    message = """\
 Subject: Flockr Password Reset Code
 
 Your reset code is: """ + reset_code
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(sender_email, password)
-                server.sendmail(sender_email, receiver_email, message)
+    context = ssl.create_default_context()
+    with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
+        server.login(sender_email, password)
+        server.sendmail(sender_email, receiver_email, message)
 
     return {}
 
+@locks.users_writes
 def auth_passwordreset_reset(reset_code, new_password): # pragma: no cover
     '''Updates a user's password using the reset code they received'''
 
     # Checks that the new passowrd is valid and the reset code exists
-    if reset_code not in data.reset_codes:
+    email = data.get_reset_email(reset_code)
+    if email is None:
         raise InputError(description='Invalid reset code')
     
     if len(new_password) < 6:
         raise InputError(description='New password too short')
 
-    # Gets the email associated with the reset code and then removes the entry
-    email = data.reset_codes[reset_code]
-    del data.reset_codes[reset_code]
+    # Removes the reset code's entry
+    data.remove_reset_code(reset_code)
 
     # Updates the user's password
-    for user in data.users:
-        if email == user['email']:
-            user['password'] = new_password
+    user = data.get_user_by_email(email)
+    if user is not None:
+        data.update_user(user, {'password': new_password})
 
     return {}
 
@@ -183,16 +176,11 @@ def handle_modify(handle_str):
 
     # If the handle is taken, the last 1 or 2 characters are replaced with a number between 1 and 99
     # Starting at 1 and increasing each time a user is found with the new handle
-    while True:
-        initial = i
-        for user in data.users:
-            if user['handle_str'] == handle_str:
-                if i < 10:
-                    handle_str = handle_str[:19] + str(i)
-                else:
-                    handle_str = handle_str[:18] + str(i)
-                i = i + 1
-        if initial == i:
-            break
+    while data.get_user_by_handle(handle_str) is not None:
+        if i < 10:
+            handle_str = handle_str[:19] + str(i)
+        else:
+            handle_str = handle_str[:18] + str(i)
+        i = i + 1
 
     return handle_str
@@ -3,10 +3,24 @@
 Channel functions implementation
 '''
 
+import itertools
 import jwt
 import error
 import data
+import locks
+import search_index
+from message import view_message
 
+# Number of messages returned by channel_messages when no limit is given
+PAGE_SIZE = 50
+
+# Largest limit channel_messages accepts
+MAX_PAGE_SIZE = 200
+
+# Messages read at a time while streaming channel_messages_range
+STREAM_PAGE_SIZE = 500
+
+@locks.writes
 def channel_invite(token, channel_id, u_id):
     '''
     Invites a user (with user id u_id) to join a channel with ID channel_id.
@@ -17,28 +31,21 @@ def channel_invite(token, channel_id, u_id):
     check_token(token, channel_id)
 
     # Check if user is already in the channel
-    member_list = []
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            for member in channel['all_members']:
-                member_list.append(member['u_id'])
-    if u_id in member_list:
+    if data.is_member(channel_id, u_id):
         raise error.InputError(description='User is already a member of the channel')
 
     # Add given user to the given channel
-    for user in data.users:
-        if u_id == user['u_id']:
-            invited_user = user
+    invited_user = data.get_user(u_id)
+    channel = data.get_channel(channel_id)
 
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            channel['all_members'].append(invited_user)
-            if invited_user['permission_id'] == 1:
-                channel['owner_members'].append(invited_user)
+    data.add_member(channel, invited_user)
+    if invited_user['permission_id'] == 1:
+        data.add_owner(channel, invited_user)
 
     return {
     }
 
+@locks.reads
 def channel_details(token, channel_id):
     '''
     Given a Channel with ID channel_id that the authorised user is part of,
@@ -51,30 +58,29 @@ def channel_details(token, channel_id):
     check_token(token, channel_id)
 
     # Get details from data
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            name = channel['name']
-            for owner in channel['owner_members']:
-                o_detail = {}
-                o_detail['u_id'] = owner['u_id']
-                o_detail['name_first'] = owner['name_first']
-                o_detail['name_last'] = owner['name_last']
+    channel = data.get_channel(channel_id)
+    name = channel['name']
+    for owner in data.get_owners(channel):
+        o_detail = {}
+        o_detail['u_id'] = owner['u_id']
+        o_detail['name_first'] = owner['name_first']
+        o_detail['name_last'] = owner['name_last']
 
-                if 'profile_img_url' in owner: # pragma: no cover
-                    o_detail['profile_img_url'] = owner['profile_img_url']
+        if 'profile_img_url' in owner: # pragma: no cover
+            o_detail['profile_img_url'] = owner['profile_img_url']
 
-                owner_list.append(o_detail)
+        owner_list.append(o_detail)
 
-            for member in channel['all_members']:
-                m_detail = {}
-                m_detail['u_id'] = member['u_id']
-                m_detail['name_first'] = member['name_first']
-                m_detail['name_last'] = member['name_last']
+    for member in data.get_members(channel):
+        m_detail = {}
+        m_detail['u_id'] = member['u_id']
+        m_detail['name_first'] = member['name_first']
+        m_detail['name_last'] = member['name_last']
 
-                if 'profile_img_url' in member: # pragma: no cover
-                    m_detail['profile_img_url'] = member['profile_img_url']
+        if 'profile_img_url' in member: # pragma: no cover
+            m_detail['profile_img_url'] = member['profile_img_url']
 
-                member_list.append(m_detail)
+        member_list.append(m_detail)
 
     return {
         'name': name,
@@ -83,38 +89,55 @@ def channel_details(token, channel_id):
     }
 
 
-def channel_messages(token, channel_id, start):
+@locks.channel_reads
+def channel_messages(token, channel_id, start=0, limit=PAGE_SIZE, #pylint: disable=too-many-arguments
+                     before_message_id=None, after_message_id=None):
     '''
     Given a Channel with ID channel_id that the authorised user is part of,
-    return up to 50 messages between index "start" and "start + 50".
+    return up to "limit" (50 by default) messages between index "start"
+    and "start + limit", counting back from the most recent message.
+    Instead of "start", a page can be anchored to a message with
+    before_message_id (older messages) or after_message_id (newer messages),
+    which stays stable while new messages arrive.
     '''
     check_channel_id(channel_id)
     u_id = check_token(token, channel_id)
 
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise error.InputError(description=f'Limit must be between 1 and {MAX_PAGE_SIZE}')
+    if before_message_id is not None and after_message_id is not None:
+        raise error.InputError(description='Cannot page both before and after a message')
+
     # Get messages from the given channel
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            messages_list = channel['messages']
+    channel = data.get_channel(channel_id)
+    total = data.count_messages(channel)
+
+    # Turn a cursor into the index counted back from the most recent message
+    stop = None
+    if before_message_id is not None:
+        start = total - find_message_position(channel, before_message_id)
+    elif after_message_id is not None:
+        stop = total - 1 - find_message_position(channel, after_message_id)
+        start = max(stop - limit, 0)
 
     # Check if start value is valid
-    if start > len(messages_list):
+    if start > total:
         raise error.InputError(description='Start is greater than total number of messages')
 
-    end = start + 50
-    stop = start + 50
-    if end > len(messages_list):
-        end = -1
-        stop = len(messages_list)
-
-    # Return messages within the range in chronological order
-    reversed_messages = messages_list[::-1]
-    return_messages = []
-    for i in range(start, stop):
-        return_messages.append(reversed_messages[i])
+    end = start + limit
+    if stop is not None:
+        end = stop
+    else:
+        stop = min(start + limit, total)
+        if end > total:
+            end = -1
 
-    # Set up 'is_user_reacted' key in each message
-    for msg in return_messages:
-        set_if_reacted(msg['reacts'], u_id)
+    # Return messages within the range, most recent first, reading only that
+    # range of the channel's messages
+    # Each message is copied with the 'is_this_user_reacted' key for this user
+    page = list(data.iter_channel_messages(channel, total - stop, total - start))
+    page.reverse()
+    return_messages = [view_message(msg, u_id) for msg in page]
 
     return {
         'messages': return_messages,
@@ -122,6 +145,52 @@ def channel_messages(token, channel_id, start):
         'end': end,
     }
 
+@locks.channel_reads
+def channel_messages_range(token, channel_id, time_start, time_end):
+    '''
+    Given a Channel with ID channel_id that the authorised user is part of,
+    return every message created between time_start and time_end inclusive,
+    oldest first
+    '''
+    return {
+        'messages': list(iter_messages_range(token, channel_id, time_start, time_end)),
+    }
+
+@locks.channel_reads
+def iter_messages_range(token, channel_id, time_start, time_end):
+    '''
+    Checks the arguments of channel_messages_range, then returns a generator
+    over the matching messages so they can be streamed, read a page at a time.
+    The range is found by binary search over the channel's message times,
+    or through the index on message times with the SQLite backend.
+    '''
+    check_channel_id(channel_id)
+    u_id = check_token(token, channel_id)
+
+    if time_start > time_end:
+        raise error.InputError(description='Time start is after time end')
+
+    def generate():
+        # The lock is only held while reading each page, so a slow client
+        # doesn't hold up writes, and each page starts after the last one
+        after = None
+        while True:
+            with locks.channel_reading([channel_id]):
+                channel = data.get_channel(channel_id)
+                if channel is None:
+                    return
+                page = list(itertools.islice(
+                    data.iter_messages_between(channel, time_start, time_end, after),
+                    STREAM_PAGE_SIZE))
+                views = [view_message(msg, u_id) for msg in page]
+            yield from views
+            if len(page) < STREAM_PAGE_SIZE:
+                return
+            after = data.message_key(page[-1])
+
+    return generate()
+
+@locks.writes
 def channel_leave(token, channel_id):
     '''
     User leaves the channel
@@ -129,35 +198,27 @@ def channel_leave(token, channel_id):
 
     detail = find_channel(channel_id)
     valid_user = find_user(token)
-    channel_members = check_member(valid_user['u_id'], detail)
 
-    if not channel_members:
+    if not check_member(valid_user['u_id'], detail):
         raise error.AccessError('User is not a member of this channel')
 
-    channel_owners = check_owner(valid_user['u_id'], detail)
-    if not channel_owners:
-        channel_members = remove_member(valid_user['u_id'], channel_members)
-        detail['all_members'] = channel_members
+    if not check_owner(valid_user['u_id'], detail):
+        data.remove_member(detail, valid_user['u_id'])
 
     else:
-        owner_count = len(channel_owners)
+        owner_count = len(data.get_owners(detail))
 
         if owner_count == 1:
             delete_entire_channel(channel_id)
 
         else:
-            channel_owners = remove_owner(valid_user['u_id'], channel_owners)
-            detail['owner_members'] = channel_owners
-            channel_members = remove_member(valid_user['u_id'], channel_members)
-            detail['all_members'] = channel_members
-
-        for channel in data.channels:
-            if channel['channel_id'] == channel_id:
-                channel = detail
+            data.remove_owner(detail, valid_user['u_id'])
+            data.remove_member(detail, valid_user['u_id'])
 
     return {
     }
 
+@locks.writes
 def channel_join(token, channel_id):
     '''
     Join a channel
@@ -169,19 +230,14 @@ def channel_join(token, channel_id):
 
     user = find_user(token)
 
-    for keys in detail:
-        if keys == 'all_members':
-            detail['all_members'].append(user)
-        elif keys == 'owner_members' and user['permission_id'] == 1:
-            detail['owner_members'].append(user)
-
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
+    data.add_member(detail, user)
+    if user['permission_id'] == 1:
+        data.add_owner(detail, user)
 
     return {
     }
 
+@locks.writes
 def channel_addowner(token, channel_id, u_id):
     '''
     Add another owner to channel
@@ -189,35 +245,24 @@ def channel_addowner(token, channel_id, u_id):
     detail = find_channel(channel_id)
 
     valid_user = find_user(token)
-    channel_owners = check_owner(valid_user['u_id'], detail)
 
-    if not channel_owners:
+    if not check_owner(valid_user['u_id'], detail):
         raise error.AccessError('User does not have owner access')
 
     #confirm  u_id is not already owner
-    for owner in channel_owners:
-        if owner['u_id'] == u_id:
-            raise error.InputError('User is already an owner')
+    if check_owner(u_id, detail):
+        raise error.InputError('User is already an owner')
 
     user = find_user_u_id(u_id)
     user = user.copy()
 
-    if not check_member(user['u_id'], detail):
-        for keys in detail:
-            if keys == 'all_members':
-                detail['all_members'].append(user)
-
-    for keys in detail:
-        if keys == 'owner_members':
-            detail['owner_members'].append(user)
-
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
+    data.add_member(detail, user)
+    data.add_owner(detail, user)
 
     return {
     }
 
+@locks.writes
 def channel_removeowner(token, channel_id, u_id):
     '''
     Remove another owner from channel
@@ -229,21 +274,14 @@ def channel_removeowner(token, channel_id, u_id):
         raise error.AccessError('Cannot remove global owner')
 
     valid_user = find_user(token)
-    channel_owners = check_owner(valid_user['u_id'], detail)
-    if not channel_owners:
+    if not check_owner(valid_user['u_id'], detail):
         raise error.AccessError('User does not have owner access')
 
     #Checks if removing user is a valid owner
-    channel_owners = check_owner(remove_user['u_id'], detail)
-    if not channel_owners:
+    if not check_owner(remove_user['u_id'], detail):
         raise error.InputError('User is not an owner')
 
-    channel_owners = remove_owner(remove_user['u_id'], channel_owners)
-    detail['owner_members'] = channel_owners
-
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
+    data.remove_owner(detail, remove_user['u_id'])
 
     return {
     }
@@ -253,133 +291,95 @@ def find_channel(channel_id):
     '''
     Check if channel exist
     '''
-    if not data.channels:
+    if not data.count_channels():
         raise error.InputError(description="No channel has been created")
 
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            return channel
+    channel = data.get_channel(channel_id)
+    if channel is None:
+        raise error.InputError(description="Channel ID is not valid")
 
-    raise error.InputError(description="Channel ID is not valid")
+    return channel
 
 def find_user(token):
     '''
     Check if user exist through their token
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise error.AccessError(description='Invalid token')
 
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
     u_id = decoded_info['u_id']
 
-    for user in data.users:
-        if user['u_id'] == u_id:
-            associated_user = user
-    return associated_user
+    return data.get_user(u_id)
 
 def find_user_u_id(u_id):
     '''
     Check if user exist through their u_id
     '''
-    for user in data.users:
-        if user['u_id'] == u_id:
-            return user
+    user = data.get_user(u_id)
+    if user is None:
+        raise error.InputError('Invalid user ID')
 
-    raise error.InputError('Invalid user ID')
+    return user
 
 def check_member(u_id, channel_fulldetail):
     '''
     Check if user is a member of channel
     '''
-    for key in channel_fulldetail['all_members']:
-        if key['u_id'] == u_id:
-            return channel_fulldetail['all_members']
-
-    return False
+    return data.is_member(channel_fulldetail['channel_id'], u_id)
 
 def check_owner(u_id, channel_fulldetail):
     '''
     Check if user is an owner of channel
     '''
-    for key in channel_fulldetail['owner_members']:
-        if key['u_id'] == u_id:
-            return channel_fulldetail['owner_members']
-
-    return False
+    return data.is_owner(channel_fulldetail['channel_id'], u_id)
 
-def remove_member(u_id, channel_members):
+@locks.writes
+def delete_entire_channel(channel_id):
     '''
-    Remove a member from a channel
+    Delete a channel with given channel_id
     '''
-    for member in channel_members:
-        if member["u_id"] == u_id:
-            channel_members.remove(member)
-    return channel_members
+    chan = data.get_channel(channel_id)
+    if chan is not None:
+        search_index.forget_channel(chan)
+        data.remove_channel(chan)
 
-def remove_owner(u_id, channel_owners):
+def find_message_position(channel, message_id):
     '''
-    Remove an owner from a channel
+    Returns the index of a message within its channel's message list
     '''
-    for owner in channel_owners:
-        if owner["u_id"] == u_id:
-            channel_owners.remove(owner)
-    return channel_owners
+    msg_channel, msg = data.get_message(message_id)
+    if msg is None or msg_channel['channel_id'] != channel['channel_id']:
+        raise error.InputError(description='Message is not in this channel')
 
-def delete_entire_channel(channel_id):
-    '''
-    Delete a channel with given channel_id
-    '''
-    for chan in data.channels:
-        if chan['channel_id'] == channel_id:
-            data.channels.remove(chan)
+    return data.message_position(channel, msg)
 
 def check_channel_id(channel_id):
     '''
     Check if channel_id is valid
     '''
-    c_id_list = []
-    for channel in data.channels:
-        c_id_list.append(channel['channel_id'])
-    if channel_id not in c_id_list:
+    if data.get_channel(channel_id) is None:
         raise error.InputError(description='Wrong channel_id')
 
 def check_user_id(u_id):
     '''
     Check if user_id is valid
     '''
-    u_id_list = []
-    for user in data.users:
-        u_id_list.append(user['u_id'])
-    if u_id not in u_id_list:
+    if data.get_user(u_id) is None:
         raise error.InputError(description='Wrong user_id')
 
 def check_token(token, channel_id):
     '''
     Check if token is a valid user, return the associated u_id
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise error.AccessError(description='Invalid token')
 
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
     u_id = decoded_info['u_id']
 
-    member_list = []
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            for member in channel['all_members']:
-                member_list.append(member['u_id'])
-    if u_id not in member_list:
+    if not data.is_member(channel_id, u_id):
         raise error.AccessError(description=\
         'You must be a member of the channel to view its details')
 
     return u_id
-
-def set_if_reacted(all_reacts, u_id):
-    '''
-    Checks if the given user has reacted to the given message
-    '''
-    for react in all_reacts:
-        if u_id in react['u_ids']:
-            react['is_this_user_reacted'] = True
-        else:
-            react['is_this_user_reacted'] = False
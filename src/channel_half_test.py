@@ -402,6 +402,95 @@ def test_more_than_50_messages():
     assert msg_list['start'] == 0
     assert msg_list['end'] == 50
 
+def test_channel_messages_limit():
+    '''
+    Tests for a custom page size in channel_messages
+    '''
+    clear()
+    token1, _, _, _, _, _, c_id1, _ = add_channel_info()
+
+    m_ids = []
+    for num_msg in range(10):
+        m_ids.append(message.message_send(token1, c_id1, str(num_msg))['message_id'])
+
+    msg_list = channel.channel_messages(token1, c_id1, 2, limit=3)
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[7:4:-1]
+    assert msg_list['start'] == 2
+    assert msg_list['end'] == 5
+
+    msg_list = channel.channel_messages(token1, c_id1, 8, limit=3)
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[1::-1]
+    assert msg_list['end'] == -1
+
+    with pytest.raises(error.InputError):
+        channel.channel_messages(token1, c_id1, 0, limit=0)
+    with pytest.raises(error.InputError):
+        channel.channel_messages(token1, c_id1, 0, limit=channel.MAX_PAGE_SIZE + 1)
+
+def test_channel_messages_cursor():
+    '''
+    Tests that before_message_id and after_message_id pages stay
+    stable while new messages arrive
+    '''
+    clear()
+    token1, token2, _, _, _, _, c_id1, c_id2 = add_channel_info()
+
+    m_ids = []
+    for num_msg in range(10):
+        m_ids.append(message.message_send(token1, c_id1, str(num_msg))['message_id'])
+
+    msg_list = channel.channel_messages(token1, c_id1, limit=3, before_message_id=m_ids[5])
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[4:1:-1]
+
+    # new messages don't shift a cursor page
+    message.message_send(token1, c_id1, 'new')
+    msg_list = channel.channel_messages(token1, c_id1, limit=3, before_message_id=m_ids[5])
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[4:1:-1]
+    assert msg_list['end'] == msg_list['start'] + 3
+
+    msg_list = channel.channel_messages(token1, c_id1, limit=3, before_message_id=m_ids[1])
+    assert [msg['message_id'] for msg in msg_list['messages']] == [m_ids[0]]
+    assert msg_list['end'] == -1
+
+    # after_message_id returns the messages right after the cursor, most recent first
+    msg_list = channel.channel_messages(token1, c_id1, limit=3, after_message_id=m_ids[2])
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[5:2:-1]
+    msg_list = channel.channel_messages(token1, c_id1, after_message_id=m_ids[9])
+    assert len(msg_list['messages']) == 1
+    assert msg_list['messages'][0]['message'] == 'new'
+
+    m_id_other = message.message_send(token2, c_id2, 'other')['message_id']
+    with pytest.raises(error.InputError):
+        channel.channel_messages(token1, c_id1, before_message_id=m_id_other)
+    with pytest.raises(error.InputError):
+        channel.channel_messages(token1, c_id1, before_message_id=m_ids[1],
+                                 after_message_id=m_ids[0])
+
+def test_channel_messages_range():
+    '''
+    Tests for messages between two times in channel_messages_range
+    '''
+    clear()
+    token1, token2, _, _, _, _, c_id1, _ = add_channel_info()
+
+    m_ids = []
+    for num_msg in range(6):
+        m_ids.append(message.message_send(token1, c_id1, str(num_msg))['message_id'])
+    times = [data.get_message(m_id)[1]['time_created'] for m_id in m_ids]
+
+    msg_list = channel.channel_messages_range(token1, c_id1, times[1], times[3])
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids[1:4]
+
+    msg_list = channel.channel_messages_range(token1, c_id1, times[5] + 1, times[5] + 2)
+    assert msg_list == {'messages': []}
+    msg_list = channel.channel_messages_range(token1, c_id1, 0, times[5])
+    assert [msg['message_id'] for msg in msg_list['messages']] == m_ids
+
+    with pytest.raises(error.InputError):
+        channel.channel_messages_range(token1, c_id1, times[3], times[1])
+    with pytest.raises(error.AccessError):
+        channel.channel_messages_range(token2, c_id1, times[1], times[3])
+
 def add_channel_info():
     '''
     Functions to register and login users
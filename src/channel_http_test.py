@@ -331,3 +331,62 @@ def test_channel_invalid_inputs(url):
     'channel_id' : channel_id['channel_id'], 'u_id' : u3payload['u_id']}
     res = requests.post(url + 'channel/addowner', json=channel_addowner)
     assert res.status_code == 400
+
+def test_channel_messages_cursor(url):
+    '''
+    Tests paging channel messages with a limit and a before_message_id cursor
+    '''
+    user1 = {'email' : 'anna@gmail.com', 'password' : 'annabanana', \
+    'name_first' : 'Anna', 'name_last' : 'Banana'}
+    u1payload = requests.post(url + 'auth/register', json=user1).json()
+
+    channel1 = {'token' : u1payload['token'], 'name' : 'Fruit Gang!', \
+    'is_public' : True}
+    channel_id = requests.post(url + 'channels/create', json=channel1).json()['channel_id']
+
+    m_ids = []
+    for num_msg in range(5):
+        msg = {'token' : u1payload['token'], 'channel_id' : channel_id, \
+        'message' : str(num_msg)}
+        m_ids.append(requests.post(url + 'message/send', json=msg).json()['message_id'])
+
+    page = {'token' : u1payload['token'], 'channel_id' : channel_id, \
+    'limit' : 2, 'before_message_id' : m_ids[3]}
+    res = requests.get(url + 'channel/messages', params=page)
+    assert res.status_code == 200
+    assert [msg['message_id'] for msg in res.json()['messages']] == [m_ids[2], m_ids[1]]
+
+    page = {'token' : u1payload['token'], 'channel_id' : channel_id, \
+    'limit' : 0}
+    res = requests.get(url + 'channel/messages', params=page)
+    assert res.status_code == 400
+
+def test_channel_messages_range(url):
+    '''
+    Tests streaming the messages sent between two times
+    '''
+    user1 = {'email' : 'anna@gmail.com', 'password' : 'annabanana', \
+    'name_first' : 'Anna', 'name_last' : 'Banana'}
+    u1payload = requests.post(url + 'auth/register', json=user1).json()
+
+    channel1 = {'token' : u1payload['token'], 'name' : 'Fruit Gang!', \
+    'is_public' : True}
+    channel_id = requests.post(url + 'channels/create', json=channel1).json()['channel_id']
+
+    for num_msg in range(3):
+        msg = {'token' : u1payload['token'], 'channel_id' : channel_id, \
+        'message' : str(num_msg)}
+        requests.post(url + 'message/send', json=msg)
+
+    page = {'token' : u1payload['token'], 'channel_id' : channel_id, 'start' : 0}
+    msgs = requests.get(url + 'channel/messages', params=page).json()['messages']
+
+    time_range = {'token' : u1payload['token'], 'channel_id' : channel_id, \
+    'time_start' : msgs[1]['time_created'], 'time_end' : msgs[0]['time_created']}
+    res = requests.get(url + 'channel/messages/range', params=time_range)
+    assert res.status_code == 200
+    assert [msg['message'] for msg in res.json()['messages']] == ['1', '2']
+
+    time_range['time_start'] = msgs[0]['time_created'] + 1
+    res = requests.get(url + 'channel/messages/range', params=time_range)
+    assert res.status_code == 400
@@ -4,8 +4,10 @@ Channels functions implementation
 
 import jwt
 import data
+import locks
 import error
 
+@locks.reads
 def channels_list(token):
     '''
     Provide a list of all channels (and their associated details)
@@ -14,23 +16,20 @@ def channels_list(token):
     u_id = check_token(token)
 
     return_list = []
-    for channel in data.channels:
-        member_list = []
-        for member in channel['all_members']:
-            member_list.append(member['u_id'])
-
-        if u_id in member_list:
-            return_list.append(
-                {
-                    'channel_id': channel['channel_id'],
-                    'name': channel['name']
-                }
-            )
+    for channel_id in sorted(data.get_user_channels(u_id)):
+        channel = data.get_channel(channel_id)
+        return_list.append(
+            {
+                'channel_id': channel['channel_id'],
+                'name': channel['name']
+            }
+        )
 
     return {
         'channels': return_list,
     }
 
+@locks.reads
 def channels_listall(token):
     '''
     Provide a list of all channels (and their associated details)
@@ -38,7 +37,7 @@ def channels_listall(token):
     check_token(token)
     return_list = []
 
-    for channel in data.channels:
+    for channel in data.iter_channels():
         return_list.append(
             {
                 'channel_id': channel['channel_id'],
@@ -50,6 +49,7 @@ def channels_listall(token):
         'channels': return_list,
     }
 
+@locks.writes
 def channels_create(token, name, is_public):
     '''
     Creates a new channel with that name that is either a public or private channel
@@ -58,12 +58,12 @@ def channels_create(token, name, is_public):
     if len(name) > 20:
         raise error.InputError(description='Name is more than 20 characters long')
 
-    for user in data.users:
-        if u_id == user['u_id']:
-            creator = user
+    creator = data.get_user(u_id)
+
+    new_channel_id = data.new_channel_id()
 
     new_channel = {
-        'channel_id' : len(data.channels) + 1,
+        'channel_id' : new_channel_id,
         'name' : name,
         'is_public': is_public,
         'owner_members' : [
@@ -75,10 +75,10 @@ def channels_create(token, name, is_public):
         'messages': []
     }
 
-    data.channels.append(new_channel)
+    data.add_channel(new_channel)
 
     return {
-        'channel_id': len(data.channels),
+        'channel_id': new_channel_id,
     }
 
 def check_token(token):
@@ -86,7 +86,7 @@ def check_token(token):
     Checks if a given token is valid, returns the associated u_id if valid
     '''
 
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise error.AccessError(description='Invalid token')
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
     return decoded_info['u_id']
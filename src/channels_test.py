@@ -328,6 +328,36 @@ def test_unjoined_channels():
         ],
     }
 
+def test_channels_list_after_leave():
+    '''
+    Tests that channels_list follows leaving and that deleted channel_ids aren't reused
+    '''
+    clear()
+    token1, token2, _, _ = add_user_info()
+
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(token2, 'channel2', True)['channel_id']
+    channel.channel_join(token1, c_id2)
+    assert [chan['channel_id'] for chan in channels.channels_list(token1)['channels']] == \
+        [c_id1, c_id2]
+
+    channel.channel_leave(token1, c_id2)
+    assert channels.channels_list(token1) == {
+        'channels': [
+            {
+                'channel_id': c_id1,
+                'name': 'channel1'
+            },
+        ],
+    }
+
+    # the last owner leaving deletes channel1, a new channel gets a fresh id
+    channel.channel_leave(token1, c_id1)
+    assert channels.channels_list(token1) == {'channels': []}
+    c_id3 = channels.channels_create(token1, 'channel3', True)['channel_id']
+    assert c_id3 not in (c_id1, c_id2)
+    assert channel.channel_details(token2, c_id2)['name'] == 'channel2'
+
 def test_invalid_token():
     '''
     Tests for invalid tokens
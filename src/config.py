@@ -0,0 +1,59 @@
+'''
+Deployment settings, read from environment variables when the server starts
+'''
+
+import os
+
+# File the message_sendlater queue is logged to so that scheduled messages
+# survive a restart, the queue is only kept in memory when this is unset
+SCHEDULE_LOG = os.environ.get('FLOCKR_SCHEDULE_LOG')
+
+# Number of worker processes searches that can't use the index are split
+# across, searches stay in the server process when this is 0
+SEARCH_WORKERS = int(os.environ.get('FLOCKR_SEARCH_WORKERS', '0'))
+
+# Backend users, channels and messages are stored in, "memory" to keep them
+# in memory (made durable by WAL_PATH) or "sqlite" to keep them in the SQLite
+# database at STORAGE_DB
+STORAGE_BACKEND = os.environ.get('FLOCKR_STORAGE', 'memory')
+STORAGE_DB = os.environ.get('FLOCKR_STORAGE_DB', 'flockr.db')
+
+# Engine searches are served by, "memory" for the indexes in search_index or
+# "fts5" for an SQLite full text table mirrored from message writes, which
+# returns searches without a limit best match first. The memory indexes keep
+# a copy of every message's text, so fts5 is the default with the sqlite
+# storage backend
+SEARCH_ENGINE = os.environ.get('FLOCKR_SEARCH_ENGINE',
+                               'fts5' if STORAGE_BACKEND == 'sqlite' else 'memory')
+
+# SQLite database the fts5 engine keeps its table in, the storage database
+# with the sqlite storage backend and in memory otherwise
+SEARCH_DB = os.environ.get('FLOCKR_SEARCH_DB', STORAGE_DB if STORAGE_BACKEND == 'sqlite'
+                           else 'file:flockr-search?mode=memory&cache=shared')
+
+# Write-ahead log every change to users, channels and messages is appended to,
+# and replayed from when the server starts. State is only kept in memory when
+# this is unset
+WAL_PATH = os.environ.get('FLOCKR_WAL')
+
+# When the write-ahead log is synced to disk, "always" after every change,
+# "interval" every WAL_FSYNC_INTERVAL_MS milliseconds or "off" to never sync
+WAL_FSYNC = os.environ.get('FLOCKR_WAL_FSYNC', 'interval')
+WAL_FSYNC_INTERVAL_MS = int(os.environ.get('FLOCKR_WAL_FSYNC_INTERVAL_MS', '50'))
+
+# File the whole state is snapshotted to every SNAPSHOT_INTERVAL seconds, so
+# startup only replays the write-ahead log written since. Only used along
+# with WAL_PATH
+SNAPSHOT_PATH = os.environ.get('FLOCKR_SNAPSHOT')
+SNAPSHOT_INTERVAL = float(os.environ.get('FLOCKR_SNAPSHOT_INTERVAL', '300'))
+
+# Write-ahead log of a primary server to follow. When set, this server is a
+# read-only follower that applies what the primary logs to its own state,
+# checking the log for new records every FOLLOW_INTERVAL_MS milliseconds and
+# starting from the primary's snapshot at SNAPSHOT_PATH if it is set
+FOLLOW_WAL = os.environ.get('FLOCKR_FOLLOW')
+FOLLOW_INTERVAL_MS = int(os.environ.get('FLOCKR_FOLLOW_INTERVAL_MS', '20'))
+
+# "fork" to write periodic snapshots from a forked child while the server
+# keeps handling requests, or "inline" to write them from the server process
+SNAPSHOT_MODE = os.environ.get('FLOCKR_SNAPSHOT_MODE', 'fork' if hasattr(os, 'fork') else 'inline')
@@ -1,9 +1,22 @@
-'''secret for jwt encoding'''
+'''
+Internal data of the application: users, channels and messages along with
+the ids and tokens handed out, served from memory or from storage_sqlite
+'''
+
+import bisect
+import threading
+import storage_sqlite
+import wal
+
+# secret for jwt encoding
 SECRET = 'ballast'
 
 '''variable for generating message_ids in message_send and message_sendlater'''
 MAX_MESSAGE_ID = 0
 
+'''variable for generating channel_ids in channels_create'''
+MAX_CHANNEL_ID = 0
+
 '''
 user = {}
 
@@ -44,6 +57,93 @@ users = [
 
 '''
 
+users_by_id = {}
+users_by_email = {}
+users_by_handle = {}
+'''
+Indexes over users so lookups don't scan the whole list.
+Each maps to the same user dict that is stored in users.
+
+users_by_id = {1: user}
+users_by_email = {'test@gmail.com': user}
+users_by_handle = {'haydenjacobs': user}
+'''
+
+def add_user(user):
+    '''
+    Stores a new user and adds it to every user index
+    '''
+    with wal.record(['add_user', user]):
+        users.append(user)
+        users_by_id[user['u_id']] = user
+        users_by_email[user['email']] = user
+        users_by_handle[user['handle_str']] = user
+
+def get_user(u_id):
+    '''
+    Returns the user with the given u_id, or None
+    '''
+    return users_by_id.get(u_id)
+
+def get_user_by_email(email):
+    '''
+    Returns the user with the given email, or None
+    '''
+    return users_by_email.get(email)
+
+def get_user_by_handle(handle_str):
+    '''
+    Returns the user with the given handle, or None
+    '''
+    return users_by_handle.get(handle_str)
+
+def update_user(user, changes):
+    '''
+    Changes some of a user's details, keeping the email and handle indexes
+    consistent
+    '''
+    with wal.record(['update_user', user['u_id'], changes]):
+        if 'email' in changes and users_by_email.get(user['email']) is user:
+            del users_by_email[user['email']]
+        if 'handle_str' in changes and users_by_handle.get(user['handle_str']) is user:
+            del users_by_handle[user['handle_str']]
+        user.update(changes)
+        users_by_email[user['email']] = user
+        users_by_handle[user['handle_str']] = user
+
+def set_user_email(user, email):
+    '''
+    Changes a user's email, keeping the email index consistent
+    '''
+    update_user(user, {'email': email})
+
+def set_user_handle(user, handle_str):
+    '''
+    Changes a user's handle, keeping the handle index consistent
+    '''
+    update_user(user, {'handle_str': handle_str})
+
+def count_users():
+    '''
+    Returns the number of registered users
+    '''
+    return len(users)
+
+def iter_users():
+    '''
+    Yields every user in the order they registered
+    '''
+    yield from users
+
+def clear_users():
+    '''
+    Removes every user and empties the user indexes
+    '''
+    users.clear()
+    users_by_id.clear()
+    users_by_email.clear()
+    users_by_handle.clear()
+
 channels = []
 '''
 [
@@ -168,14 +268,403 @@ channels = []
 ]
 '''
 
-tokens = []
+channels_by_id = {}
+channel_members = {}
+channel_owners = {}
+user_channels = {}
 '''
-[
+Membership indexes kept in both directions so membership checks and
+channels_list don't scan member lists.
+
+channels_by_id = {1: channel}
+channel_members = {1: {1, 2}}
+channel_owners = {1: {1}}
+user_channels = {1: {1}, 2: {1}}
+'''
+
+channel_versions = {}
+membership_versions = {}
+'''
+Counters for caching search results.
+channel_versions is bumped whenever a message in that channel is added,
+edited or removed, membership_versions whenever that user joins or leaves
+a channel.
+
+channel_versions = {1: 3}
+membership_versions = {1: 2, 2: 1}
+'''
+
+def bump_membership(u_id):
+    '''
+    Records that the set of channels a user is a member of has changed
+    '''
+    membership_versions[u_id] = membership_versions.get(u_id, 0) + 1
+
+def add_channel(channel):
+    '''
+    Stores a new channel and indexes its initial members and owners
+    '''
+    channel_id = channel['channel_id']
+    logged = {
+        'channel_id': channel_id,
+        'name': channel['name'],
+        'is_public': channel['is_public'],
+        'owner_members': [owner['u_id'] for owner in channel['owner_members']],
+        'all_members': [member['u_id'] for member in channel['all_members']],
+    }
+    with wal.record(['add_channel', logged]):
+        channels.append(channel)
+        channels_by_id[channel_id] = channel
+        channel_members[channel_id] = set()
+        channel_owners[channel_id] = set()
+        for member in channel['all_members']:
+            channel_members[channel_id].add(member['u_id'])
+            user_channels.setdefault(member['u_id'], set()).add(channel_id)
+            bump_membership(member['u_id'])
+        for owner in channel['owner_members']:
+            channel_owners[channel_id].add(owner['u_id'])
+        message_keys[channel_id] = [message_key(message) for message in channel['messages']]
+
+def get_channel(channel_id):
+    '''
+    Returns the channel with the given channel_id, or None
+    '''
+    return channels_by_id.get(channel_id)
+
+def count_channels():
+    '''
+    Returns the number of channels
+    '''
+    return len(channels)
+
+def iter_channels():
+    '''
+    Yields every channel in the order they were created
+    '''
+    yield from channels
+
+def new_channel_id():
+    '''
+    Returns an unused channel_id for a new channel
+    '''
+    global MAX_CHANNEL_ID # pylint: disable=global-statement
+    MAX_CHANNEL_ID += 1
+    return MAX_CHANNEL_ID
+
+def get_user_channels(u_id):
+    '''
+    Returns the set of channel_ids the user is a member of
+    '''
+    return user_channels.get(u_id, set())
+
+def is_member(channel_id, u_id):
+    '''
+    Checks if the user is a member of the channel
+    '''
+    return u_id in channel_members.get(channel_id, ())
+
+def is_owner(channel_id, u_id):
+    '''
+    Checks if the user is an owner of the channel
+    '''
+    return u_id in channel_owners.get(channel_id, ())
+
+def get_members(channel):
+    '''
+    Returns the users who are members of a channel, in the order they joined
+    '''
+    return channel['all_members']
+
+def get_owners(channel):
+    '''
+    Returns the users who are owners of a channel, in the order they became one
+    '''
+    return channel['owner_members']
+
+def add_member(channel, user):
+    '''
+    Adds a user to a channel's members, doing nothing if they already are one
+    '''
+    channel_id = channel['channel_id']
+    if user['u_id'] in channel_members[channel_id]:
+        return
+    with wal.record(['add_member', channel_id, user['u_id']]):
+        channel['all_members'].append(user)
+        channel_members[channel_id].add(user['u_id'])
+        user_channels.setdefault(user['u_id'], set()).add(channel_id)
+        bump_membership(user['u_id'])
+
+def add_owner(channel, user):
+    '''
+    Adds a user to a channel's owners, doing nothing if they already are one
+    '''
+    channel_id = channel['channel_id']
+    if user['u_id'] in channel_owners[channel_id]:
+        return
+    with wal.record(['add_owner', channel_id, user['u_id']]):
+        channel['owner_members'].append(user)
+        channel_owners[channel_id].add(user['u_id'])
+
+def remove_member(channel, u_id):
+    '''
+    Removes a user from a channel's members
+    '''
+    channel_id = channel['channel_id']
+    with wal.record(['remove_member', channel_id, u_id]):
+        channel['all_members'][:] = [member for member in channel['all_members']
+                                     if member['u_id'] != u_id]
+        channel_members[channel_id].discard(u_id)
+        user_channels.get(u_id, set()).discard(channel_id)
+        bump_membership(u_id)
+
+def remove_owner(channel, u_id):
+    '''
+    Removes a user from a channel's owners
+    '''
+    with wal.record(['remove_owner', channel['channel_id'], u_id]):
+        channel['owner_members'][:] = [owner for owner in channel['owner_members']
+                                       if owner['u_id'] != u_id]
+        channel_owners[channel['channel_id']].discard(u_id)
+
+def remove_channel(channel):
+    '''
+    Deletes a channel along with its messages and membership entries
+    '''
+    channel_id = channel['channel_id']
+    with wal.record(['remove_channel', channel_id]):
+        forget_channel_messages(channel)
+        channels.remove(channel)
+        del channels_by_id[channel_id]
+        for u_id in channel_members.pop(channel_id):
+            user_channels[u_id].discard(channel_id)
+            bump_membership(u_id)
+        del channel_owners[channel_id]
+        del message_keys[channel_id]
+        channel_versions.pop(channel_id, None)
+
+def clear_channels():
+    '''
+    Removes every channel and empties the channel and message indexes
+    '''
+    global MAX_CHANNEL_ID # pylint: disable=global-statement
+    channels.clear()
+    channels_by_id.clear()
+    channel_members.clear()
+    channel_owners.clear()
+    user_channels.clear()
+    messages_by_id.clear()
+    message_keys.clear()
+    channel_versions.clear()
+    membership_versions.clear()
+    MAX_CHANNEL_ID = 0
+
+messages_by_id = {}
+'''
+Locator index from message_id to the channel holding it and the message itself,
+so a message can be found without scanning every channel.
+
+messages_by_id = {
+    1: (channel, message),
+}
+'''
+
+message_keys = {}
+'''
+Sort keys of each channel's messages, parallel to channel['messages'].
+Messages are kept ordered by (time_created, message_id), so a message sent
+with message_sendlater lands in its place in time even if it arrives after
+newer messages, and positions can be found with a binary search.
+
+message_keys = {
+    1: [(12345677, 1), (12345678, 2), (12345679, 3)],
+}
+'''
+
+# Held while handing out message_ids, as messages are sent to different
+# channels at the same time
+ids_lock = threading.Lock()
+
+def new_message_id():
+    '''
+    Returns an unused message_id for a new message
+    '''
+    global MAX_MESSAGE_ID # pylint: disable=global-statement
+    with ids_lock:
+        MAX_MESSAGE_ID += 1
+        return MAX_MESSAGE_ID
+
+def reserve_message_id(message_id):
+    '''
+    Keeps new_message_id from handing out a message_id that is already used
+    '''
+    global MAX_MESSAGE_ID # pylint: disable=global-statement
+    with ids_lock:
+        MAX_MESSAGE_ID = max(MAX_MESSAGE_ID, message_id)
+
+def message_key(message):
+    '''
+    Returns the key channel messages are ordered by
+    '''
+    return (message['time_created'], message['message_id'])
+
+def add_message(channel, message):
+    '''
+    Inserts a message into a channel in time order and records where it lives
+    '''
+    with wal.record(['add_message', channel['channel_id'], message]):
+        keys = message_keys[channel['channel_id']]
+        key = message_key(message)
+        if not keys or keys[-1] <= key:
+            keys.append(key)
+            channel['messages'].append(message)
+        else:
+            position = bisect.bisect_right(keys, key)
+            keys.insert(position, key)
+            channel['messages'].insert(position, message)
+        messages_by_id[message['message_id']] = (channel, message)
+        bump_version(channel['channel_id'])
+
+def update_message(message, changes):
+    '''
+    Changes some fields of a message, such as its text or whether it is pinned
+    '''
+    with wal.record(['update_message', message['message_id'], changes]):
+        message.update(changes)
+        if 'message' in changes:
+            bump_version(messages_by_id[message['message_id']][0]['channel_id'])
+
+def add_react(message, react_id, u_id):
+    '''
+    Records that a user reacted to a message
+    '''
+    with wal.record(['add_react', message['message_id'], react_id, u_id]):
+        for react in message['reacts']:
+            if react['react_id'] == react_id:
+                react['u_ids'].append(u_id)
+                return
+        message['reacts'].append({
+            'react_id': react_id,
+            'u_ids': [u_id],
+        })
+
+def remove_react(message, react_id, u_id):
+    '''
+    Removes a user's react from a message, dropping the react once nobody has it
+    '''
+    with wal.record(['remove_react', message['message_id'], react_id, u_id]):
+        for react in message['reacts']:
+            if react['react_id'] == react_id:
+                react['u_ids'].remove(u_id)
+                if not react['u_ids']:
+                    message['reacts'].remove(react)
+                return
+
+def bump_version(channel_id):
+    '''
+    Records that message text in a channel has changed, so copies of it are
+    out of date
+    '''
+    channel_versions[channel_id] = channel_versions.get(channel_id, 0) + 1
+
+def get_channel_version(channel_id):
+    '''
+    Returns the counter bumped whenever message text in a channel changes
+    '''
+    return channel_versions.get(channel_id, 0)
+
+def get_membership_version(u_id):
+    '''
+    Returns the counter bumped whenever a user joins or leaves a channel
+    '''
+    return membership_versions.get(u_id, 0)
+
+def count_messages(channel):
+    '''
+    Returns the number of messages in a channel
+    '''
+    return len(message_keys[channel['channel_id']])
+
+def iter_channel_messages(channel, start=0, stop=None):
+    '''
+    Yields a channel's messages oldest first, from index start up to but
+    not including index stop
+    '''
+    # Sliced in one step, so readers that don't hold the channel's lock, like
+    # search_pool copying every channel, can't have the list shift under them
+    yield from channel['messages'][start:stop]
+
+def message_position(channel, message):
+    '''
+    Returns the index of a message within its channel's message list
+    '''
+    return bisect.bisect_left(message_keys[channel['channel_id']], message_key(message))
+
+def get_message(message_id):
+    '''
+    Returns the (channel, message) pair for a message_id, or (None, None)
+    '''
+    return messages_by_id.get(message_id, (None, None))
+
+def message_range(channel, time_start, time_end):
+    '''
+    Returns the (start, stop) indexes of a channel's messages created
+    between time_start and time_end inclusive
+    '''
+    keys = message_keys[channel['channel_id']]
+    start = bisect.bisect_left(keys, (time_start,))
+    stop = bisect.bisect_right(keys, (time_end, float('inf')))
+    return start, stop
+
+def iter_messages_between(channel, time_start, time_end, after=None):
+    '''
+    Yields a channel's messages created between time_start and time_end
+    inclusive, oldest first, starting above the key "after" if it is given
+    '''
+    start, stop = message_range(channel, time_start, time_end)
+    if after is not None:
+        start = max(start, bisect.bisect_right(message_keys[channel['channel_id']], after))
+    yield from iter_channel_messages(channel, start, stop)
+
+def iter_newest(channel, before=None):
+    '''
+    Yields (key, message) for a channel's messages from newest to oldest,
+    starting below the key "before" if it is given
+    '''
+    keys = message_keys[channel['channel_id']]
+    messages = channel['messages']
+    stop = len(keys) if before is None else bisect.bisect_left(keys, before)
+    for i in range(stop - 1, -1, -1):
+        yield keys[i], messages[i]
+
+def remove_message(message_id):
+    '''
+    Removes a message from its channel and from the locator index
+    '''
+    with wal.record(['remove_message', message_id]):
+        channel, message = messages_by_id.pop(message_id)
+        position = message_position(channel, message)
+        del channel['messages'][position]
+        del message_keys[channel['channel_id']][position]
+        bump_version(channel['channel_id'])
+
+def forget_channel_messages(channel):
+    '''
+    Drops every message of a channel from the locator index
+    '''
+    for message in channel['messages']:
+        messages_by_id.pop(message['message_id'], None)
+
+tokens = set()
+'''
+Tokens that were issued and are still valid, kept in a set so checking a
+token doesn't scan every token issued
+
+{
     b'eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJ1X2lkIjoxfQ.
     hOT2PzNDMEW-UPlc5h6ZNUsDW-XOGASFmol9cJGdiUA',
     b'eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJ1X2lkIjoyfQ.
     FKgeYBPr6Z56zpj06xtU7AB-eYicvXjUwJMvk3phjS4',
-]
+}
 '''
 
 reset_codes = {}
@@ -185,3 +674,241 @@ reset_codes = {}
     'eyJ0eXAiOi9KV1QiLC3h' : 'another@email.com',
 }
 '''
+
+reset_codes_by_email = {}
+'''
+Index of the unused reset code sent to each email
+
+{
+    'test@email.com' : 'eyJ0eXAiOi9KV1QiLC3h',
+}
+'''
+
+def has_token(token):
+    '''
+    Checks if a token was issued and is still valid
+    '''
+    return token in tokens
+
+def get_reset_email(reset_code):
+    '''
+    Returns the email a password reset code was sent to, or None
+    '''
+    return reset_codes.get(reset_code)
+
+def find_reset_code(email):
+    '''
+    Returns the unused password reset code sent to an email, or None
+    '''
+    return reset_codes_by_email.get(email)
+
+def add_token(token):
+    '''
+    Records a token that was issued, doing nothing if it is already valid
+    '''
+    if token in tokens:
+        return
+    with wal.record(['add_token', token]):
+        tokens.add(token)
+
+def remove_token(token):
+    '''
+    Invalidates a token
+    '''
+    with wal.record(['remove_token', token]):
+        tokens.remove(token)
+
+def add_reset_code(reset_code, email):
+    '''
+    Stores a password reset code for an email
+    '''
+    with wal.record(['add_reset_code', reset_code, email]):
+        reset_codes[reset_code] = email
+        reset_codes_by_email[email] = reset_code
+
+def remove_reset_code(reset_code):
+    '''
+    Removes a password reset code once it is used or replaced
+    '''
+    with wal.record(['remove_reset_code', reset_code]):
+        email = reset_codes.pop(reset_code)
+        if reset_codes_by_email.get(email) == reset_code:
+            del reset_codes_by_email[email]
+
+def start_standup(channel, finish, token):
+    '''
+    Starts a standup in a channel, to be ended at time finish with the token
+    of the user who started it
+    '''
+    with wal.record(['start_standup', channel['channel_id'], finish, token]):
+        channel['standup'] = {'finish': finish, 'token': token, 'messages': []}
+
+def get_standup(channel):
+    '''
+    Returns a channel's active standup, or None
+    '''
+    return channel.get('standup')
+
+def add_standup_message(channel, handle_str, message):
+    '''
+    Adds a message to a channel's active standup
+    '''
+    with wal.record(['add_standup_message', channel['channel_id'], handle_str, message]):
+        channel['standup']['messages'].append({handle_str: message})
+
+def end_standup(channel, finish=None):
+    '''
+    Ends a channel's active standup and returns its messages, or returns None
+    if there is no active standup, or the one finishing at finish has ended
+    '''
+    with wal.lock:
+        standup = channel.get('standup')
+        if standup is None or finish not in (None, standup['finish']):
+            return None
+        with wal.record(['end_standup', channel['channel_id']]):
+            del channel['standup']
+        return standup['messages']
+
+def clear():
+    '''
+    Resets every user, channel, message, token and reset code
+    '''
+    global MAX_MESSAGE_ID # pylint: disable=global-statement
+    with wal.record(['clear']):
+        clear_users()
+        clear_channels()
+        tokens.clear()
+        reset_codes.clear()
+        reset_codes_by_email.clear()
+        MAX_MESSAGE_ID = 0
+
+def load(path, fsync='interval', fsync_interval_ms=50, offset=0):
+    '''
+    Applies every change logged at path from offset bytes in again, then
+    keeps logging changes to it
+    '''
+    wal.close()
+    for record in wal.read(path, offset):
+        apply(record)
+    wal.open_log(path, fsync, fsync_interval_ms)
+
+STATE = (
+    'MAX_MESSAGE_ID', 'MAX_CHANNEL_ID',
+    'users', 'users_by_id', 'users_by_email', 'users_by_handle',
+    'channels', 'channels_by_id', 'channel_members', 'channel_owners', 'user_channels',
+    'channel_versions', 'membership_versions', 'messages_by_id', 'message_keys',
+    'tokens', 'reset_codes', 'reset_codes_by_email',
+)
+'''
+Names of the variables above that make up the state saved in snapshots
+'''
+
+def export_state():
+    '''
+    Returns the state saved in snapshots, which should be copied or
+    serialised while holding wal.lock so no change is half applied
+    '''
+    return {name: globals()[name] for name in STATE}
+
+def import_state(state):
+    '''
+    Replaces the state with one loaded from a snapshot
+    '''
+    globals().update({name: state[name] for name in STATE})
+
+def apply(record):
+    '''
+    Applies one logged change, looking up the users, channels and messages
+    it names by their ids
+    '''
+    global MAX_MESSAGE_ID, MAX_CHANNEL_ID # pylint: disable=global-statement
+    kind, args = record[0], record[1:]
+    if kind == 'add_channel':
+        channel = dict(args[0], messages=[])
+        channel['owner_members'] = [get_user(u_id) for u_id in channel['owner_members']]
+        channel['all_members'] = [get_user(u_id) for u_id in channel['all_members']]
+        add_channel(channel)
+        MAX_CHANNEL_ID = max(MAX_CHANNEL_ID, channel['channel_id'])
+    elif kind == 'add_message':
+        add_message(get_channel(args[0]), args[1])
+        MAX_MESSAGE_ID = max(MAX_MESSAGE_ID, args[1]['message_id'])
+    else:
+        REPLAY[kind](*args)
+
+REPLAY = {
+    'add_user': add_user,
+    'update_user': lambda u_id, changes: update_user(get_user(u_id), changes),
+    'add_member': lambda channel_id, u_id: add_member(get_channel(channel_id), get_user(u_id)),
+    'add_owner': lambda channel_id, u_id: add_owner(get_channel(channel_id), get_user(u_id)),
+    'remove_member': lambda channel_id, u_id: remove_member(get_channel(channel_id), u_id),
+    'remove_owner': lambda channel_id, u_id: remove_owner(get_channel(channel_id), u_id),
+    'remove_channel': lambda channel_id: remove_channel(get_channel(channel_id)),
+    'update_message': lambda message_id, changes: update_message(get_message(message_id)[1],
+                                                                 changes),
+    'add_react': lambda message_id, react_id, u_id: add_react(get_message(message_id)[1],
+                                                              react_id, u_id),
+    'remove_react': lambda message_id, react_id, u_id: remove_react(get_message(message_id)[1],
+                                                                    react_id, u_id),
+    'remove_message': remove_message,
+    'add_token': add_token,
+    'remove_token': remove_token,
+    'add_reset_code': add_reset_code,
+    'remove_reset_code': remove_reset_code,
+    'start_standup': lambda channel_id, finish, token: start_standup(get_channel(channel_id),
+                                                                     finish, token),
+    'add_standup_message': lambda channel_id, handle_str, message: add_standup_message(
+        get_channel(channel_id), handle_str, message),
+    'end_standup': lambda channel_id: end_standup(get_channel(channel_id)),
+    'clear': clear,
+}
+'''
+Functions applying each kind of logged change other than add_channel and
+add_message, which also move the id counters on
+'''
+
+OPERATIONS = (
+    'add_user', 'get_user', 'get_user_by_email', 'get_user_by_handle', 'update_user',
+    'set_user_email', 'set_user_handle', 'count_users', 'iter_users',
+    'add_channel', 'get_channel', 'count_channels', 'iter_channels', 'new_channel_id',
+    'get_user_channels', 'is_member', 'is_owner', 'get_members', 'get_owners',
+    'add_member', 'add_owner', 'remove_member', 'remove_owner', 'remove_channel',
+    'new_message_id', 'reserve_message_id', 'add_message', 'update_message',
+    'add_react', 'remove_react', 'remove_message', 'get_message', 'count_messages',
+    'iter_channel_messages', 'message_position', 'iter_messages_between', 'iter_newest',
+    'get_channel_version', 'get_membership_version',
+    'has_token', 'add_token', 'remove_token', 'get_reset_email', 'find_reset_code',
+    'add_reset_code', 'remove_reset_code',
+    'start_standup', 'get_standup', 'add_standup_message', 'end_standup',
+    'clear',
+)
+'''
+Repository API the rest of the server stores and reads users, channels,
+messages, tokens and standups through, without touching how they are kept.
+The functions above are the in-memory backend. use_backend() swaps them for
+the functions of the same names in another backend module.
+'''
+
+BACKENDS = {
+    'memory': {name: globals()[name] for name in OPERATIONS},
+}
+'''
+Functions of each backend that has been opened, by backend name
+'''
+
+BACKEND = 'memory'
+'''name of the backend the repository API is served from'''
+
+def use_backend(name, path=None):
+    '''
+    Serves the repository API from the named backend, "memory" for the
+    functions above or "sqlite" for the database at path
+    '''
+    global BACKEND # pylint: disable=global-statement
+    if name == 'sqlite':
+        storage_sqlite.open_db(path)
+        BACKENDS['sqlite'] = {operation: getattr(storage_sqlite, operation)
+                              for operation in OPERATIONS}
+    elif name != 'memory':
+        raise ValueError(f'Unknown storage backend {name!r}')
+    globals().update(BACKENDS[name])
+    BACKEND = name
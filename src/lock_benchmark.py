@@ -0,0 +1,163 @@
+'''
+Benchmark of message_send from many threads at once as the messages are
+spread over more channels, with every channel behind its own stripe lock
+and with every channel behind the same lock.
+
+    python3 src/lock_benchmark.py [messages]
+
+prints the messages sent per second for each number of channels, twice.
+
+In the first table sends are all there is. Sends to memory hold the
+interpreter lock for nearly all of their time, so they can't run on more
+than one core however the channels are locked, and striping makes little
+difference to throughput.
+
+In the second table another thread holds the first channel's lock to write
+for HOLD_SECONDS, as a slow request to that channel would. With one lock
+shared by every channel nothing is sent meanwhile. With stripes only sends
+to that channel wait, and sends to the other channels go on at about the
+rate of the first table.
+'''
+
+import sys
+import threading
+import time
+import auth
+import channel
+import channels
+import locks
+import message
+import other
+
+# Messages sent in each run when no number is given
+MESSAGES = 20000
+
+# Threads sending at the same time, spread evenly over the channels
+SENDERS = 32
+
+# Numbers of channels the messages are spread over
+CHANNEL_COUNTS = (1, 2, 4, 8, 16, 32)
+
+# Seconds the first channel's lock is held for by run_held
+HOLD_SECONDS = 0.5
+
+def set_up(channel_count):
+    '''
+    Registers SENDERS users and creates channel_count channels, with each
+    user a member of the channel it sends to, and returns the users' tokens
+    and the channel_ids
+    '''
+    users = [auth.auth_register(f'user{num}@email.com', 'password', 'User', f'Number{num}')
+             for num in range(SENDERS)]
+    c_ids = [channels.channels_create(users[0]['token'], f'channel{num}', True)['channel_id']
+             for num in range(channel_count)]
+    for num, registered in enumerate(users[1:], 1):
+        channel.channel_join(registered['token'], c_ids[num % channel_count])
+    return [registered['token'] for registered in users], c_ids
+
+def share_stripes(shared):
+    '''
+    Puts one lock behind every channel if shared is set, returning the
+    stripes to put back afterwards
+    '''
+    striped = locks.stripes
+    if shared:
+        locks.stripes = [locks.ReadWriteLock()] * locks.STRIPES
+    return striped
+
+def run(channel_count, messages=MESSAGES, shared=False):
+    '''
+    Sends messages from SENDERS threads to channel_count channels, with one
+    lock shared by every channel if shared is set, and returns the messages
+    sent per second
+    '''
+    other.clear()
+    striped = share_stripes(shared)
+    try:
+        tokens, c_ids = set_up(channel_count)
+        start = threading.Barrier(SENDERS + 1)
+        def send(num):
+            c_id = c_ids[num % channel_count]
+            start.wait()
+            for count in range(messages // SENDERS):
+                message.message_send(tokens[num], c_id, f'Message number {count}')
+
+        senders = [threading.Thread(target=send, args=(num,)) for num in range(SENDERS)]
+        for sender in senders:
+            sender.start()
+        start.wait()
+        started = time.perf_counter()
+        for sender in senders:
+            sender.join()
+        per_second = messages // SENDERS * SENDERS / (time.perf_counter() - started)
+        other.clear()
+    finally:
+        locks.stripes = striped
+    return per_second
+
+def run_held(channel_count, shared=False, seconds=HOLD_SECONDS):
+    '''
+    Sends from SENDERS threads to channel_count channels while another
+    thread holds the first channel's lock to write for some seconds, with one
+    lock shared by every channel if shared is set, and returns the messages
+    sent per second while it was held
+    '''
+    other.clear()
+    striped = share_stripes(shared)
+    try:
+        tokens, c_ids = set_up(channel_count)
+        sent = [0] * SENDERS
+        holding = threading.Event()
+        stopping = threading.Event()
+
+        def hold():
+            with locks.channel_writing([c_ids[0]]):
+                holding.set()
+                stopping.wait()
+
+        def send(num):
+            c_id = c_ids[num % channel_count]
+            holding.wait()
+            while not stopping.is_set():
+                message.message_send(tokens[num], c_id, 'Message')
+                # Sends let through once the lock is given back don't count
+                if not stopping.is_set():
+                    sent[num] += 1
+
+        threads = [threading.Thread(target=send, args=(num,)) for num in range(SENDERS)]
+        threads.append(threading.Thread(target=hold))
+        for thread in threads:
+            thread.start()
+        holding.wait()
+        time.sleep(seconds)
+        stopping.set()
+        for thread in threads:
+            thread.join()
+        other.clear()
+    finally:
+        locks.stripes = striped
+    return sum(sent) / seconds
+
+def main():
+    '''
+    Benchmarks each number of channels with and without striping, then again
+    while a channel is held, and prints the results side by side
+    '''
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    print(f'{messages} messages from {SENDERS} threads, message_send per second')
+    print(f'{"channels":<10}{"striped":>12}{"shared":>12}{"ratio":>8}')
+    for channel_count in CHANNEL_COUNTS:
+        striped = run(channel_count, messages)
+        shared = run(channel_count, messages, shared=True)
+        print(f'{channel_count:<10}{striped:>12.0f}{shared:>12.0f}{striped / shared:>8.2f}')
+
+    print()
+    print(f'{SENDERS} threads while the first channel is held, message_send per second')
+    print(f'{"channels":<10}{"striped":>12}{"shared":>12}')
+    for channel_count in CHANNEL_COUNTS:
+        striped = run_held(channel_count)
+        shared = run_held(channel_count, shared=True)
+        print(f'{channel_count:<10}{striped:>12.0f}{shared:>12.0f}')
+
+if __name__ == '__main__':
+    main()
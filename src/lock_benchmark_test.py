@@ -0,0 +1,26 @@
+'''
+Tests for the lock striping benchmark
+'''
+
+import lock_benchmark
+import locks
+
+def test_benchmark():
+    '''
+    Tests that sends are benchmarked with and without striping, and the
+    stripes are put back afterwards
+    '''
+    stripes = locks.stripes
+    assert lock_benchmark.run(4, 64) > 0
+    assert lock_benchmark.run(4, 64, shared=True) > 0
+    assert locks.stripes is stripes
+
+def test_benchmark_held():
+    '''
+    Tests that a held channel only holds up sends to it when channels are striped
+    '''
+    stripes = locks.stripes
+    assert lock_benchmark.run_held(2, seconds=0.2) > 0
+    assert lock_benchmark.run_held(1, seconds=0.2) == 0
+    assert lock_benchmark.run_held(2, shared=True, seconds=0.2) == 0
+    assert locks.stripes is stripes
@@ -0,0 +1,275 @@
+'''
+Locks over the state, so that requests run at the same time without seeing
+or making half applied changes.
+
+The state as a whole is guarded by a reader/writer lock. Everything that only
+touches one channel's messages or standup, such as sending, editing or
+reacting to a message, holds it to read and holds the lock of that channel
+instead, so requests to different channels don't wait for each other.
+Channels share a fixed number of stripe locks, picked by their channel_id.
+Registering, logging in and changing a profile hold it to read and hold the
+lock of the user registry. Sending a reset code and uploading a profile
+photo only hold them around their changes to the state, not while they wait
+on the network. Changes that span channels, such as creating or deleting a
+channel, changing who is a member of one, and
+admin_userpermission_change, hold it to write, which keeps out every other
+request, so they take no other lock. Cancelling or rescheduling a sendlater
+message only changes the scheduler's queue, which scheduler.condition
+guards, so they hold it to read.
+
+Every public function of auth, channel, channels, message, user, other and
+standup is marked with the locks it needs, which covers requests handled by
+the server's threads as well as the threading.Timer that ends a standup. The
+sendlater scheduler takes a channel's lock around each message it sends, the
+search index's rebuild a channel's lock to read around each channel it
+indexes, and a follower the state's lock to write around each record it
+applies.
+
+The locks are reentrant, but a thread that only reads can't start writing.
+Lock ordering, which every thread follows so none can deadlock:
+
+    1. the state's lock, to read or to write
+    2. the user registry's lock
+    3. channel stripe locks, in ascending order of stripe
+    4. search_index.lock, search_cache.lock, search_pool.sending then
+       search_pool.changing, scheduler.condition, wal.lock, data.ids_lock
+       and storage_sqlite.lock, each held only briefly and never while
+       waiting for a lock above it
+
+Striping keeps a slow request to one channel from holding up requests to
+the others. It doesn't make sends to memory faster as channels are added:
+they hold the interpreter lock for nearly all of their time, and every send
+still briefly takes search_index.lock, and wal.lock while a log is open.
+lock_benchmark.py measures both.
+'''
+
+import contextlib
+import functools
+import inspect
+import threading
+import data
+
+class ReadWriteLock:
+    '''
+    Lock held either by any number of readers or by one writer. Once a
+    writer is waiting, new readers wait behind it, so a steady stream of
+    reads can't hold writes off forever.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.writes = 0
+        self.waiting_writers = 0
+        # Number of read holds of the current thread
+        self.held = threading.local()
+
+    def read_holds(self):
+        '''
+        Returns the number of times the current thread holds the lock to read
+        '''
+        return getattr(self.held, 'reads', 0)
+
+    def acquire_read(self):
+        '''
+        Waits until no writer holds or is waiting for the lock, then reads.
+        A thread that already holds the lock doesn't wait.
+        '''
+        with self.condition:
+            if self.writer != threading.get_ident() and not self.read_holds():
+                self.condition.wait_for(lambda: self.writer is None and not self.waiting_writers)
+            self.readers += 1
+            self.held.reads = self.read_holds() + 1
+
+    def release_read(self):
+        '''
+        Stops reading, letting a waiting writer in after the last reader
+        '''
+        with self.condition:
+            self.readers -= 1
+            self.held.reads = self.read_holds() - 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        '''
+        Waits until nobody else holds the lock, then writes
+        '''
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.writes += 1
+                return
+            if self.read_holds():
+                raise RuntimeError('Cannot write while holding the lock to read')
+            self.waiting_writers += 1
+            self.condition.wait_for(lambda: self.writer is None and not self.readers)
+            self.waiting_writers -= 1
+            self.writer = me
+            self.writes = 1
+
+    def release_write(self):
+        '''
+        Stops writing, letting readers or the next writer in
+        '''
+        with self.condition:
+            self.writes -= 1
+            if not self.writes:
+                self.writer = None
+                self.condition.notify_all()
+
+# Lock over the whole state
+lock = ReadWriteLock()
+
+# Lock over the registered users, their tokens and reset codes
+users = ReadWriteLock()
+
+# Number of locks channels are spread over
+STRIPES = 64
+
+# Lock over the messages and standup of the channels with channel_id % STRIPES == i
+stripes = [ReadWriteLock() for _ in range(STRIPES)]
+
+@contextlib.contextmanager
+def reading():
+    '''
+    Holds the lock to read for the duration of the block
+    '''
+    lock.acquire_read()
+    try:
+        yield
+    finally:
+        lock.release_read()
+
+@contextlib.contextmanager
+def writing():
+    '''
+    Holds the lock to write for the duration of the block
+    '''
+    lock.acquire_write()
+    try:
+        yield
+    finally:
+        lock.release_write()
+
+@contextlib.contextmanager
+def holding(find_locks, write):
+    '''
+    Holds the lock to read, then each of the locks find_locks() returns, in
+    order, to read or to write for the duration of the block
+    '''
+    lock.acquire_read()
+    acquired = []
+    try:
+        for each in find_locks():
+            if write:
+                each.acquire_write()
+            else:
+                each.acquire_read()
+            acquired.append(each)
+        yield
+    finally:
+        for each in reversed(acquired):
+            if write:
+                each.release_write()
+            else:
+                each.release_read()
+        lock.release_read()
+
+def channel_stripes(channel_ids):
+    '''
+    Returns the stripe locks of the given channels, in the order they are taken
+    '''
+    return [stripes[index] for index in sorted({hash(channel_id) % STRIPES
+                                                 for channel_id in channel_ids})]
+
+def message_stripes(message_id):
+    '''
+    Returns the stripe lock of the channel a message was sent to, if it exists
+    '''
+    channel, _ = data.get_message(message_id)
+    if channel is None:
+        return []
+    return channel_stripes([channel['channel_id']])
+
+def channel_reading(channel_ids):
+    '''
+    Holds the locks of the given channels to read for the duration of the block
+    '''
+    return holding(lambda: channel_stripes(channel_ids), False)
+
+def channel_writing(channel_ids):
+    '''
+    Holds the locks of the given channels to write for the duration of the block
+    '''
+    return holding(lambda: channel_stripes(channel_ids), True)
+
+def users_reading():
+    '''
+    Holds the lock of the user registry to read for the duration of the block
+    '''
+    return holding(lambda: [users], False)
+
+def users_writing():
+    '''
+    Holds the lock of the user registry to write for the duration of the block
+    '''
+    return holding(lambda: [users], True)
+
+def reads(function):
+    '''
+    Marks a function that only reads the state
+    '''
+    @functools.wraps(function)
+    def locked(*args, **kwargs):
+        with reading():
+            return function(*args, **kwargs)
+    return locked
+
+def writes(function):
+    '''
+    Marks a function that changes the state across channels or users
+    '''
+    @functools.wraps(function)
+    def locked(*args, **kwargs):
+        with writing():
+            return function(*args, **kwargs)
+    return locked
+
+def holds(find_locks, write, name=None):
+    '''
+    Returns a decorator which holds the locks find_locks returns while the
+    function runs. If name is given, find_locks is passed the argument with
+    that name.
+    '''
+    def decorator(function):
+        position = None
+        if name is not None:
+            position = list(inspect.signature(function).parameters).index(name)
+
+        @functools.wraps(function)
+        def locked(*args, **kwargs):
+            if position is None:
+                find = find_locks
+            else:
+                value = args[position] if position < len(args) else kwargs[name]
+                find = functools.partial(find_locks, value)
+            with holding(find, write):
+                return function(*args, **kwargs)
+        return locked
+    return decorator
+
+# Marks a function that only reads the channel given by its channel_id
+channel_reads = holds(lambda channel_id: channel_stripes([channel_id]), False, 'channel_id')
+
+# Marks a function that changes the channel given by its channel_id
+channel_writes = holds(lambda channel_id: channel_stripes([channel_id]), True, 'channel_id')
+
+# Marks a function that changes the message given by its message_id
+message_writes = holds(message_stripes, True, 'message_id')
+
+# Marks a function that only reads the user registry
+users_reads = holds(lambda: [users], False)
+
+# Marks a function that changes the user registry
+users_writes = holds(lambda: [users], True)
@@ -0,0 +1,342 @@
+'''
+Tests for the reader/writer lock over the state, and stress tests of
+requests running at the same time
+'''
+
+import sys
+import threading
+import time
+import pytest
+import auth
+import channel
+import channels
+import locks
+import message
+import other
+import search_cache
+import data
+
+# Threads sending at the same time in the stress tests, and messages each sends
+SENDERS = 64
+SENDS = 25
+
+def test_lock_readers_share():
+    '''
+    Tests that readers hold the lock at the same time
+    '''
+    other.clear()
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def read():
+        with locks.reading():
+            both_reading.wait()
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert not both_reading.broken
+
+def test_lock_writer_excludes():
+    '''
+    Tests that a writer waits for readers, and readers for a waiting writer
+    '''
+    other.clear()
+    order = []
+    lock = locks.ReadWriteLock()
+
+    def write():
+        lock.acquire_write()
+        order.append('write')
+        lock.release_write()
+
+    def read():
+        lock.acquire_read()
+        order.append('read')
+        lock.release_read()
+
+    lock.acquire_read()
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not lock.waiting_writers:
+        time.sleep(0.01)
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.1)
+    assert not order
+    lock.release_read()
+    writer.join()
+    reader.join()
+    assert order == ['write', 'read']
+
+def test_lock_reentrant():
+    '''
+    Tests that a thread can take the lock again, but can't start writing
+    while it only reads
+    '''
+    other.clear()
+    with locks.writing():
+        with locks.writing():
+            with locks.reading():
+                assert locks.lock.writer == threading.get_ident()
+    assert locks.lock.writer is None
+
+    with locks.reading():
+        with locks.reading():
+            with pytest.raises(RuntimeError):
+                with locks.writing():
+                    pass
+    assert locks.lock.readers == 0
+
+def send_from_threads(token, c_id):
+    '''
+    Sends SENDS messages from each of SENDERS threads at once while other
+    threads page through the channel, and returns the message_ids sent
+    '''
+    sent = []
+    failures = []
+    start = threading.Barrier(SENDERS + 4, timeout=30)
+
+    def send(num):
+        start.wait()
+        try:
+            for count in range(SENDS):
+                sent.append(message.message_send(token, c_id, f'{num} {count}')['message_id'])
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    def read():
+        start.wait()
+        try:
+            while len(sent) < SENDERS * SENDS and not failures:
+                page = channel.channel_messages(token, c_id, 0)['messages']
+                assert len({msg['message_id'] for msg in page}) == len(page)
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    threads = [threading.Thread(target=send, args=(num,)) for num in range(SENDERS)]
+    threads += [threading.Thread(target=read) for _ in range(4)]
+    interval = sys.getswitchinterval()
+    # Switching threads often makes races more likely to show up
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not failures
+    return sent
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_concurrent_senders(backend, tmp_path):
+    '''
+    Tests that messages sent from many threads at once all get a different
+    message_id, in the order they are stored, and none of them are lost
+    '''
+    other.clear()
+    if backend == 'sqlite':
+        other.open_storage(str(tmp_path / 'flockr.db'))
+    try:
+        user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+        c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+
+        sent = send_from_threads(user1['token'], c_id1)
+        assert sorted(sent) == list(range(1, SENDERS * SENDS + 1))
+        assert data.count_messages(data.get_channel(c_id1)) == SENDERS * SENDS
+        stored = channel.channel_messages_range(user1['token'], c_id1, 0,
+                                                time.time() + 60)['messages']
+        # message_ids are handed out in the order messages are stored
+        assert [msg['message_id'] for msg in stored] == sorted(sent)
+        assert message.message_send(user1['token'], c_id1, 'Last')['message_id'] == \
+            SENDERS * SENDS + 1
+        other.clear()
+    finally:
+        data.use_backend('memory')
+
+def test_stream_releases_lock(monkeypatch):
+    '''
+    Tests that a streamed range doesn't keep writes out between pages, and
+    picks up after the last message it streamed
+    '''
+    other.clear()
+    monkeypatch.setattr(channel, 'STREAM_PAGE_SIZE', 2)
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    for num in range(5):
+        message.message_send(user1['token'], c_id1, f'Hello {num}')
+
+    stream = channel.iter_messages_range(user1['token'], c_id1, 0, time.time() + 60)
+    assert next(stream)['message'] == 'Hello 0'
+
+    sender = threading.Thread(target=message.message_send,
+                              args=(user1['token'], c_id1, 'Hello 5'))
+    sender.start()
+    sender.join(5)
+    assert not sender.is_alive()
+
+    assert [msg['message'] for msg in stream] == [f'Hello {num}' for num in range(1, 6)]
+    other.clear()
+
+def test_channel_locks():
+    '''
+    Tests that a channel being written to only holds up requests to that
+    channel, and that requests spanning channels wait for every channel
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(user1['token'], 'channel2', True)['channel_id']
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+
+    def start(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        thread.join(0.2)
+        return thread
+
+    with locks.channel_writing([c_id1]):
+        assert not start(message.message_send, user1['token'], c_id2, 'Hello').is_alive()
+        assert not start(auth.auth_login, 'another@email.com', 'another_password').is_alive()
+        blocked_send = start(message.message_send, user1['token'], c_id1, 'Later')
+        blocked_admin = start(other.admin_userpermission_change, user1['token'],
+                              user2['u_id'], 1)
+        assert blocked_send.is_alive()
+        assert blocked_admin.is_alive()
+    blocked_send.join(5)
+    blocked_admin.join(5)
+    assert not blocked_send.is_alive()
+    assert not blocked_admin.is_alive()
+    assert [msg['message'] for msg in
+            channel.channel_messages(user1['token'], c_id1, 0)['messages']] == ['Later']
+
+    # stripes are taken in the same order whatever order channels are given in
+    assert locks.channel_stripes([c_id2, c_id1]) == locks.channel_stripes([c_id1, c_id2])
+    other.clear()
+
+def test_concurrent_channels():
+    '''
+    Tests that messages sent to many channels at once, while a member comes
+    and goes and a user searches, all get a different message_id and are
+    stored in the order they were handed out
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    token1 = user1['token']
+    c_ids = [channels.channels_create(token1, f'channel{num}', True)['channel_id']
+             for num in range(8)]
+    sent = []
+    failures = []
+    sending = threading.Event()
+    sending.set()
+
+    def send(num):
+        try:
+            for count in range(SENDS):
+                sent.append(message.message_send(token1, c_ids[num % len(c_ids)],
+                                                 f'Hello {count}')['message_id'])
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    def churn():
+        try:
+            while sending.is_set():
+                channel.channel_join(user2['token'], c_ids[0])
+                other.search(token1, 'Hello')
+                channel.channel_leave(user2['token'], c_ids[0])
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    churner = threading.Thread(target=churn)
+    churner.start()
+    senders = [threading.Thread(target=send, args=(num,)) for num in range(SENDERS)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    sending.clear()
+    churner.join()
+    assert not failures
+
+    assert sorted(sent) == list(range(1, SENDERS * SENDS + 1))
+    for c_id in c_ids:
+        stored = channel.channel_messages_range(token1, c_id, 0, time.time() + 60)['messages']
+        assert len(stored) == SENDERS * SENDS // len(c_ids)
+        assert [msg['message_id'] for msg in stored] == \
+            sorted(msg['message_id'] for msg in stored)
+    assert len(other.search(token1, 'Hello')['messages']) == SENDERS * SENDS
+    other.clear()
+
+def test_search_while_other_channel_changes():
+    '''
+    Tests that searching isn't thrown by messages being removed from a channel
+    the user isn't in, whose lock the search doesn't hold
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(user2['token'], 'channel2', True)['channel_id']
+    m_id1 = message.message_send(user1['token'], c_id1, 'hello there')['message_id']
+    failures = []
+    stopping = threading.Event()
+
+    def churn():
+        try:
+            while not stopping.is_set():
+                m_id = message.message_send(user2['token'], c_id2, 'hello world')['message_id']
+                message.message_remove(user2['token'], m_id)
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    def search():
+        try:
+            while not stopping.is_set():
+                search_cache.clear()
+                found = other.search(user1['token'], 'hello')['messages']
+                assert [msg['message_id'] for msg in found] == [m_id1]
+                found = other.search(user1['token'], 'hello', 5)['messages']
+                assert [msg['message_id'] for msg in found] == [m_id1]
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(err)
+
+    threads = [threading.Thread(target=churn)]
+    threads += [threading.Thread(target=search) for _ in range(2)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(2)
+    finally:
+        stopping.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+    assert not failures
+    other.clear()
+
+def test_sendlater_changes_only_read():
+    '''
+    Tests that cancelling or rescheduling a sendlater message doesn't wait
+    for requests reading the state
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    m_id1 = message.message_sendlater(user1['token'], c_id1, 'Later',
+                                      time.time() + 60)['message_id']
+
+    with locks.reading():
+        for target, args in [(message.message_sendlater_reschedule,
+                              (user1['token'], m_id1, time.time() + 120)),
+                             (message.message_sendlater_cancel, (user1['token'], m_id1))]:
+            changer = threading.Thread(target=target, args=args)
+            changer.start()
+            changer.join(5)
+            assert not changer.is_alive()
+    assert not message.message_sendlater_list(user1['token'], c_id1)['messages']
+    other.clear()
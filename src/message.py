@@ -3,11 +3,14 @@ Message functions implementation
 '''
 
 from datetime import datetime
-import threading
 import jwt
 import data
+import locks
 import error
+import scheduler
+import search_index
 
+@locks.channel_writes
 def message_send(token, channel_id, message):
     '''
     Send a message from authorised_user to the channel specified by channel_id
@@ -15,8 +18,7 @@ def message_send(token, channel_id, message):
     check_message_length(message)
     u_id = check_token_channel(token, channel_id)
 
-    new_message_id = data.MAX_MESSAGE_ID + 1
-    data.MAX_MESSAGE_ID = new_message_id
+    new_message_id = data.new_message_id()
 
     time_created = datetime.now().timestamp()
     send_to_channel(channel_id, new_message_id, u_id, message, time_created)
@@ -25,6 +27,7 @@ def message_send(token, channel_id, message):
         'message_id': new_message_id,
     }
 
+@locks.channel_writes
 def message_sendlater(token, channel_id, message, time_sent):
     '''
     Send a message from authorised_user to the channel
@@ -34,23 +37,67 @@ def message_sendlater(token, channel_id, message, time_sent):
     check_channel_id(channel_id)
     u_id = check_token_channel(token, channel_id)
 
-    new_message_id = data.MAX_MESSAGE_ID + 1
-    data.MAX_MESSAGE_ID = new_message_id
+    new_message_id = data.new_message_id()
 
     wait_period = time_sent - datetime.now().timestamp()
     if wait_period < 0:
         raise error.InputError(description='Time sent is a time in the past')
 
-    timer = threading.Timer(
-        wait_period, send_to_channel,
-        args=(channel_id, new_message_id, u_id, message, time_sent)
-    )
-    timer.start()
+    scheduler.schedule(new_message_id, channel_id, u_id, message, time_sent)
 
     return {
         'message_id': new_message_id,
     }
 
+@locks.reads
+def message_sendlater_list(token, channel_id):
+    '''
+    List the authorised user's messages in the channel
+    that are scheduled but haven't been sent yet
+    '''
+    check_channel_id(channel_id)
+    u_id = check_token_channel(token, channel_id)
+
+    return {
+        'messages': [
+            {
+                'message_id': entry['message_id'],
+                'message': entry['message'],
+                'time_sent': entry['time_sent'],
+            }
+            for entry in scheduler.list_pending(u_id, channel_id)
+        ],
+    }
+
+@locks.reads
+def message_sendlater_cancel(token, message_id):
+    '''
+    Given the message_id of a scheduled message, it is cancelled before being sent
+    '''
+    check_scheduled_access(token, message_id)
+
+    if scheduler.cancel(message_id) is None:
+        raise error.InputError(description='Scheduled message does not exist')
+
+    return {
+    }
+
+@locks.reads
+def message_sendlater_reschedule(token, message_id, time_sent):
+    '''
+    Given the message_id of a scheduled message, change the time it will be sent at
+    '''
+    check_scheduled_access(token, message_id)
+
+    if time_sent < datetime.now().timestamp():
+        raise error.InputError(description='Time sent is a time in the past')
+
+    if scheduler.reschedule(message_id, time_sent) is None:
+        raise error.InputError(description='Scheduled message does not exist')
+
+    return {
+    }
+
 def send_to_channel(channel_id, message_id, u_id, message, time_sent):
     '''
     Helper function that sends a given message to a given channel
@@ -64,32 +111,32 @@ def send_to_channel(channel_id, message_id, u_id, message, time_sent):
         'is_pinned': False,
     }
 
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            channel['messages'].append(message_info)
+    channel = data.get_channel(channel_id)
+    if channel is not None:
+        data.add_message(channel, message_info)
+        search_index.add_message(message_info, channel_id)
 
+@locks.message_writes
 def message_remove(token, message_id):
     '''
     Given a message_id for a message, this message is removed from the channel
     '''
     u_id = check_token(token)
 
-    removed = False
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if (u_id == msg['u_id']) or check_owner(u_id, channel['channel_id']):
-                    channel['messages'].remove(msg)
-                    removed = True
-                else:
-                    raise error.AccessError(description='User does not have permission')
-
-    if not removed:
+    channel, msg = data.get_message(message_id)
+    if msg is None:
         raise error.InputError(description='Message does not exist')
 
+    if (u_id != msg['u_id']) and not check_owner(u_id, channel['channel_id']):
+        raise error.AccessError(description='User does not have permission')
+
+    data.remove_message(message_id)
+    search_index.remove_message(message_id)
+
     return {
     }
 
+@locks.message_writes
 def message_edit(token, message_id, message):
     '''
     Given a message, update it's text with new text.
@@ -98,69 +145,68 @@ def message_edit(token, message_id, message):
     u_id = check_token(token)
     check_message_length(message)
 
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if (u_id == msg['u_id']) or check_owner(u_id, channel['channel_id']):
-                    if not message:
-                        channel['messages'].remove(msg)
-                    else:
-                        msg['message'] = message
-                else:
-                    raise error.AccessError(description='User does not have permission')
+    channel, msg = data.get_message(message_id)
+    if msg is None:
+        return {
+        }
+
+    if (u_id != msg['u_id']) and not check_owner(u_id, channel['channel_id']):
+        raise error.AccessError(description='User does not have permission')
+
+    if not message:
+        data.remove_message(message_id)
+        search_index.remove_message(message_id)
+    else:
+        data.update_message(msg, {'message': message})
+        search_index.update_message(msg)
     return {
     }
 
+@locks.message_writes
 def message_pin(token, message_id):
     '''
     Given a message within a channel, mark it as "pinned"
     '''
     u_id = check_token(token)
 
-    pinned = False
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if msg['is_pinned']:
-                    raise error.InputError(description='Message is already pinned')
-                if not check_member(u_id, channel['channel_id']):
-                    raise error.AccessError(description='User is not a member of the channel')
-                if not check_owner(u_id, channel['channel_id']):
-                    raise error.AccessError(description='User is not an owner')
-
-                msg['is_pinned'] = True
-                pinned = True
-
-    if not pinned:
+    channel, msg = data.get_message(message_id)
+    if msg is None:
         raise error.InputError(description='Message does not exist')
 
+    if msg['is_pinned']:
+        raise error.InputError(description='Message is already pinned')
+    if not check_member(u_id, channel['channel_id']):
+        raise error.AccessError(description='User is not a member of the channel')
+    if not check_owner(u_id, channel['channel_id']):
+        raise error.AccessError(description='User is not an owner')
+
+    data.update_message(msg, {'is_pinned': True})
+
     return {}
 
+@locks.message_writes
 def message_unpin(token, message_id):
     '''
     Given a message within a channel, remove it's mark as unpinned
     '''
     u_id = check_token(token)
 
-    unpinned = False
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if not msg['is_pinned']:
-                    raise error.InputError(description='Message is already unpinned')
-                if not check_member(u_id, channel['channel_id']):
-                    raise error.AccessError(description='User is not a member of the channel')
-                if not check_owner(u_id, channel['channel_id']):
-                    raise error.AccessError(description='User is not an owner')
-
-                msg['is_pinned'] = False
-                unpinned = True
-
-    if not unpinned:
+    channel, msg = data.get_message(message_id)
+    if msg is None:
         raise error.InputError(description='Message does not exist')
 
+    if not msg['is_pinned']:
+        raise error.InputError(description='Message is already unpinned')
+    if not check_member(u_id, channel['channel_id']):
+        raise error.AccessError(description='User is not a member of the channel')
+    if not check_owner(u_id, channel['channel_id']):
+        raise error.AccessError(description='User is not an owner')
+
+    data.update_message(msg, {'is_pinned': False})
+
     return {}
 
+@locks.message_writes
 def message_react(token, message_id, react_id):
     '''
     Given a message within a channel the authorised user is part of,
@@ -169,21 +215,18 @@ def message_react(token, message_id, react_id):
     u_id = check_token(token)
     check_react_id(react_id)
 
-    reacted = False
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if not check_member(u_id, channel['channel_id']):
-                    raise error.InputError(description='User is not a member of the channel')
+    channel, msg = data.get_message(message_id)
+    if msg is None:
+        raise error.InputError(description='Message does not exist')
 
-                add_react(msg['reacts'], react_id, u_id)
-                reacted = True
+    if not check_member(u_id, channel['channel_id']):
+        raise error.InputError(description='User is not a member of the channel')
 
-    if not reacted:
-        raise error.InputError(description='Message does not exist')
+    add_react(msg, react_id, u_id)
 
     return {}
 
+@locks.message_writes
 def message_unreact(token, message_id, react_id):
     '''
     Given a message within a channel the authorised user is part of,
@@ -192,21 +235,33 @@ def message_unreact(token, message_id, react_id):
     u_id = check_token(token)
     check_react_id(react_id)
 
-    unreacted = False
-    for channel in data.channels:
-        for msg in channel['messages']:
-            if msg['message_id'] == message_id:
-                if not check_member(u_id, channel['channel_id']):
-                    raise error.InputError(description='User is not a member of the channel')
+    channel, msg = data.get_message(message_id)
+    if msg is None:
+        raise error.InputError(description='Message does not exist')
 
-                remove_react(msg['reacts'], react_id, u_id)
-                unreacted = True
+    if not check_member(u_id, channel['channel_id']):
+        raise error.InputError(description='User is not a member of the channel')
 
-    if not unreacted:
-        raise error.InputError(description='Message does not exist')
+    remove_react(msg, react_id, u_id)
 
     return {}
 
+def view_message(msg, u_id):
+    '''
+    Returns a copy of a stored message as seen by the given user, with
+    'is_this_user_reacted' set on each react. The stored message is not modified.
+    '''
+    view = dict(msg)
+    view['reacts'] = [
+        {
+            'react_id': react['react_id'],
+            'u_ids': list(react['u_ids']),
+            'is_this_user_reacted': u_id in react['u_ids'],
+        }
+        for react in msg['reacts']
+    ]
+    return view
+
 def check_message_length(message):
     '''
     Check if the given massage has valid length
@@ -218,7 +273,7 @@ def check_token(token):
     '''
     Check if given token is valid, if so return the associate u_id
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise error.AccessError(description='Invalid token')
 
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
@@ -228,28 +283,20 @@ def check_channel_id(channel_id):
     '''
     Check if given channel_id is valid
     '''
-    c_id_list = []
-    for channel in data.channels:
-        c_id_list.append(channel['channel_id'])
-    if channel_id not in c_id_list:
+    if data.get_channel(channel_id) is None:
         raise error.InputError(description='Invalid channel_id')
 
 def check_token_channel(token, channel_id):
     '''
     Check if given token is a valid user that has joined the given channel
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise error.AccessError(description='Invalid token')
 
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
     u_id = decoded_info['u_id']
 
-    member_list = []
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            for member in channel['all_members']:
-                member_list.append(member['u_id'])
-    if u_id not in member_list:
+    if not data.is_member(channel_id, u_id):
         raise error.AccessError(description='User is not authorised')
 
     return u_id
@@ -258,28 +305,32 @@ def check_member(u_id, channel_id):
     '''
     Check if the given user is a member of the given channel
     '''
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            for member in channel['all_members']:
-                if u_id == member['u_id']:
-                    return True
-    return False
+    return data.is_member(channel_id, u_id)
 
 def check_owner(u_id, channel_id):
     '''
     Check if the given user is an owner of flocker or the given channel
     '''
-    for user in data.users:
-        if u_id == user['u_id']:
-            if user['permission_id'] == 1:
-                return True
+    user = data.get_user(u_id)
+    if user is not None and user['permission_id'] == 1:
+        return True
 
-    for channel in data.channels:
-        if channel_id == channel['channel_id']:
-            for member in channel['owner_members']:
-                if u_id == member['u_id']:
-                    return True
-    return False
+    return data.is_owner(channel_id, u_id)
+
+def check_scheduled_access(token, message_id):
+    '''
+    Check if the given user sent the given scheduled message or owns its channel
+    '''
+    u_id = check_token(token)
+
+    entry = scheduler.get(message_id)
+    if entry is None:
+        raise error.InputError(description='Scheduled message does not exist')
+
+    if (u_id != entry['u_id']) and not check_owner(u_id, entry['channel_id']):
+        raise error.AccessError(description='User does not have permission')
+
+    return u_id
 
 def check_react_id(react_id): 
     ''' 
@@ -288,38 +339,26 @@ def check_react_id(react_id):
     if react_id != 1: 
         raise error.InputError(description='Invalid react_id') 
 
-def add_react(reacts, react_id, u_id):
+def add_react(msg, react_id, u_id):
     '''
     Adds a react of given id by the given user
     '''
-    if not reacts:
-        reacts.append(
-            {
-                'react_id': react_id,
-                'u_ids': [u_id],
-            }
-        )
-    else:
-        for react in reacts:
-            # There is only one react_id and was checked earlier,
-            # therefore it is assumed that there is only one element in the list
-            if u_id in react['u_ids']:
-                raise error.InputError(description='Message is already reacted by the user')
+    for react in msg['reacts']:
+        if react['react_id'] == react_id and u_id in react['u_ids']:
+            raise error.InputError(description='Message is already reacted by the user')
 
-            react['u_ids'].append(u_id)
+    data.add_react(msg, react_id, u_id)
 
-def remove_react(reacts, react_id, u_id):
+def remove_react(msg, react_id, u_id):
     '''
     Removes a react of given id by the given user
     '''
-    if not reacts:
+    if not msg['reacts']:
         raise error.InputError(description='No active react')
-    
-    for react in reacts:
-        # There is only one react_id and was checked earlier,
-        # therefore it is assumed that there is only one element in the list
-        if u_id not in react['u_ids']:
-            raise error.InputError(description='Message has not been reacted by the user')
-        react['u_ids'].remove(u_id)
-        if not react['u_ids']:
-            reacts.remove(react)
+
+    for react in msg['reacts']:
+        if react['react_id'] == react_id and u_id in react['u_ids']:
+            data.remove_react(msg, react_id, u_id)
+            return
+
+    raise error.InputError(description='Message has not been reacted by the user')
@@ -496,6 +496,64 @@ def test_sendlater(url):
     message1 = response.json()
     assert 'message_id' in message1
 
+def test_sendlater_cancel_reschedule(url):
+    '''Tests the calling of the sendlater list, cancel and reschedule functions'''
+    reg_data1 = {
+        'email': 'test@email.com',
+        'password': 'test_pass',
+        'name_first': 'test_first',
+        'name_last': 'test_last',
+    }
+    user1 = requests.post(url + 'auth/register', json=reg_data1).json()
+
+    channel_data1 = {
+        'token': user1['token'],
+        'name': 'channel1',
+        'is_public': True,
+    }
+    channel1 = requests.post(url + 'channels/create', json=channel_data1).json()
+
+    now = datetime.datetime.now()
+    time_sent = (now + datetime.timedelta(seconds=10)).timestamp()
+    msg_data = {
+        'token': user1['token'],
+        'channel_id': channel1['channel_id'],
+        'message': 'Hello World',
+        'time_sent': time_sent,
+    }
+    message1 = requests.post(url + 'message/sendlater', json=msg_data).json()
+
+    list_input = {
+        'token': user1['token'],
+        'channel_id': channel1['channel_id'],
+    }
+    response = requests.get(url + 'message/sendlater/list', params=list_input)
+    assert response.status_code == 200
+    assert response.json()['messages'] == [
+        {'message_id': message1['message_id'], 'message': 'Hello World', 'time_sent': time_sent}
+    ]
+
+    reschedule_data = {
+        'token': user1['token'],
+        'message_id': message1['message_id'],
+        'time_sent': time_sent + 10,
+    }
+    response = requests.put(url + 'message/sendlater/reschedule', json=reschedule_data)
+    assert response.status_code == 200
+
+    cancel_data = {
+        'token': user1['token'],
+        'message_id': message1['message_id'],
+    }
+    response = requests.delete(url + 'message/sendlater/cancel', json=cancel_data)
+    assert response.status_code == 200
+    response = requests.delete(url + 'message/sendlater/cancel', json=cancel_data)
+    assert response.status_code == 400
+
+    response = requests.get(url + 'scheduler/metrics')
+    assert response.status_code == 200
+    assert response.json()['depth'] == 0
+
 def test_sendlater_invalid_inputs(url):
     '''Tests the calling of message_sendlater function with invalid inputs'''
     # register and login user1
@@ -12,6 +12,7 @@ import auth
 import channels
 import message
 import error
+import data
 
 REACT_ID = 1
 INVALID_REACT_ID = -1
@@ -480,6 +481,37 @@ def test_sendlater_access_error():
     with pytest.raises(error.AccessError):
         message.message_sendlater(token2, c_id1, 'Hello', time_sent)
 
+def test_late_message_time_order():
+    '''
+    Tests that a message arriving after newer ones is stored in time order
+    '''
+    other.clear()
+    user1, _ = add_user_info()
+    token1 = user1['token']
+    channel1 = channels.channels_create(token1, 'channel1', True)
+    c_id1 = channel1['channel_id']
+
+    m_id1 = message.message_send(token1, c_id1, 'first')['message_id']
+    first_time = data.get_message(m_id1)[1]['time_created']
+    m_id2 = message.message_send(token1, c_id1, 'second')['message_id']
+    second_time = data.get_message(m_id2)[1]['time_created']
+
+    # a scheduled message due between the first two is dispatched late
+    data.MAX_MESSAGE_ID += 1
+    late_id = data.MAX_MESSAGE_ID
+    message.send_to_channel(c_id1, late_id, user1['u_id'], 'late',
+                            (first_time + second_time) / 2)
+    m_id3 = message.message_send(token1, c_id1, 'third')['message_id']
+
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id3, m_id2, late_id, m_id1]
+    messages = channel.channel_messages(token1, c_id1, before_message_id=m_id2)['messages']
+    assert [msg['message_id'] for msg in messages] == [late_id, m_id1]
+
+    message.message_remove(token1, late_id)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id3, m_id2, m_id1]
+
 def test_valid_pin():
     '''
     Test valid inputs for message_pin and message_unpin function
@@ -652,6 +684,30 @@ def test_valid_react():
     msg0 = messages['messages'][0]
     assert not msg0['reacts']
 
+def test_react_view_not_stored():
+    '''
+    Test that reading messages doesn't write 'is_this_user_reacted' into stored messages
+    '''
+    other.clear()
+    user1, user2 = add_user_info()
+    token1 = user1['token']
+    token2 = user2['token']
+    channel1 = channels.channels_create(token1, 'channel1', True)
+    c_id1 = channel1['channel_id']
+    channel.channel_invite(token1, c_id1, user2['u_id'])
+
+    message1 = message.message_send(token1, c_id1, 'Hello World')
+    message.message_react(token1, message1['message_id'], REACT_ID)
+
+    view1 = channel.channel_messages(token1, c_id1, 0)['messages'][0]
+    view2 = channel.channel_messages(token2, c_id1, 0)['messages'][0]
+    assert view1['reacts'][0]['is_this_user_reacted']
+    assert not view2['reacts'][0]['is_this_user_reacted']
+    assert other.search(token2, 'Hello')['messages'][0]['reacts'][0] == view2['reacts'][0]
+
+    stored = data.get_message(message1['message_id'])[1]
+    assert 'is_this_user_reacted' not in stored['reacts'][0]
+
 def test_react_multiple_channels():
     '''
     Test valid reacts/unreacts of when user is in multiple channels
@@ -769,6 +825,34 @@ def test_check_owner():
     message.message_remove(token3, msg['message_id'])
     assert channel.channel_messages(token2, c_id2, 0)['messages'] == []
 
+def test_message_id_after_delete():
+    '''
+    Tests that removed, emptied and deleted-channel messages can no longer be found
+    '''
+    other.clear()
+    user1, _ = add_user_info()
+    token1 = user1['token']
+
+    channel1 = channels.channels_create(token1, 'channel1', True)
+    c_id1 = channel1['channel_id']
+    m_id1 = message.message_send(token1, c_id1, 'Hello World')['message_id']
+    m_id2 = message.message_send(token1, c_id1, 'Goodbye')['message_id']
+
+    # editing a message to an empty string deletes it
+    message.message_edit(token1, m_id1, '')
+    with pytest.raises(error.InputError):
+        message.message_react(token1, m_id1, REACT_ID)
+
+    message.message_remove(token1, m_id2)
+    with pytest.raises(error.InputError):
+        message.message_remove(token1, m_id2)
+
+    # the last owner leaving deletes the channel and its messages
+    m_id3 = message.message_send(token1, c_id1, 'Last one')['message_id']
+    channel.channel_leave(token1, c_id1)
+    with pytest.raises(error.InputError):
+        message.message_pin(token1, m_id3)
+
 def add_user_info():
     '''
     Function to register and login two users for testing purpose
@@ -2,31 +2,81 @@
 Other functions implementation
 '''
 
+import heapq
+import math
 import jwt
 import data
+import locks
+import scheduler
+import search_cache
+import search_fts
+import search_index
+import search_pool
+import snapshot
+import standup
+import storage_sqlite
 from error import InputError, AccessError
+from message import view_message
 
+# Largest limit search accepts
+MAX_SEARCH_LIMIT = 1000
+
+@locks.writes
 def clear():
     '''
     Resets the internal data of the application to it's initial state
     '''
-    data.users.clear()
-    data.channels.clear()
-    data.tokens.clear()
-    data.MAX_MESSAGE_ID = 0
-    data.reset_codes.clear()
+    data.clear()
+    scheduler.clear()
+    search_index.clear()
+    search_pool.close()
+    search_cache.clear()
     return {}
 
+@locks.writes
+def load(wal_path, fsync, fsync_interval_ms, #pylint: disable=too-many-arguments
+         snapshot_path=None, snapshot_interval=None):
+    '''
+    Reloads the internal data of the application from its latest snapshot
+    and the write-ahead log written after it, then keeps logging to it.
+    A snapshot is taken every snapshot_interval seconds if one is given.
+    '''
+    offset = 0
+    if snapshot_path is not None:
+        offset = snapshot.restore(snapshot_path)
+    data.load(wal_path, fsync, fsync_interval_ms, offset)
+    search_index.rebuild(data.iter_channels())
+    standup.resume_standups()
+    if snapshot_path is not None and snapshot_interval is not None:
+        snapshot.start(snapshot_path, snapshot_interval)
+
+@locks.writes
+def open_storage(path):
+    '''
+    Serves the internal data of the application from the SQLite database at
+    path instead of from memory, picking up where it was left
+    '''
+    data.use_backend('sqlite', path)
+    search_pool.close()
+    if search_fts.enabled():
+        # SQLite copies the messages into the fts5 table itself, so their
+        # text isn't read into memory
+        search_fts.load_messages(path, storage_sqlite.last_message_id())
+    else:
+        search_index.rebuild(data.iter_channels())
+    standup.resume_standups()
 
+
+@locks.users_reads
 def users_all(token):
     '''
     Returns a list of all users and their associated details
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise AccessError(description='Invalid token')
 
     users_list = []
-    for user in data.users:
+    for user in data.iter_users():
         info = {
             'u_id': user['u_id'],
             'email': user['email'],
@@ -42,6 +92,7 @@ def users_all(token):
         'users': users_list
     }
 
+@locks.writes
 def admin_userpermission_change(token, u_id, permission_id):
     '''Takes a user based on u_id and changes their permission_id
     if the user associated with the given token has global permissions'''
@@ -49,7 +100,8 @@ def admin_userpermission_change(token, u_id, permission_id):
     if u_id == 1:
         raise AccessError(description='Cannot change permissions of initial user')
 
-    if u_id > len(data.users) or u_id < 1:
+    user = data.get_user(u_id)
+    if user is None:
         raise InputError(description='Invalid user ID')
 
     valid_permission_id = [1, 2]
@@ -58,16 +110,15 @@ def admin_userpermission_change(token, u_id, permission_id):
         raise InputError(description='Invalid permission ID')
 
 
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise AccessError(description='Invalid token')
 
     owner_id = jwt.decode(token, data.SECRET, algorithms=['HS256'])['u_id']
 
-    # Checks owner_id - 1 since lists are indexed at 0 but the ids start at 1
-    if data.users[owner_id - 1]['permission_id'] == 2:
+    if data.get_user(owner_id)['permission_id'] == 2:
         raise AccessError(description='Invalid user permissions')
 
-    data.users[u_id - 1]['permission_id'] = permission_id
+    data.update_user(user, {'permission_id': permission_id})
 
     # Returns if the user is not given owner permissions
     if permission_id == 2:
@@ -75,52 +126,242 @@ def admin_userpermission_change(token, u_id, permission_id):
 
     # Promotes the user to owner for all channels they are in that
     # they aren't currenlty an owner of
-    for channel in data.channels:
-        for member in channel['all_members']:
-            if member['u_id'] == u_id:
-                if member not in channel['owner_members']:
-                    channel['owner_members'].append(member)
+    for channel_id in data.get_user_channels(u_id):
+        data.add_owner(data.get_channel(channel_id), user)
 
     return {}
 
-def search(token, query_str):
+@locks.reads
+def search(token, query_str, limit=None, cursor=None, #pylint: disable=too-many-arguments
+           channel_id=None, u_id=None, since=None, until=None):
     '''Returns a collection of messages from all the channels that the user
-    is part of that contain the query string'''
-
-    message_list = []
+    is part of that contain the query string.
+    Results can be narrowed to one channel, one author (u_id) and messages
+    created between since and until.
+    If a limit is given, only the newest "limit" matches older than the
+    cursor are returned, along with the cursor for the next page'''
 
     # Converts token to u_id if it is valid
-    if token not in data.tokens:
+    if not data.has_token(token):
         raise AccessError(description='Invalid token')
 
-    u_id = jwt.decode(token, data.SECRET, algorithms=['HS256'])['u_id']
+    viewer_id = jwt.decode(token, data.SECRET, algorithms=['HS256'])['u_id']
+
+    user_channels = data.get_user_channels(viewer_id)
+
+    if channel_id is not None:
+        if data.get_channel(channel_id) is None:
+            raise InputError(description='Invalid channel ID')
+        if channel_id not in user_channels:
+            raise AccessError(description='User is not a member of the channel')
+    if u_id is not None and data.get_user(u_id) is None:
+        raise InputError(description='Invalid user ID')
+    if any(bound is not None and not math.isfinite(bound) for bound in (since, until)):
+        raise InputError(description='Time must be a finite number')
 
-    # Loops through every member of every channel. If the user associated
-    # with the given token is a member, loops through every message
-    # in that channel. If the message contains the query_str, it is added
-    # to the returned message list.
+    query = {
+        'query_str': query_str,
+        'channel_id': channel_id,
+        'u_id': u_id,
+        'since': since,
+        'until': until,
+    }
 
-    for channel in data.channels:
-        for member in channel['all_members']:
-            if member['u_id'] == u_id:
-                for msg in channel['messages']:
-                    if query_str in msg['message']:
-                        message_list.append(msg)
+    before = None
+    if limit is not None:
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise InputError(description=f'Limit must be between 1 and {MAX_SEARCH_LIMIT}')
+        before = parse_cursor(cursor)
 
-    # Sets up 'is_user_reacted' key in each message
-    for msg in message_list:
-        set_if_reacted(msg['reacts'], u_id)
+    with locks.channel_reading(user_channels):
+        message_ids, next_cursor = cached_search(viewer_id, user_channels,
+                                                 dict(query, limit=limit, cursor=cursor), before)
 
+        # Copies each message with the 'is_this_user_reacted' key for this user
+        messages = [view_message(data.get_message(message_id)[1], viewer_id)
+                    for message_id in message_ids]
+    if limit is None:
+        return {
+            'messages': messages
+        }
     return {
-        'messages': message_list
+        'messages': messages,
+        'next_cursor': next_cursor,
     }
 
-def set_if_reacted(all_reacts, u_id):
-    '''
-    Checks if the given user has reacted to the given message
-    '''
-    for react in all_reacts:
-        if u_id in react['u_ids']:
-            react['is_this_user_reacted'] = True
-        else:
-            react['is_this_user_reacted'] = False
+def cached_search(viewer_id, user_channels, query, before):
+    '''Returns the result of run_search, reusing the result of the same search
+    if none of the channels it covered have been written to since'''
+
+    key = search_cache.make_key(viewer_id, query)
+    cached = search_cache.get(key)
+    if cached is None:
+        # Versions are read first so a write during the search invalidates it
+        versions = search_cache.channel_versions(user_channels)
+        cached = run_search(user_channels, query, before)
+        search_cache.put(key, cached[0], cached[1], versions)
+    return cached
+
+def run_search(user_channels, query, before):
+    '''Returns the message_ids of the messages a search finds and the cursor
+    for the next page, which is None without a limit or on the last page'''
+
+    limit = query['limit']
+    if limit is None:
+        return [msg['message_id'] for msg in all_matches(user_channels, query)], None
+
+    # Finds one extra match to know whether there is another page
+    matches = newest_matches(user_channels, query, limit + 1, before)
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        time_created, message_id = data.message_key(matches[-1])
+        next_cursor = f'{time_created!r}:{message_id}'
+    return [msg['message_id'] for msg in matches], next_cursor
+
+def all_matches(user_channels, query):
+    '''Returns every message in the given channels that matches the query,
+    ordered by channel then by time, or best match first with the fts5 engine'''
+
+    if search_fts.enabled():
+        return [data.get_message(message_id)[1]
+                for message_id in search_fts.search(query, user_channels)]
+
+    query_str = query['query_str']
+    pooled = pooled_channels(user_channels, query)
+    if pooled is not None:
+        candidates = {message_id for _, message_id in search_pool.scan(pooled, query_str)}
+    else:
+        candidates = search_index.candidates(query_str, query['channel_id'],
+                                             query['u_id'], query['since'], query['until'])
+
+    if candidates is None:
+        # The query has no tokens to look up and no filters, or the index is
+        # being rebuilt, so loops through every channel searched, and every
+        # message in that channel
+        matches = []
+        for channel_id in sorted(scanned_channels(user_channels, query)):
+            for msg in data.iter_channel_messages(data.get_channel(channel_id)):
+                if is_match(msg, query):
+                    matches.append(msg)
+        return matches
+
+    # Keeps the candidates from the index that are in the user's channels
+    # and match the query, in the order a scan would find them
+    found = []
+    for message_id in candidates:
+        channel, msg = data.get_message(message_id)
+        if is_searched(channel, user_channels) and is_match(msg, query):
+            found.append(((channel['channel_id'], data.message_key(msg)), msg))
+    found.sort(key=lambda match: match[0])
+    return [msg for _, msg in found]
+
+def pooled_channels(user_channels, query):
+    '''Returns the channels a search should scan in the process pool, or None if
+    it should use the index. Queries shorter than a trigram can't be looked up
+    by trigram and their tokens can match most of the vocabulary, so they are
+    scanned, as is every query while the index is rebuilt, unless an author or
+    time filter narrows them down first'''
+
+    if (len(query['query_str']) >= 3 and search_index.ready.is_set()) \
+            or query['u_id'] is not None \
+            or query['since'] is not None or query['until'] is not None:
+        return None
+    channel_ids = scanned_channels(user_channels, query)
+    if not search_pool.is_worthwhile(channel_ids):
+        return None
+    return channel_ids
+
+def scanned_channels(user_channels, query):
+    '''Returns the channels a search looks through, which is only the one it
+    is filtered to if it has a channel filter'''
+
+    if query['channel_id'] is not None:
+        return {query['channel_id']}
+    return user_channels
+
+def search_metrics():
+    '''Returns the hit rate and eviction count of the search result cache'''
+
+    return search_cache.metrics()
+
+def newest_matches(user_channels, query, count, before):
+    '''Returns up to "count" messages in the given channels that match the
+    query and are older than the key "before", newest first.
+    Messages are checked newest first and checking stops after "count" matches'''
+
+    if search_fts.enabled():
+        return [data.get_message(message_id)[1]
+                for message_id in search_fts.search(query, user_channels, before, count)]
+
+    pooled = pooled_channels(user_channels, query)
+    if pooled is not None:
+        # Only the channel filter is used with the pool, so every key found matches
+        return [data.get_message(message_id)[1] for _, message_id in
+                search_pool.scan(pooled, query['query_str'], count, before)]
+
+    matches = []
+    candidates = search_index.candidates(query['query_str'], query['channel_id'],
+                                         query['u_id'], query['since'], query['until'])
+
+    if candidates is None:
+        # Merges the channels' messages from newest to oldest
+        newest = heapq.merge(*[data.iter_newest(data.get_channel(channel_id), before)
+                               for channel_id in scanned_channels(user_channels, query)],
+                             key=lambda item: item[0], reverse=True)
+        for _, msg in newest:
+            if is_match(msg, query):
+                matches.append(msg)
+                if len(matches) == count:
+                    break
+        return matches
+
+    # Heap of the candidates in the user's channels, newest on top
+    heap = []
+    for message_id in candidates:
+        channel, msg = data.get_message(message_id)
+        if is_searched(channel, user_channels):
+            time_created, _ = data.message_key(msg)
+            if before is None or (time_created, message_id) < before:
+                heap.append((-time_created, -message_id, msg))
+    heapq.heapify(heap)
+
+    while heap and len(matches) < count:
+        msg = heapq.heappop(heap)[2]
+        if is_match(msg, query):
+            matches.append(msg)
+    return matches
+
+def is_searched(channel, user_channels):
+    '''Checks if a candidate from the index was sent to one of the channels
+    searched. Only those channels are locked, so a candidate from another
+    channel may have been removed since the index was read, leaving no channel'''
+
+    return channel is not None and channel['channel_id'] in user_channels
+
+def is_match(msg, query):
+    '''Checks a message against the query string, author and time window of a
+    search. The channel filter is applied by picking the channels searched'''
+
+    if query['u_id'] is not None and msg['u_id'] != query['u_id']:
+        return False
+    if query['since'] is not None and msg['time_created'] < query['since']:
+        return False
+    if query['until'] is not None and msg['time_created'] > query['until']:
+        return False
+    return query['query_str'] in msg['message']
+
+def parse_cursor(cursor):
+    '''Turns a search cursor of the form "time_created:message_id" into a
+    message key'''
+
+    if cursor is None:
+        return None
+    try:
+        time_created, message_id = cursor.split(':')
+        key = (float(time_created), int(message_id))
+    except ValueError as err:
+        raise InputError(description='Invalid cursor') from err
+    if not math.isfinite(key[0]):
+        raise InputError(description='Invalid cursor')
+    return key
@@ -6,6 +6,8 @@ import channel
 import channels
 import message
 import other
+import search_cache
+import search_pool
 from error import InputError, AccessError
 
 def test_clear():
@@ -436,3 +438,221 @@ def test_search_invalid_token():
 
     with pytest.raises(AccessError):
         assert other.search(test_dict['token'], 'key')
+
+def test_search_after_edit_remove_and_leave():
+    '''Tests that search follows edited, removed and deleted messages'''
+    other.clear()
+
+    test_token = auth.auth_register('test@email.com', 'test_password',
+                                    'test_first', 'test_last')['token']
+    channel1_id = channels.channels_create(test_token, 'channel1', True)['channel_id']
+    channel2_id = channels.channels_create(test_token, 'channel2', True)['channel_id']
+
+    message1_id = message.message_send(test_token, channel1_id, 'my key ring')['message_id']
+    message2_id = message.message_send(test_token, channel2_id, 'Monkey')['message_id']
+    message3_id = message.message_send(test_token, channel1_id, 'Lock')['message_id']
+
+    messages = other.search(test_token, 'key')['messages']
+    assert [msg['message_id'] for msg in messages] == [message1_id, message2_id]
+
+    message.message_edit(test_token, message3_id, 'keyhole')
+    message.message_remove(test_token, message1_id)
+    messages = other.search(test_token, 'key')['messages']
+    assert [msg['message_id'] for msg in messages] == [message3_id, message2_id]
+
+    channel.channel_leave(test_token, channel2_id)
+    messages = other.search(test_token, 'key')['messages']
+    assert [msg['message_id'] for msg in messages] == [message3_id]
+
+def test_search_limit_and_cursor():
+    '''Tests paging through the newest search results with limit and cursor'''
+    other.clear()
+
+    test_token = auth.auth_register('test@email.com', 'test_password',
+                                    'test_first', 'test_last')['token']
+    channel1_id = channels.channels_create(test_token, 'channel1', True)['channel_id']
+    channel2_id = channels.channels_create(test_token, 'channel2', True)['channel_id']
+
+    key_ids = []
+    for num in range(7):
+        channel_id = channel1_id if num % 2 else channel2_id
+        key_ids.append(message.message_send(test_token, channel_id, f'key {num}')['message_id'])
+        message.message_send(test_token, channel_id, f'lock {num}')
+
+    for query_str in ['key', ' ']:
+        page = other.search(test_token, query_str, 3)
+        if query_str == 'key':
+            assert [msg['message_id'] for msg in page['messages']] == key_ids[:3:-1]
+        assert len(page['messages']) == 3
+
+        seen = []
+        cursor = None
+        while True:
+            page = other.search(test_token, query_str, 3, cursor)
+            seen += [msg['message_id'] for msg in page['messages']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        expected = [msg['message_id'] for msg in other.search(test_token, query_str)['messages']]
+        assert sorted(seen, reverse=True) == seen
+        assert sorted(seen) == sorted(expected)
+
+    assert other.search(test_token, 'key', 7)['next_cursor'] is None
+
+    with pytest.raises(InputError):
+        other.search(test_token, 'key', 0)
+    with pytest.raises(InputError):
+        other.search(test_token, 'key', 3, 'not a cursor')
+    for cursor in ('nan:2', 'inf:2', '-inf:2'):
+        with pytest.raises(InputError):
+            other.search(test_token, 'key', 3, cursor)
+
+def test_search_filters():
+    '''Tests narrowing search results by channel, author and time'''
+    other.clear()
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'test_first', 'test_last')
+    user2 = auth.auth_register('test2@email.com', 'test_password', 'test_first', 'test_last')
+    user3 = auth.auth_register('test3@email.com', 'test_password', 'test_first', 'test_last')
+    channel1_id = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    channel2_id = channels.channels_create(user1['token'], 'channel2', True)['channel_id']
+    channel3_id = channels.channels_create(user3['token'], 'channel3', True)['channel_id']
+    channel.channel_join(user2['token'], channel1_id)
+
+    m_id1 = message.message_send(user1['token'], channel1_id, 'Hello')['message_id']
+    m_id2 = message.message_send(user2['token'], channel1_id, 'Hello there')['message_id']
+    m_id3 = message.message_send(user1['token'], channel2_id, 'Hello again')['message_id']
+    message.message_send(user3['token'], channel3_id, 'Hello')
+
+    def found(**filters):
+        return [msg['message_id'] for msg in
+                other.search(user1['token'], 'Hello', **filters)['messages']]
+
+    assert found(channel_id=channel1_id) == [m_id1, m_id2]
+    assert found(u_id=user1['u_id']) == [m_id1, m_id3]
+    assert found(channel_id=channel1_id, u_id=user2['u_id']) == [m_id2]
+    assert found(u_id=user3['u_id']) == []
+    assert found(limit=1, channel_id=channel1_id) == [m_id2]
+
+    time_created = {msg['message_id']: msg['time_created']
+                    for msg in other.search(user1['token'], 'Hello')['messages']}
+    assert found(since=time_created[m_id2]) == [m_id2, m_id3]
+    assert found(until=time_created[m_id1]) == [m_id1]
+    assert found(since=time_created[m_id3] + 1) == []
+
+    with pytest.raises(InputError):
+        other.search(user1['token'], 'Hello', channel_id=channel3_id + 1)
+    with pytest.raises(AccessError):
+        other.search(user1['token'], 'Hello', channel_id=channel3_id)
+    with pytest.raises(InputError):
+        other.search(user1['token'], 'Hello', u_id=user3['u_id'] + 1)
+    with pytest.raises(InputError):
+        other.search(user1['token'], 'Hello', until=float('inf'))
+    with pytest.raises(InputError):
+        other.search(user1['token'], 'Hello', since=float('nan'))
+
+def test_search_process_pool(monkeypatch):
+    '''Tests that searches split across worker processes find the same messages'''
+    other.clear()
+    monkeypatch.setattr(search_pool, 'WORKERS', 2)
+    monkeypatch.setattr(search_pool, 'MIN_MESSAGES', 0)
+
+    test_token = auth.auth_register('test@email.com', 'test_password',
+                                    'test_first', 'test_last')['token']
+    channel_ids = [channels.channels_create(test_token, f'channel{num}', True)['channel_id']
+                   for num in range(3)]
+    for num in range(30):
+        message.message_send(test_token, channel_ids[num % 3], f'message {num}')
+
+    scanned = []
+    def record_scan(channel_ids, query_str, *args, scan=search_pool.scan):
+        scanned.append(query_str)
+        return scan(channel_ids, query_str, *args)
+    monkeypatch.setattr(search_pool, 'scan', record_scan)
+
+    pooled = other.search(test_token, ' ')
+    pooled_page = other.search(test_token, ' ', 4)
+    pooled_next = other.search(test_token, ' ', 4, pooled_page['next_cursor'])
+    pooled_short = other.search(test_token, '1')
+    pooled_channel = other.search(test_token, 'e', 4, channel_id=channel_ids[1])
+    assert scanned == [' ', ' ', ' ', '1', 'e']
+    monkeypatch.setattr(search_pool, 'WORKERS', 0)
+    assert pooled == other.search(test_token, ' ')
+    assert len(pooled['messages']) == 30
+    assert pooled_page == other.search(test_token, ' ', 4)
+    assert pooled_next == other.search(test_token, ' ', 4, pooled_page['next_cursor'])
+    assert pooled_short == other.search(test_token, '1')
+    assert len(pooled_short['messages']) == 12
+    assert pooled_channel == other.search(test_token, 'e', 4, channel_id=channel_ids[1])
+
+    # the workers are kept, and sent what changed instead of whole channels again
+    monkeypatch.setattr(search_pool, 'WORKERS', 2)
+    workers = search_pool.pool['workers']
+    shipped = []
+    def record_shard(channel, shard=search_pool.shard):
+        shipped.append(channel['channel_id'])
+        return shard(channel)
+    monkeypatch.setattr(search_pool, 'shard', record_shard)
+    edited = pooled['messages'][0]['message_id']
+    removed = pooled['messages'][1]['message_id']
+    message.message_edit(test_token, edited, 'edited')
+    message.message_remove(test_token, removed)
+    added = message.message_send(test_token, channel_ids[0], 'new message')['message_id']
+    found = [msg['message_id'] for msg in other.search(test_token, ' ')['messages']]
+    assert len(found) == 29 and added in found
+    assert edited not in found and removed not in found
+    assert [msg['message_id'] for msg in other.search(test_token, 'ed')['messages']] == [edited]
+    assert search_pool.pool['workers'] is workers
+    assert not shipped
+
+    # a deleted channel's shard is dropped
+    channel.delete_entire_channel(channel_ids[2])
+    assert channel_ids[2] not in search_pool.pool['loaded']
+    assert len(other.search(test_token, ' ')['messages']) == 19
+    assert not shipped
+    other.clear()
+
+def test_search_cache(monkeypatch):
+    '''Tests that cached search results are invalidated by writes and membership'''
+    other.clear()
+    monkeypatch.setattr(search_cache, 'CAPACITY', 2)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'test_first', 'test_last')
+    user2 = auth.auth_register('test2@email.com', 'test_password', 'test_first', 'test_last')
+    channel1_id = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    channel2_id = channels.channels_create(user2['token'], 'channel2', True)['channel_id']
+    m_id1 = message.message_send(user1['token'], channel1_id, 'Hello')['message_id']
+    m_id2 = message.message_send(user2['token'], channel2_id, 'Hello')['message_id']
+
+    def found():
+        return [msg['message_id'] for msg in other.search(user1['token'], 'Hello')['messages']]
+
+    assert found() == [m_id1]
+    assert found() == [m_id1]
+    assert other.search_metrics()['hits'] == 1
+
+    # reacts are shown as they are now on a hit
+    message.message_react(user1['token'], m_id1, 1)
+    assert other.search(user1['token'], 'Hello')['messages'][0]['reacts'][0]['u_ids'] \
+        == [user1['u_id']]
+    assert other.search_metrics()['hits'] == 2
+
+    # writes to a channel the user isn't in don't invalidate the entry
+    message.message_send(user2['token'], channel2_id, 'Hello again')
+    assert found() == [m_id1]
+    assert other.search_metrics()['hits'] == 3
+
+    m_id3 = message.message_send(user1['token'], channel1_id, 'Hello there')['message_id']
+    assert found() == [m_id1, m_id3]
+    message.message_edit(user1['token'], m_id3, 'Bye')
+    assert found() == [m_id1]
+    channel.channel_join(user1['token'], channel2_id)
+    assert found() == [m_id1, m_id2, m_id2 + 1]
+    assert other.search_metrics()['hits'] == 3
+
+    other.search(user1['token'], 'a')
+    other.search(user1['token'], 'b')
+    metrics = other.search_metrics()
+    assert metrics['size'] == 2
+    assert metrics['evictions'] >= 1
+    assert metrics['hit_rate'] == metrics['hits'] / (metrics['hits'] + metrics['misses'])
@@ -0,0 +1,185 @@
+'''
+Follower mode, where a server keeps a copy of a primary server's state by
+tailing the primary's write-ahead log, and serves read-only routes from it.
+
+A follower starts from the primary's latest snapshot if it can read one,
+then applies every record appended to the log after it, polling the log
+every config.FOLLOW_INTERVAL_MS. A record is only applied once its line is complete,
+and the follower never writes to the log, so it can follow a primary that
+is running or restarting. The log only has to be readable by the follower,
+for example through a shared volume when the follower runs on another host.
+
+Changes are applied through data.apply() like a restart replays them, and
+mirrored into the search index. Scheduled messages are only kept by the
+primary, which sends them and logs the messages it sends.
+'''
+
+import json
+import os
+import threading
+import time
+import data
+import locks
+import search_cache
+import search_index
+import search_pool
+import snapshot
+
+# Routes a follower can't answer even though they only read, because what
+# they read isn't in the write-ahead log
+PRIMARY_ONLY_ROUTES = ('/message/sendlater/list', '/scheduler/metrics', '/snapshot/metrics')
+
+# Primary's log being followed, how far into it has been applied, the number
+# of records applied, the size of the log when last polled, and when the
+# follower last had every record in the log applied
+follower = {
+    'path': None,
+    'offset': 0,
+    'records': 0,
+    'primary_offset': 0,
+    'caught_up_at': None,
+}
+
+# Stops the polling thread when set
+stopping = threading.Event()
+worker = None
+
+def follow(path, interval_ms=20, snapshot_path=None):
+    '''
+    Loads the state of the primary logging to path, starting from the
+    snapshot at snapshot_path if there is one, then keeps applying what the
+    primary logs every interval_ms milliseconds
+    '''
+    global worker # pylint: disable=global-statement
+    stop()
+    reset(path, snapshot_path)
+    catch_up()
+    stopping.clear()
+    worker = threading.Thread(target=run, args=(interval_ms / 1000, snapshot_path),
+                              name='replica', daemon=True)
+    worker.start()
+
+@locks.writes
+def reset(path, snapshot_path=None):
+    '''
+    Drops the state and loads the primary's snapshot if there is one
+    '''
+    data.clear()
+    search_index.clear()
+    search_pool.close()
+    search_cache.clear()
+    offset = 0
+    if snapshot_path is not None:
+        offset = snapshot.restore(snapshot_path)
+        search_index.rebuild(data.iter_channels())
+    follower.update({
+        'path': path,
+        'offset': offset,
+        'records': 0,
+        'primary_offset': offset,
+        'caught_up_at': None,
+    })
+
+def is_follower():
+    '''
+    Checks if this server is following a primary
+    '''
+    return follower['path'] is not None
+
+def run(interval, snapshot_path):
+    '''
+    Polling loop, applying new records until stopped
+    '''
+    while not stopping.wait(interval):
+        if os.path.exists(follower['path']) and \
+                os.path.getsize(follower['path']) < follower['offset']:
+            # The log was replaced rather than appended to, so the state is
+            # loaded from the start again
+            reset(follower['path'], snapshot_path)
+        catch_up()
+
+def catch_up():
+    '''
+    Applies every complete record appended to the primary's log since the
+    last call, and returns the number applied
+    '''
+    path = follower['path']
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path, 'rb') as log_file:
+        log_file.seek(follower['offset'])
+        with locks.writing():
+            for line in log_file:
+                try:
+                    record = json.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    # The primary is still writing this record
+                    break
+                apply(record)
+                follower['offset'] += len(line)
+                applied += 1
+        primary_offset = max(os.fstat(log_file.fileno()).st_size, follower['offset'])
+    follower['records'] += applied
+    follower['primary_offset'] = primary_offset
+    if follower['offset'] == primary_offset:
+        follower['caught_up_at'] = time.time()
+    return applied
+
+def apply(record):
+    '''
+    Applies one record from the primary's log, keeping the search index and
+    caches in step with it
+    '''
+    kind, args = record[0], record[1:]
+    if kind == 'remove_channel':
+        search_index.forget_channel(data.get_channel(args[0]))
+    data.apply(record)
+    if kind == 'add_message':
+        search_index.add_message(data.get_message(args[1]['message_id'])[1], args[0])
+    elif kind == 'update_message' and 'message' in args[1]:
+        search_index.update_message(data.get_message(args[0])[1])
+    elif kind == 'remove_message':
+        search_index.remove_message(args[0])
+    elif kind == 'clear':
+        search_index.clear()
+        search_pool.close()
+        search_cache.clear()
+
+def status():
+    '''
+    Returns how far behind the primary this follower is, in bytes of log not
+    yet applied and in seconds since it last had every record applied
+    '''
+    if not is_follower():
+        return {'role': 'primary'}
+    path = follower['path']
+    if os.path.exists(path):
+        follower['primary_offset'] = max(os.path.getsize(path), follower['offset'])
+    lag_bytes = follower['primary_offset'] - follower['offset']
+    lag_seconds = 0.0
+    if follower['caught_up_at'] is None:
+        lag_seconds = None
+    elif lag_bytes:
+        lag_seconds = time.time() - follower['caught_up_at']
+    return {
+        'role': 'follower',
+        'applied_offset': follower['offset'],
+        'primary_offset': follower['primary_offset'],
+        'records_applied': follower['records'],
+        'lag_bytes': lag_bytes,
+        'lag_seconds': lag_seconds,
+    }
+
+def stop():
+    '''
+    Stops following the primary
+    '''
+    global worker # pylint: disable=global-statement
+    if worker is not None:
+        stopping.set()
+        worker.join()
+        worker = None
+    follower['path'] = None
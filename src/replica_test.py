@@ -0,0 +1,145 @@
+'''
+Tests for followers of a primary server's write-ahead log
+'''
+
+import os
+import re
+import signal
+from subprocess import Popen, PIPE
+from time import sleep
+import requests
+import channel
+import other
+import replica
+import search_index
+import data
+
+def start_server(**env):
+    '''
+    Starts a server with the given environment variables, returning the
+    process and its url
+    '''
+    url_re = re.compile(r' \* Running on ([^ ]*)')
+    server = Popen(["python3", "src/server.py"], stderr=PIPE, stdout=PIPE,
+                   env=dict(os.environ, **env))
+    local_url = url_re.match(server.stderr.readline().decode())
+    if not local_url:
+        server.kill()
+        raise Exception("Couldn't get URL from local server")
+    return server, local_url.group(1)
+
+def stop_server(server):
+    '''
+    Stops a server started by start_server
+    '''
+    server.send_signal(signal.SIGINT)
+    waited = 0
+    while server.poll() is None and waited < 5:
+        sleep(0.1)
+        waited += 0.1
+    if server.poll() is None:
+        server.kill()
+
+def wait_for_follower():
+    '''
+    Waits until this process has applied everything the primary logged
+    '''
+    waited = 0
+    while replica.status()['lag_bytes'] and waited < 5:
+        sleep(0.05)
+        waited += 0.05
+    assert replica.status()['lag_bytes'] == 0
+
+def test_replica_follows_primary(tmp_path):
+    '''
+    Tests that a follower applies the primary's changes as they are logged
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    primary, url = start_server(FLOCKR_WAL=log_path, FLOCKR_WAL_FSYNC='always')
+    try:
+        user1 = requests.post(url + 'auth/register', json={
+            'email': 'test@email.com', 'password': 'test_password',
+            'name_first': 'Hayden', 'name_last': 'Jacobs'}).json()
+        token1 = user1['token']
+        c_id1 = requests.post(url + 'channels/create', json={
+            'token': token1, 'name': 'channel1', 'is_public': True}).json()['channel_id']
+        m_id1 = requests.post(url + 'message/send', json={
+            'token': token1, 'channel_id': c_id1, 'message': 'Hello there'}).json()['message_id']
+
+        # a follower started late catches up with what was logged before it
+        replica.follow(log_path, 10)
+        assert replica.is_follower()
+        assert replica.status()['role'] == 'follower'
+        assert replica.status()['records_applied'] > 0
+        assert [msg['message_id'] for msg in other.search(token1, 'Hello')['messages']] == [m_id1]
+
+        # and keeps applying new changes, the search index included
+        requests.put(url + 'message/edit', json={
+            'token': token1, 'message_id': m_id1, 'message': 'Goodbye'})
+        m_id2 = requests.post(url + 'message/send', json={
+            'token': token1, 'channel_id': c_id1, 'message': 'Hello again'}).json()['message_id']
+        wait_for_follower()
+        assert [msg['message_id'] for msg in other.search(token1, 'Hello')['messages']] == [m_id2]
+        assert [msg['message_id'] for msg in other.search(token1, 'Goodbye')['messages']] == [m_id1]
+        messages = channel.channel_messages(token1, c_id1, 0)['messages']
+        assert [msg['message'] for msg in messages] == ['Hello again', 'Goodbye']
+        assert replica.status()['lag_seconds'] == 0.0
+
+        requests.delete(url + 'clear')
+        wait_for_follower()
+        assert data.count_users() == 0
+        assert data.count_channels() == 0
+        assert not search_index.indexed
+    finally:
+        replica.stop()
+        stop_server(primary)
+        other.clear()
+    assert not replica.is_follower()
+
+def test_replica_server(tmp_path):
+    '''
+    Tests that a follower server serves reads, turns away writes and
+    reports its lag
+    '''
+    log_path = str(tmp_path / 'flockr.wal')
+    primary, primary_url = start_server(FLOCKR_WAL=log_path, FLOCKR_WAL_FSYNC='always')
+    follower, follower_url = start_server(FLOCKR_FOLLOW=log_path, FLOCKR_FOLLOW_INTERVAL_MS='10')
+    try:
+        user1 = requests.post(primary_url + 'auth/register', json={
+            'email': 'test@email.com', 'password': 'test_password',
+            'name_first': 'Hayden', 'name_last': 'Jacobs'}).json()
+        token1 = user1['token']
+        c_id1 = requests.post(primary_url + 'channels/create', json={
+            'token': token1, 'name': 'channel1', 'is_public': True}).json()['channel_id']
+        requests.post(primary_url + 'message/send', json={
+            'token': token1, 'channel_id': c_id1, 'message': 'Hello there'})
+
+        waited = 0
+        status = requests.get(follower_url + 'replica/status').json()
+        while (status['lag_bytes'] or status['applied_offset'] == 0) and waited < 5:
+            sleep(0.05)
+            waited += 0.05
+            status = requests.get(follower_url + 'replica/status').json()
+        assert status['role'] == 'follower'
+        assert status['lag_bytes'] == 0
+        assert status['applied_offset'] == os.path.getsize(log_path)
+        assert requests.get(primary_url + 'replica/status').json() == {'role': 'primary'}
+
+        for route, params in [('channels/list', {'token': token1}),
+                              ('users/all', {'token': token1}),
+                              ('channel/messages', {'token': token1, 'channel_id': c_id1,
+                                                    'start': 0}),
+                              ('search', {'token': token1, 'query_str': 'Hello'})]:
+            assert requests.get(follower_url + route, params=params).json() == \
+                requests.get(primary_url + route, params=params).json()
+
+        response = requests.post(follower_url + 'message/send', json={
+            'token': token1, 'channel_id': c_id1, 'message': 'Not here'})
+        assert response.status_code == 400
+        assert 'read-only' in response.json()['message']
+        assert requests.get(follower_url + 'message/sendlater/list', params={
+            'token': token1, 'channel_id': c_id1}).status_code == 400
+    finally:
+        stop_server(follower)
+        stop_server(primary)
@@ -0,0 +1,333 @@
+'''
+Scheduler for messages sent with message_sendlater.
+A single worker thread waits on a heap ordered by send time and sends
+each message when it is due, instead of starting a timer thread per message.
+
+The queue can also be logged to a file with load(), so that messages which
+haven't been sent yet survive a restart. Every change is appended to the log
+as one JSON line:
+
+    ["S", message_id, channel_id, u_id, time_sent, message]    scheduled
+    ["R", message_id, time_sent]                               rescheduled
+    ["C", message_id]                                          cancelled
+    ["D", message_id]                                          sent
+
+The log is rewritten with only the pending messages whenever it grows well
+past them, so reloading it costs time proportional to what is still pending.
+Messages being sent are kept in the rewritten log until their "D" record is
+written, so a rewrite part way through sending them doesn't lose them.
+'''
+
+import heapq
+import json
+import os
+import threading
+import time
+import data
+import locks
+
+# Heap of (time_sent, message_id) for every scheduled message
+queue = []
+
+# Scheduled messages that have not been sent yet, by message_id
+pending = {}
+
+# Messages taken off pending by the worker whose "D" record isn't logged yet,
+# by message_id
+in_flight = {}
+
+# message_ids of pending messages, by (u_id, channel_id) of the sender
+by_sender = {}
+
+# Counters reported by metrics()
+stats = {
+    'dispatched': 0,
+    'failed': 0,
+    'last_lag': 0.0,
+    'max_lag': 0.0,
+}
+
+# Open log file, the number of records in it, and the path it was opened from
+log = {
+    'file': None,
+    'records': 0,
+    'path': None,
+}
+
+# The log is compacted once it holds this many more records than twice
+# the number of pending messages
+COMPACT_SLACK = 1000
+
+condition = threading.Condition()
+worker = None
+
+def schedule(message_id, channel_id, u_id, message, time_sent):
+    '''
+    Queues a message to be sent to a channel at time_sent
+    '''
+    with condition:
+        add_entry({
+            'message_id': message_id,
+            'channel_id': channel_id,
+            'u_id': u_id,
+            'message': message,
+            'time_sent': time_sent,
+        })
+        write_log(['S', message_id, channel_id, u_id, time_sent, message])
+        start_worker()
+        condition.notify()
+
+def add_entry(entry):
+    '''
+    Adds a scheduled message to the heap and the pending indexes
+    '''
+    pending[entry['message_id']] = entry
+    by_sender.setdefault((entry['u_id'], entry['channel_id']), set()).add(entry['message_id'])
+    heapq.heappush(queue, (entry['time_sent'], entry['message_id']))
+
+def get(message_id):
+    '''
+    Returns a copy of a pending scheduled message, or None
+    '''
+    with condition:
+        entry = pending.get(message_id)
+        return None if entry is None else dict(entry)
+
+def list_pending(u_id, channel_id):
+    '''
+    Returns the user's pending scheduled messages in a channel, soonest first
+    '''
+    with condition:
+        entries = [dict(pending[message_id])
+                   for message_id in by_sender.get((u_id, channel_id), ())]
+    return sorted(entries, key=lambda entry: (entry['time_sent'], entry['message_id']))
+
+def cancel(message_id):
+    '''
+    Removes a pending scheduled message, returning it or None if it wasn't pending.
+    Its heap entry is left behind and skipped when it reaches the top.
+    '''
+    with condition:
+        entry = pending.pop(message_id, None)
+        if entry is not None:
+            forget_sender(entry)
+            write_log(['C', message_id])
+        return entry
+
+def reschedule(message_id, time_sent):
+    '''
+    Moves a pending scheduled message to a new send time, returning it or None
+    if it wasn't pending. The old heap entry becomes stale and is skipped.
+    '''
+    with condition:
+        entry = pending.get(message_id)
+        if entry is None:
+            return None
+        entry['time_sent'] = time_sent
+        heapq.heappush(queue, (time_sent, message_id))
+        write_log(['R', message_id, time_sent])
+        condition.notify()
+        return dict(entry)
+
+def forget_sender(entry):
+    '''
+    Removes a scheduled message from its sender's index
+    '''
+    key = (entry['u_id'], entry['channel_id'])
+    message_ids = by_sender.get(key)
+    if message_ids is not None:
+        message_ids.discard(entry['message_id'])
+        if not message_ids:
+            del by_sender[key]
+
+def start_worker():
+    '''
+    Starts the worker thread if it isn't running yet
+    '''
+    global worker # pylint: disable=global-statement
+    if worker is None or not worker.is_alive():
+        worker = threading.Thread(target=run, name='sendlater-scheduler', daemon=True)
+        worker.start()
+
+def run():
+    '''
+    Worker loop, sends every message that is due then sleeps until the next one
+    '''
+    while True:
+        with condition:
+            due = pop_due(time.time())
+            while not due:
+                timeout = queue[0][0] - time.time() if queue else None
+                condition.wait(timeout)
+                due = pop_due(time.time())
+        dispatch(due)
+
+def pop_due(now):
+    '''
+    Removes and returns every scheduled message whose send time has passed.
+    Heap entries that no longer match a pending message are skipped.
+    '''
+    due = []
+    while queue and queue[0][0] <= now:
+        time_sent, message_id = heapq.heappop(queue)
+        entry = pending.get(message_id)
+        if entry is None or entry['time_sent'] != time_sent:
+            continue
+        del pending[message_id]
+        forget_sender(entry)
+        in_flight[message_id] = entry
+        due.append(entry)
+    return due
+
+def dispatch(due):
+    '''
+    Sends a batch of due messages to their channels
+    '''
+    # Imported here since message imports this module
+    from message import send_to_channel # pylint: disable=import-outside-toplevel
+
+    for entry in due:
+        try:
+            with locks.channel_writing([entry['channel_id']]):
+                # Skips a message sent just before a crash kept its 'D' record
+                # from being logged, as replaying the write-ahead log added it
+                if data.get_message(entry['message_id'])[1] is None:
+                    send_to_channel(entry['channel_id'], entry['message_id'], entry['u_id'],
+                                    entry['message'], entry['time_sent'])
+                    lag = max(time.time() - entry['time_sent'], 0.0)
+                    stats['dispatched'] += 1
+                    stats['last_lag'] = lag
+                    stats['max_lag'] = max(stats['max_lag'], lag)
+        except Exception: # pylint: disable=broad-except
+            # A message that can't be sent is dropped, without stopping the worker
+            stats['failed'] += 1
+
+    with condition:
+        for entry in due:
+            in_flight.pop(entry['message_id'], None)
+            write_log(['D', entry['message_id']])
+
+def metrics():
+    '''
+    Returns the scheduler's queue depth and dispatch lag
+    '''
+    with condition:
+        overdue = 0.0
+        if queue:
+            overdue = max(time.time() - queue[0][0], 0.0)
+        return {
+            'depth': len(pending),
+            'dispatched': stats['dispatched'],
+            'failed': stats['failed'],
+            'last_lag': stats['last_lag'],
+            'max_lag': stats['max_lag'],
+            'overdue': overdue,
+        }
+
+def clear():
+    '''
+    Drops every scheduled message and resets the counters
+    '''
+    with condition:
+        queue.clear()
+        pending.clear()
+        in_flight.clear()
+        by_sender.clear()
+        stats['dispatched'] = 0
+        stats['failed'] = 0
+        stats['last_lag'] = 0.0
+        stats['max_lag'] = 0.0
+        if log['file'] is not None:
+            compact()
+        condition.notify()
+
+def load(path):
+    '''
+    Reloads the scheduled messages logged at path and keeps logging to it.
+    Messages that became due while the server was down are sent straight
+    away as one batch, the rest are queued again.
+    '''
+    entries = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash, nothing after it is usable
+                    break
+                replay(entries, record)
+
+    with condition:
+        for entry in entries.values():
+            data.reserve_message_id(entry['message_id'])
+            # A message already in its channel was sent before the restart
+            if data.get_message(entry['message_id'])[1] is None:
+                add_entry(entry)
+        log['path'] = path
+        compact()
+        if pending:
+            start_worker()
+        condition.notify()
+
+def replay(entries, record):
+    '''
+    Applies one log record to the pending messages being reloaded
+    '''
+    kind, message_id = record[0], record[1]
+    if kind == 'S':
+        entries[message_id] = {
+            'message_id': message_id,
+            'channel_id': record[2],
+            'u_id': record[3],
+            'time_sent': record[4],
+            'message': record[5],
+        }
+    elif kind == 'R' and message_id in entries:
+        entries[message_id]['time_sent'] = record[2]
+    else:
+        entries.pop(message_id, None)
+
+def write_log(record):
+    '''
+    Appends a record to the log if one is open, compacting it when it has
+    grown well past the pending messages
+    '''
+    if log['file'] is None:
+        return
+    log['file'].write(json.dumps(record) + '\n')
+    log['file'].flush()
+    log['records'] += 1
+    if log['records'] > 2 * (len(pending) + len(in_flight)) + COMPACT_SLACK:
+        compact()
+
+def compact():
+    '''
+    Rewrites the log with one record per pending or in flight message
+    '''
+    if log['file'] is not None:
+        log['file'].close()
+
+    temp_path = log['path'] + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as log_file:
+        for entry in list(pending.values()) + list(in_flight.values()):
+            log_file.write(json.dumps(['S', entry['message_id'], entry['channel_id'],
+                                       entry['u_id'], entry['time_sent'],
+                                       entry['message']]) + '\n')
+        log_file.flush()
+        os.fsync(log_file.fileno())
+    os.replace(temp_path, log['path'])
+
+    log['file'] = open(log['path'], 'a', encoding='utf-8') # pylint: disable=consider-using-with
+    log['records'] = len(pending) + len(in_flight)
+
+def close():
+    '''
+    Stops logging the scheduled messages
+    '''
+    with condition:
+        if log['file'] is not None:
+            log['file'].close()
+        log['file'] = None
+        log['records'] = 0
+        log['path'] = None
@@ -0,0 +1,289 @@
+'''
+Tests for the message_sendlater scheduler
+'''
+
+import json
+import time
+import pytest
+import other
+import auth
+import channels
+import channel
+import message
+import scheduler
+import error
+import data
+
+def test_sendlater_dispatch_order():
+    '''
+    Tests that scheduled messages are sent in order of their send time
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+
+    now = time.time()
+    later_id = message.message_sendlater(token1, c_id1, 'later', now + 0.4)['message_id']
+    sooner_id = message.message_sendlater(token1, c_id1, 'sooner', now + 0.2)['message_id']
+    assert scheduler.metrics()['depth'] == 2
+    assert channel.channel_messages(token1, c_id1, 0)['messages'] == []
+
+    time.sleep(0.3)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [sooner_id]
+    assert scheduler.metrics()['depth'] == 1
+
+    time.sleep(0.3)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [later_id, sooner_id]
+    assert messages[0]['time_created'] == now + 0.4
+
+def test_scheduler_metrics():
+    '''
+    Tests the depth and lag counters reported by the scheduler
+    '''
+    other.clear()
+    assert scheduler.metrics() == {
+        'depth': 0,
+        'dispatched': 0,
+        'failed': 0,
+        'last_lag': 0.0,
+        'max_lag': 0.0,
+        'overdue': 0.0,
+    }
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    for _ in range(20):
+        message.message_sendlater(token1, c_id1, 'Hello', time.time() + 0.1)
+    assert scheduler.metrics()['depth'] == 20
+
+    time.sleep(0.3)
+    metrics = scheduler.metrics()
+    assert metrics['depth'] == 0
+    assert metrics['dispatched'] == 20
+    assert 0 <= metrics['last_lag'] <= metrics['max_lag'] < 0.2
+    assert len(channel.channel_messages(token1, c_id1, 0)['messages']) == 20
+
+def test_clear_drops_scheduled():
+    '''
+    Tests that clearing the application drops messages that haven't been sent
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    message.message_sendlater(token1, c_id1, 'Hello', time.time() + 0.1)
+
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    time.sleep(0.2)
+    assert channel.channel_messages(token1, c_id1, 0)['messages'] == []
+
+def test_sendlater_list_cancel_reschedule():
+    '''
+    Tests listing, cancelling and rescheduling scheduled messages
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    token2 = user2['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    channel.channel_join(token2, c_id1)
+
+    now = time.time()
+    m_id1 = message.message_sendlater(token1, c_id1, 'first', now + 5)['message_id']
+    m_id2 = message.message_sendlater(token1, c_id1, 'second', now + 3)['message_id']
+    m_id3 = message.message_sendlater(token2, c_id1, 'third', now + 4)['message_id']
+
+    assert message.message_sendlater_list(token1, c_id1) == {
+        'messages': [
+            {'message_id': m_id2, 'message': 'second', 'time_sent': now + 3},
+            {'message_id': m_id1, 'message': 'first', 'time_sent': now + 5},
+        ],
+    }
+    listed = message.message_sendlater_list(token2, c_id1)['messages']
+    assert [msg['message_id'] for msg in listed] == [m_id3]
+
+    # user2 can't change user1's message, user1 owns the channel so can change user2's
+    with pytest.raises(error.AccessError):
+        message.message_sendlater_cancel(token2, m_id1)
+    assert message.message_sendlater_cancel(token1, m_id3) == {}
+    assert message.message_sendlater_list(token2, c_id1) == {'messages': []}
+    with pytest.raises(error.InputError):
+        message.message_sendlater_cancel(token1, m_id3)
+
+    # rescheduling moves the message to the front of the queue
+    assert message.message_sendlater_reschedule(token1, m_id1, now + 0.1) == {}
+    listed = message.message_sendlater_list(token1, c_id1)['messages']
+    assert [msg['message_id'] for msg in listed] == [m_id1, m_id2]
+    with pytest.raises(error.InputError):
+        message.message_sendlater_reschedule(token1, m_id2, now - 10)
+
+    time.sleep(0.3)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id1]
+    assert messages[0]['time_created'] == now + 0.1
+    assert scheduler.metrics()['depth'] == 1
+    with pytest.raises(error.InputError):
+        message.message_sendlater_reschedule(token1, m_id1, now + 10)
+
+def test_schedule_log_reload(tmp_path):
+    '''
+    Tests that scheduled messages are reloaded from the log after a restart
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'schedule.log')
+    scheduler.load(log_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+
+    now = time.time()
+    m_id1 = message.message_sendlater(token1, c_id1, 'overdue', now + 0.2)['message_id']
+    m_id2 = message.message_sendlater(token1, c_id1, 'pending', now + 5)['message_id']
+    m_id3 = message.message_sendlater(token1, c_id1, 'cancelled', now + 6)['message_id']
+    message.message_sendlater_cancel(token1, m_id3)
+    message.message_sendlater_reschedule(token1, m_id2, now + 4)
+
+    # simulate a restart by dropping the queue without touching the log
+    scheduler.close()
+    scheduler.clear()
+    data.MAX_MESSAGE_ID = 0
+    time.sleep(0.3)
+    assert channel.channel_messages(token1, c_id1, 0)['messages'] == []
+
+    # the overdue message is sent as soon as the log is reloaded
+    scheduler.load(log_path)
+    time.sleep(0.1)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id1]
+    assert message.message_sendlater_list(token1, c_id1)['messages'] == [
+        {'message_id': m_id2, 'message': 'pending', 'time_sent': now + 4},
+    ]
+    assert data.MAX_MESSAGE_ID >= m_id2
+    scheduler.close()
+
+def test_schedule_log_compaction(tmp_path, monkeypatch):
+    '''
+    Tests that the log is kept proportional to the pending messages
+    '''
+    other.clear()
+    monkeypatch.setattr(scheduler, 'COMPACT_SLACK', 10)
+    log_path = str(tmp_path / 'schedule.log')
+    scheduler.load(log_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+
+    kept = message.message_sendlater(token1, c_id1, 'kept', time.time() + 10)['message_id']
+    for _ in range(100):
+        m_id = message.message_sendlater(token1, c_id1, 'Hello', time.time() + 10)['message_id']
+        message.message_sendlater_cancel(token1, m_id)
+
+    with open(log_path) as log_file:
+        assert len(log_file.readlines()) <= 2 + 10 + 2
+    scheduler.close()
+
+    scheduler.clear()
+    scheduler.load(log_path)
+    assert [entry['message_id'] for entry in scheduler.list_pending(user1['u_id'], c_id1)] \
+        == [kept]
+    scheduler.close()
+    other.clear()
+
+def test_schedule_log_sent_before_crash(tmp_path):
+    '''
+    Tests that a message sent just before a crash, whose sending wasn't
+    logged, isn't sent again after a restart
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'schedule.log')
+    scheduler.load(log_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    now = time.time()
+    m_id1 = message.message_sendlater(token1, c_id1, 'sent', now + 0.2)['message_id']
+
+    # the message reached its channel, as replaying the write-ahead log would
+    # give, but the scheduler's log still has it pending
+    scheduler.close()
+    scheduler.clear()
+    message.send_to_channel(c_id1, m_id1, user1['u_id'], 'sent', now + 0.2)
+
+    scheduler.load(log_path)
+    assert scheduler.metrics()['depth'] == 0
+    time.sleep(0.3)
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id1]
+    assert scheduler.metrics()['dispatched'] == 0
+    scheduler.close()
+    other.clear()
+
+def test_schedule_log_compaction_in_flight(tmp_path):
+    '''
+    Tests that the log being compacted while due messages are sent keeps
+    them until their sending is logged
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'schedule.log')
+    scheduler.load(log_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    with scheduler.condition:
+        m_id1 = message.message_sendlater(token1, c_id1, 'sent', time.time() + 0.1)['message_id']
+        time.sleep(0.2)
+        # as the worker would, then another thread's write compacts the log
+        # before the message is sent
+        due = scheduler.pop_due(time.time())
+        scheduler.compact()
+    assert [entry['message_id'] for entry in due] == [m_id1]
+
+    with open(log_path, encoding='utf-8') as log_file:
+        assert [json.loads(line)[:2] for line in log_file] == [['S', m_id1]]
+
+    scheduler.dispatch(due)
+    with open(log_path, encoding='utf-8') as log_file:
+        assert [json.loads(line)[:2] for line in log_file] == [['S', m_id1], ['D', m_id1]]
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id1]
+    assert scheduler.metrics()['dispatched'] == 1
+    scheduler.close()
+    other.clear()
+
+def test_dispatch_failure(monkeypatch):
+    '''
+    Tests that a message failing to send doesn't stop later ones being sent
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    send_to_channel = message.send_to_channel
+
+    def fail_once(*_):
+        monkeypatch.setattr(message, 'send_to_channel', send_to_channel)
+        raise ValueError('Failed to send')
+
+    monkeypatch.setattr(message, 'send_to_channel', fail_once)
+    message.message_sendlater(token1, c_id1, 'lost', time.time() + 0.1)
+    time.sleep(0.2)
+    m_id2 = message.message_sendlater(token1, c_id1, 'sent', time.time() + 0.1)['message_id']
+    time.sleep(0.2)
+
+    messages = channel.channel_messages(token1, c_id1, 0)['messages']
+    assert [msg['message_id'] for msg in messages] == [m_id2]
+    assert scheduler.metrics()['failed'] == 1
+    assert scheduler.metrics()['dispatched'] == 1
+    other.clear()
@@ -0,0 +1,96 @@
+'''
+Least recently used cache of search results.
+
+Entries are keyed by the searching user, the version of the set of channels
+they are a member of, and the search arguments, so joining or leaving a
+channel makes the user's old entries unreachable. Each entry remembers the
+write version of every channel it covered and is dropped on lookup if any of
+them changed. Only the matching message_ids are cached, so reacts and pins
+are still shown as they are now when an entry is used.
+'''
+
+import threading
+from collections import OrderedDict
+import data
+
+# Most entries kept before the least recently used one is evicted
+CAPACITY = 256
+
+# key -> (message_ids, next_cursor, {channel_id: version}), oldest use first
+entries = OrderedDict()
+
+# Counters reported by metrics()
+stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+}
+
+# Searches run at the same time, so the entries and counters are only
+# changed while holding this
+lock = threading.Lock()
+
+def make_key(u_id, query):
+    '''
+    Returns the cache key of a search by a user
+    '''
+    return (u_id, data.get_membership_version(u_id)) + tuple(sorted(query.items()))
+
+def channel_versions(channel_ids):
+    '''
+    Returns the current write version of each of the given channels
+    '''
+    return {channel_id: data.get_channel_version(channel_id) for channel_id in channel_ids}
+
+def get(key):
+    '''
+    Returns (message_ids, next_cursor) cached for key, or None if there is no
+    entry or a channel it covered has been written to since
+    '''
+    with lock:
+        entry = entries.get(key)
+        if entry is not None:
+            message_ids, next_cursor, versions = entry
+            if all(data.get_channel_version(channel_id) == version
+                   for channel_id, version in versions.items()):
+                entries.move_to_end(key)
+                stats['hits'] += 1
+                return message_ids, next_cursor
+            del entries[key]
+        stats['misses'] += 1
+        return None
+
+def put(key, message_ids, next_cursor, versions):
+    '''
+    Caches the result of a search, with the channel versions read before it ran
+    '''
+    with lock:
+        entries[key] = (message_ids, next_cursor, versions)
+        entries.move_to_end(key)
+        while len(entries) > CAPACITY:
+            entries.popitem(last=False)
+            stats['evictions'] += 1
+
+def metrics():
+    '''
+    Returns the size, hit rate and eviction count of the cache
+    '''
+    with lock:
+        lookups = stats['hits'] + stats['misses']
+        return {
+            'size': len(entries),
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+            'evictions': stats['evictions'],
+        }
+
+def clear():
+    '''
+    Empties the cache and resets the counters
+    '''
+    with lock:
+        entries.clear()
+        stats['hits'] = 0
+        stats['misses'] = 0
+        stats['evictions'] = 0
@@ -0,0 +1,304 @@
+'''
+Search engine backed by an SQLite FTS5 table, used instead of the indexes in
+search_index when config.SEARCH_ENGINE is "fts5".
+
+Message writes are queued and a writer thread applies them to the table in
+batches, one transaction per batch, so sending a message doesn't wait on
+SQLite. A search first waits for the writes queued before it to be applied,
+so it sees every message that was sent before it.
+
+The table uses the trigram tokenizer where SQLite has it, so a query of at
+least 3 characters is narrowed down by the full text index. Every query is
+also checked with instr(), which keeps the substring semantics of
+"query_str in message". Searches without a limit are ranked with bm25.
+
+With the sqlite storage backend, the table is filled from the storage
+database's messages table by SQLite itself, so the text of every message
+isn't read into memory when the server starts.
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import config
+
+# Engine selected for this server
+ENGINE = config.SEARCH_ENGINE
+
+# SQLite database the table is kept in
+PATH = config.SEARCH_DB
+
+# Name of the table, which can share a database with storage_sqlite's tables
+TABLE = 'search_fts_messages'
+
+# Most queued writes applied in one transaction
+BATCH_SIZE = 500
+
+# Open connection, writer thread, whether the table has the trigram
+# tokenizer, the number of writes queued and applied so far, and the number
+# of writes that failed along with the last error
+state = {
+    'connection': None,
+    'worker': None,
+    'trigram': False,
+    'queued': 0,
+    'applied': 0,
+    'failed': 0,
+    'last_error': None,
+}
+
+# Writes waiting for the writer thread, as tuples starting with their kind
+queue = []
+
+condition = threading.Condition()
+db_lock = threading.Lock()
+
+# Held while opening or closing the database, which searches and message
+# writes can both do first
+starting = threading.Lock()
+
+def enabled():
+    '''
+    Checks if searches are served by this engine
+    '''
+    return ENGINE == 'fts5'
+
+def start():
+    '''
+    Opens the database with an empty table and starts the writer thread,
+    if that hasn't been done yet
+    '''
+    with starting:
+        if state['connection'] is not None:
+            return
+        connection = sqlite3.connect(PATH, uri=PATH.startswith('file:'),
+                                     check_same_thread=False, isolation_level=None)
+        columns = 'body, channel_id UNINDEXED, u_id UNINDEXED, time_created UNINDEXED'
+        connection.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        try:
+            connection.execute(f'CREATE VIRTUAL TABLE {TABLE} USING fts5({columns}, '
+                               "tokenize='trigram case_sensitive 1')")
+            state['trigram'] = True
+        except sqlite3.OperationalError:
+            # SQLite before 3.34 has no trigram tokenizer, queries are then
+            # only checked with instr()
+            connection.execute(f'CREATE VIRTUAL TABLE {TABLE} USING fts5({columns})')
+            state['trigram'] = False
+        state['connection'] = connection
+        state['failed'] = 0
+        state['last_error'] = None
+        state['worker'] = threading.Thread(target=run, name='search-fts-writer', daemon=True)
+        state['worker'].start()
+
+def enqueue(write):
+    '''
+    Queues a write for the writer thread
+    '''
+    start()
+    with condition:
+        queue.append(write)
+        state['queued'] += 1
+        condition.notify_all()
+
+def add_message(message, channel_id):
+    '''
+    Mirrors a message that was added to a channel
+    '''
+    enqueue(('add', message['message_id'], message['message'], channel_id,
+             message['u_id'], message['time_created']))
+
+def remove_message(message_id):
+    '''
+    Mirrors the removal of a message
+    '''
+    enqueue(('remove', message_id))
+
+def update_message(message):
+    '''
+    Mirrors the edit of a message's text
+    '''
+    enqueue(('update', message['message_id'], message['message']))
+
+def forget_channel(channel):
+    '''
+    Mirrors the deletion of a channel
+    '''
+    enqueue(('forget_channel', channel['channel_id']))
+
+def load_messages(path, last_message_id):
+    '''
+    Replaces the table's rows with the messages kept by storage_sqlite in the
+    database at path, up to last_message_id. Messages sent after that are
+    added by the writes queued for them.
+    '''
+    enqueue(('load', path, last_message_id))
+
+def clear():
+    '''
+    Empties the table
+    '''
+    if state['connection'] is not None:
+        enqueue(('clear',))
+
+def run():
+    '''
+    Writer loop, applies the queued writes a batch at a time until closed
+    '''
+    while True:
+        with condition:
+            condition.wait_for(lambda: queue)
+            # A load can't be part of a batch, as it attaches a database
+            size = next((num for num, write in enumerate(queue[:BATCH_SIZE])
+                         if write[0] == 'load'), BATCH_SIZE) or 1
+            batch = queue[:size]
+            del queue[:size]
+
+        with db_lock:
+            if batch[0][0] == 'load':
+                load(state['connection'], batch[0])
+            else:
+                apply_batch(state['connection'], batch)
+
+        with condition:
+            state['applied'] += len(batch)
+            condition.notify_all()
+        if batch[-1][0] == 'close':
+            return
+
+def apply_batch(connection, batch):
+    '''
+    Applies a batch of writes in one transaction. If one of them fails, the
+    batch is rolled back and applied again a write at a time, skipping and
+    recording the ones that fail, so the writer thread keeps running.
+    '''
+    try:
+        connection.execute('BEGIN')
+        for write in batch:
+            apply(connection, write)
+        connection.execute('COMMIT')
+        return
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+    for write in batch:
+        try:
+            apply(connection, write)
+        except sqlite3.Error as err:
+            state['failed'] += 1
+            state['last_error'] = f'{write[0]}: {err}'
+
+def load(connection, write):
+    '''
+    Copies the messages of a storage database into the table with one
+    INSERT ... SELECT, attaching the database unless the table is kept in it
+    '''
+    _, path, last_message_id = write
+    main = connection.execute('PRAGMA database_list').fetchone()[2]
+    attached = os.path.realpath(path) != os.path.realpath(main)
+    try:
+        if attached:
+            connection.execute('ATTACH DATABASE ? AS storage', (path,))
+        source = 'storage.messages' if attached else 'main.messages'
+        try:
+            connection.execute('BEGIN')
+            connection.execute(f'DELETE FROM {TABLE}')
+            connection.execute(f'INSERT INTO {TABLE} (rowid, body, channel_id, u_id, '
+                               'time_created) SELECT message_id, body, channel_id, u_id, '
+                               f'time_created FROM {source} WHERE message_id <= ?',
+                               (last_message_id,))
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            if attached:
+                connection.execute('DETACH DATABASE storage')
+    except sqlite3.Error as err:
+        state['failed'] += 1
+        state['last_error'] = f'load: {err}'
+
+def apply(connection, write):
+    '''
+    Applies one queued write to the table
+    '''
+    kind = write[0]
+    if kind == 'add':
+        connection.execute(f'INSERT INTO {TABLE} (rowid, body, channel_id, u_id, time_created) '
+                           'VALUES (?, ?, ?, ?, ?)', write[1:])
+    elif kind == 'remove':
+        connection.execute(f'DELETE FROM {TABLE} WHERE rowid = ?', write[1:])
+    elif kind == 'update':
+        connection.execute(f'UPDATE {TABLE} SET body = ? WHERE rowid = ?', (write[2], write[1]))
+    elif kind == 'forget_channel':
+        connection.execute(f'DELETE FROM {TABLE} WHERE channel_id = ?', write[1:])
+    elif kind == 'clear':
+        connection.execute(f'DELETE FROM {TABLE}')
+
+def flush():
+    '''
+    Waits until every write queued so far has been applied
+    '''
+    with condition:
+        target = state['queued']
+        condition.wait_for(lambda: state['applied'] >= target)
+
+def search(query, channel_ids, before=None, count=None):
+    '''
+    Returns the message_ids of messages in the given channels that match the
+    query. Without a count, every match is returned best match first.
+    With a count, at most that many matches older than the key "before" are
+    returned, newest first.
+    '''
+    start()
+    flush()
+
+    conditions = ['channel_id IN (SELECT value FROM json_each(?))']
+    params = [json.dumps(sorted(channel_ids))]
+    query_str = query['query_str']
+    ranked = False
+    if len(query_str) >= 3 and state['trigram']:
+        conditions.append(f'{TABLE} MATCH ?')
+        params.append('"' + query_str.replace('"', '""') + '"')
+        ranked = True
+    if query_str:
+        conditions.append('instr(body, ?) > 0')
+        params.append(query_str)
+    for column, operator, key in [('channel_id', '=', 'channel_id'), ('u_id', '=', 'u_id'),
+                                  ('time_created', '>=', 'since'),
+                                  ('time_created', '<=', 'until')]:
+        if query[key] is not None:
+            conditions.append(f'{column} {operator} ?')
+            params.append(query[key])
+    if before is not None:
+        conditions.append('(time_created < ? OR (time_created = ? AND rowid < ?))')
+        params += [before[0], before[0], before[1]]
+
+    sql = f'SELECT rowid FROM {TABLE} WHERE ' + ' AND '.join(conditions)
+    if count is not None:
+        sql += ' ORDER BY time_created DESC, rowid DESC LIMIT ?'
+        params.append(count)
+    elif ranked:
+        sql += f' ORDER BY bm25({TABLE}), rowid'
+    else:
+        sql += ' ORDER BY channel_id, time_created, rowid'
+
+    with db_lock:
+        return [row[0] for row in state['connection'].execute(sql, params)]
+
+def close():
+    '''
+    Applies the queued writes, stops the writer thread and closes the database
+    '''
+    with starting:
+        if state['connection'] is None:
+            return
+        with condition:
+            queue.append(('close',))
+            state['queued'] += 1
+            condition.notify_all()
+        state['worker'].join()
+        with db_lock:
+            state['connection'].close()
+        state['connection'] = None
+        state['worker'] = None
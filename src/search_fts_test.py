@@ -0,0 +1,132 @@
+'''
+Tests for the SQLite FTS5 search engine
+'''
+
+import pytest
+import auth
+import channel
+import channels
+import message
+import other
+import search_fts
+import search_index
+import data
+
+@pytest.fixture
+def fts_engine(tmp_path, monkeypatch):
+    '''Serves searches from an FTS5 table in a temporary database'''
+    other.clear()
+    monkeypatch.setattr(search_fts, 'ENGINE', 'fts5')
+    monkeypatch.setattr(search_fts, 'PATH', str(tmp_path / 'search.db'))
+    yield
+    search_fts.close()
+    other.clear()
+
+def message_ids(result):
+    '''Returns the message_ids of a search result'''
+    return [msg['message_id'] for msg in result['messages']]
+
+def test_fts_search_matches_memory(fts_engine, monkeypatch):
+    '''Tests that the fts5 engine finds the same messages as the memory indexes'''
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(user2['token'], 'channel2', True)['channel_id']
+    channel.channel_join(user1['token'], c_id2)
+    channel.channel_join(user2['token'], c_id1)
+
+    texts = ['Hello World', 'hello there', 'Say "hi"', 'World of hello', 'ok', 'a b c']
+    for num, text in enumerate(texts):
+        sender = user1 if num % 2 else user2
+        message.message_send(sender['token'], c_id2 if num % 3 else c_id1, text)
+    message.message_send(user2['token'], c_id2, 'Hello World again')
+    m_id = message.message_send(user1['token'], c_id1, 'Goodbye World')['message_id']
+    message.message_edit(user1['token'], m_id, 'Goodbye')
+
+    searches = [('Hello', {}), ('World', {}), ('hello', {'u_id': user1['u_id']}),
+                ('"hi"', {}), ('o', {'channel_id': c_id2}), (' ', {}), ('', {}),
+                ('b c', {}), ('Goodbye World', {})]
+    fts_results = []
+    for query_str, filters in searches:
+        fts_results.append((other.search(user1['token'], query_str, **filters),
+                            other.search(user1['token'], query_str, 2, **filters)))
+
+    monkeypatch.setattr(search_fts, 'ENGINE', 'memory')
+    for (query_str, filters), (ranked, page) in zip(searches, fts_results):
+        expected = other.search(user1['token'], query_str, **filters)
+        assert sorted(message_ids(ranked)) == sorted(message_ids(expected))
+        assert page == other.search(user1['token'], query_str, 2, **filters)
+
+def test_fts_ranked_and_mirrored(fts_engine):
+    '''Tests bm25 ranking and that removals and deleted channels are mirrored'''
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    m_id1 = message.message_send(user1['token'], c_id1, 'cat ' + 'dog ' * 20)['message_id']
+    m_id2 = message.message_send(user1['token'], c_id1, 'cat cat cat')['message_id']
+    assert message_ids(other.search(user1['token'], 'cat')) == [m_id2, m_id1]
+
+    message.message_remove(user1['token'], m_id2)
+    assert message_ids(other.search(user1['token'], 'cat')) == [m_id1]
+
+    for num in range(search_fts.BATCH_SIZE + 10):
+        message.message_send(user1['token'], c_id1, f'bulk {num}')
+    assert len(other.search(user1['token'], 'bulk')['messages']) == search_fts.BATCH_SIZE + 10
+
+def test_fts_writer_survives_failure(fts_engine):
+    '''Tests that a write failing doesn't stop the writes batched with it or later ones'''
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    sent = message.message_send(user1['token'], c_id1, 'Hello there')['message_id']
+
+    # the same rowid again fails with an IntegrityError
+    search_fts.add_message({'message_id': sent, 'message': 'Hello again', 'u_id': 1,
+                            'time_created': 0}, c_id1)
+    m_id2 = message.message_send(user1['token'], c_id1, 'Hello later')['message_id']
+    assert sorted(message_ids(other.search(user1['token'], 'Hello'))) == [sent, m_id2]
+    assert search_fts.state['failed'] == 1
+    assert search_fts.state['last_error'].startswith('add')
+
+    m_id3 = message.message_send(user1['token'], c_id1, 'Hello last')['message_id']
+    assert sorted(message_ids(other.search(user1['token'], 'Hello'))) == [sent, m_id2, m_id3]
+
+def test_fts_shares_storage_db(fts_engine, tmp_path, monkeypatch):
+    '''Tests that the fts5 table can be kept in the storage database'''
+    db_path = str(tmp_path / 'flockr.db')
+    monkeypatch.setattr(search_fts, 'PATH', db_path)
+    other.open_storage(db_path)
+    try:
+        user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+        c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+        m_id1 = message.message_send(user1['token'], c_id1, 'Hello there')['message_id']
+        assert message_ids(other.search(user1['token'], 'Hello')) == [m_id1]
+        assert message_ids(channel.channel_messages(user1['token'], c_id1, 0)) == [m_id1]
+        other.clear()
+    finally:
+        data.use_backend('memory')
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_fts_loaded_from_storage(fts_engine, tmp_path, monkeypatch, shared):
+    '''Tests that reopening the storage database fills the fts5 table from it,
+    whether or not they share a database, without indexing the messages in memory'''
+    db_path = str(tmp_path / 'flockr.db')
+    if shared:
+        monkeypatch.setattr(search_fts, 'PATH', db_path)
+    other.open_storage(db_path)
+    try:
+        user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+        c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+        m_id1 = message.message_send(user1['token'], c_id1, 'Hello there')['message_id']
+        m_id2 = message.message_send(user1['token'], c_id1, 'Hello again')['message_id']
+        message.message_remove(user1['token'], m_id2)
+        m_id3 = message.message_send(user1['token'], c_id1, 'Goodbye')['message_id']
+
+        search_fts.close()
+        other.open_storage(db_path)
+        m_id4 = message.message_send(user1['token'], c_id1, 'Hello last')['message_id']
+        assert sorted(message_ids(other.search(user1['token'], 'Hello'))) == [m_id1, m_id4]
+        assert message_ids(other.search(user1['token'], 'Goodbye')) == [m_id3]
+        assert not search_index.indexed
+        assert search_fts.state['failed'] == 0
+        other.clear()
+    finally:
+        data.use_backend('memory')
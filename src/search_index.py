@@ -0,0 +1,354 @@
+'''
+Inverted indexes over message text, used by other.search to find the
+messages that can contain a query string without scanning every message.
+
+Every run of 3 characters (trigram) of a message maps to the message_ids
+containing it, and so does every whitespace separated token. Queries of at
+least 3 characters are narrowed to the messages containing all of their
+trigrams. Shorter queries can't be split into trigrams, so they fall back to
+scanning the (much smaller) token vocabulary. Search keeps its substring
+semantics: the index only narrows the messages down, and each candidate is
+still checked with "query_str in message".
+
+Messages are also indexed by channel, author and hour created, so a search
+filtered to a channel, a user or a time window intersects those postings
+with the text candidates instead of filtering every match afterwards.
+
+After the state is reloaded, the indexes are rebuilt by a background
+thread, so starting up doesn't wait on indexing every message. Until the
+rebuild is done, candidates() can't narrow anything down and searches fall
+back to scanning the messages.
+
+When the fts5 search engine is selected, writes are passed on to
+search_fts instead and these indexes stay empty. Writes are also passed on
+to search_pool, for the shards its worker processes hold.
+'''
+
+import itertools
+import threading
+import data
+import locks
+import search_fts
+import search_pool
+
+# Token -> set of message_ids of messages containing that token
+postings = {}
+
+# Trigram -> set of message_ids of messages containing that trigram
+trigram_postings = {}
+
+# channel_id -> set of message_ids of messages sent to that channel
+channel_postings = {}
+
+# u_id -> set of message_ids of messages sent by that user
+author_postings = {}
+
+# Time bucket -> set of message_ids of messages created during that bucket
+time_buckets = {}
+
+# Length in seconds of the time buckets
+BUCKET_SECONDS = 3600
+
+# message_id -> (text, channel_id, u_id, time bucket) of that message as it was
+# indexed, so it can be taken out of every posting
+indexed = {}
+
+# Messages are sent to different channels at the same time, so the indexes
+# are only read or changed while holding this. Searches only hold it to look
+# up and combine posting sets, not while scanning the token vocabulary, so
+# they don't keep sends to every channel waiting.
+lock = threading.RLock()
+
+# Set once the indexes cover every message, cleared while they are rebuilt
+ready = threading.Event()
+ready.set()
+
+# Number of rebuilds started or cancelled, so a rebuild that was overtaken
+# by a clear or a newer rebuild stops
+build = {
+    'generation': 0,
+}
+
+# Messages indexed at a time by a rebuild, between which the lock is let go
+REBUILD_CHUNK = 1000
+
+def tokenize(text):
+    '''
+    Returns the distinct whitespace separated tokens of some text
+    '''
+    return set(text.split())
+
+def trigrams(text):
+    '''
+    Returns the distinct runs of 3 characters in some text
+    '''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def bucket(time_created):
+    '''
+    Returns the time bucket a time falls in
+    '''
+    return int(time_created // BUCKET_SECONDS)
+
+def add_message(message, channel_id):
+    '''
+    Indexes a message that was added to a channel
+    '''
+    search_pool.add_message(message, channel_id)
+    index(message, channel_id)
+
+def index(message, channel_id):
+    '''
+    Indexes a message without passing it on to the search pool
+    '''
+    with lock:
+        if search_fts.enabled():
+            search_fts.add_message(message, channel_id)
+            return
+        message_id = message['message_id']
+        text = message['message']
+        time_bucket = bucket(message['time_created'])
+        indexed[message_id] = (text, channel_id, message['u_id'], time_bucket)
+        channel_postings.setdefault(channel_id, set()).add(message_id)
+        author_postings.setdefault(message['u_id'], set()).add(message_id)
+        time_buckets.setdefault(time_bucket, set()).add(message_id)
+        for token in tokenize(text):
+            postings.setdefault(token, set()).add(message_id)
+        for trigram in trigrams(text):
+            trigram_postings.setdefault(trigram, set()).add(message_id)
+
+def remove_message(message_id):
+    '''
+    Takes a removed message out of the index
+    '''
+    search_pool.remove_message(message_id)
+    unindex(message_id)
+
+def unindex(message_id):
+    '''
+    Takes a message out of the index without passing it on to the search pool
+    '''
+    with lock:
+        if search_fts.enabled():
+            search_fts.remove_message(message_id)
+            return
+        entry = indexed.pop(message_id, None)
+        if entry is None:
+            return
+        text, channel_id, u_id, time_bucket = entry
+        discard(postings, tokenize(text), message_id)
+        discard(trigram_postings, trigrams(text), message_id)
+        discard(channel_postings, [channel_id], message_id)
+        discard(author_postings, [u_id], message_id)
+        discard(time_buckets, [time_bucket], message_id)
+
+def discard(index, keys, message_id):
+    '''
+    Removes a message_id from the postings of the given keys
+    '''
+    for key in keys:
+        message_ids = index[key]
+        message_ids.discard(message_id)
+        if not message_ids:
+            del index[key]
+
+def update_message(message):
+    '''
+    Reindexes a message whose text was edited
+    '''
+    search_pool.update_message(message)
+    with lock:
+        if search_fts.enabled():
+            search_fts.update_message(message)
+            return
+        entry = indexed.get(message['message_id'])
+        if entry is None:
+            return
+        unindex(message['message_id'])
+        index(message, entry[1])
+
+def forget_channel(channel):
+    '''
+    Takes every message of a deleted channel out of the index
+    '''
+    search_pool.forget_channel(channel['channel_id'])
+    with lock:
+        if search_fts.enabled():
+            search_fts.forget_channel(channel)
+            return
+        for message in data.iter_channel_messages(channel):
+            unindex(message['message_id'])
+
+def rebuild(channels):
+    '''
+    Indexes every message of the given channels in a background thread,
+    after they were reloaded
+    '''
+    channel_ids = [channel['channel_id'] for channel in channels]
+    with lock:
+        build['generation'] += 1
+        ready.clear()
+        generation = build['generation']
+    threading.Thread(target=run_rebuild, args=(channel_ids, generation),
+                     name='search-index-rebuild', daemon=True).start()
+
+def run_rebuild(channel_ids, generation):
+    '''
+    Indexes the messages of each channel while holding that channel's lock,
+    so none of them can change part way through, then marks the index ready
+    '''
+    for channel_id in channel_ids:
+        with locks.channel_reading([channel_id]):
+            channel = data.get_channel(channel_id)
+            if channel is None:
+                continue
+            messages = data.iter_channel_messages(channel)
+            while True:
+                chunk = list(itertools.islice(messages, REBUILD_CHUNK))
+                if not chunk:
+                    break
+                with lock:
+                    if build['generation'] != generation:
+                        return
+                    for message in chunk:
+                        index(message, channel_id)
+    with lock:
+        if build['generation'] == generation:
+            ready.set()
+
+def clear():
+    '''
+    Empties the index, stopping a rebuild in progress
+    '''
+    with lock:
+        build['generation'] += 1
+        ready.set()
+        search_fts.clear()
+        postings.clear()
+        trigram_postings.clear()
+        channel_postings.clear()
+        author_postings.clear()
+        time_buckets.clear()
+        indexed.clear()
+
+def candidates(query_str, channel_id=None, u_id=None, since=None, until=None):
+    '''
+    Returns a set of message_ids that includes every message containing
+    query_str that was sent to channel_id by u_id between since and until,
+    leaving out any filter that is None.
+    Returns None if the query has nothing to narrow it down with, or the
+    index is still being rebuilt.
+    Only the messages of channels the caller has locked are sure to still
+    exist, others may have been removed by the time the set is used.
+    '''
+    if not ready.is_set():
+        return None
+    found = []
+    if len(query_str) >= 3:
+        found.append(trigram_candidates(query_str))
+    else:
+        message_ids = token_candidates(query_str)
+        if message_ids is not None:
+            found.append(message_ids)
+
+    with lock:
+        if channel_id is not None:
+            found.append(channel_postings.get(channel_id, set()))
+        if u_id is not None:
+            found.append(author_postings.get(u_id, set()))
+        if since is not None or until is not None:
+            found.append(time_candidates(since, until))
+
+        if not found:
+            return None
+        return intersect(found)
+
+def time_candidates(since, until):
+    '''
+    Returns the message_ids of messages created in the time buckets overlapping
+    since to until. Messages near either end may fall outside of the window.
+    The lock must be held.
+    '''
+    if not time_buckets:
+        return set()
+    first = min(time_buckets) if since is None else bucket(since)
+    last = max(time_buckets) if until is None else bucket(until)
+
+    if last - first + 1 <= len(time_buckets):
+        keys = range(first, last + 1)
+    else:
+        # The window spans more buckets than are in use
+        keys = [key for key in time_buckets if first <= key <= last]
+
+    message_ids = set()
+    for key in keys:
+        message_ids |= time_buckets.get(key, set())
+    return message_ids
+
+def trigram_candidates(query_str):
+    '''
+    Returns the message_ids of messages containing every trigram of query_str
+    '''
+    query_trigrams = trigrams(query_str)
+    with lock:
+        found = []
+        for trigram in query_trigrams:
+            message_ids = trigram_postings.get(trigram)
+            if not message_ids:
+                return set()
+            found.append(message_ids)
+        return intersect(found)
+
+def token_candidates(query_str):
+    '''
+    Returns a set of message_ids that includes every message containing
+    query_str, or None if the query has no tokens to narrow it down with.
+
+    A query token with whitespace on both sides in the query must be a whole
+    token of a matching message, so it is looked up directly. The first and
+    last query tokens may be cut off, so they match any token containing them.
+    '''
+    terms = query_str.split()
+    if not terms:
+        return None
+
+    starts_cut = not query_str[0].isspace()
+    ends_cut = not query_str[-1].isspace()
+
+    # Tokens to look up for each query token, found by scanning a copy of the
+    # vocabulary for the tokens that may be cut off. The channels searched are
+    # locked, so a token added to the vocabulary since the copy was taken
+    # can't belong to any of their messages. Messages of other channels can
+    # be added or removed meanwhile, so they may be missing or stale.
+    vocabulary = None
+    lookups = []
+    for i, term in enumerate(terms):
+        partial = (i == 0 and starts_cut) or (i == len(terms) - 1 and ends_cut)
+        if partial:
+            if vocabulary is None:
+                with lock:
+                    vocabulary = list(postings)
+            lookups.append([token for token in vocabulary if term in token])
+        else:
+            lookups.append([term])
+
+    with lock:
+        found = []
+        for tokens in lookups:
+            message_ids = set().union(*[postings.get(token, ()) for token in tokens])
+            if not message_ids:
+                return set()
+            found.append(message_ids)
+        return intersect(found)
+
+def intersect(found):
+    '''
+    Intersects posting sets, starting from the smallest
+    '''
+    found.sort(key=len)
+    result = set(found[0])
+    for message_ids in found[1:]:
+        result &= message_ids
+        if not result:
+            break
+    return result
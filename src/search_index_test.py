@@ -0,0 +1,135 @@
+'''
+Tests for the message search index
+'''
+
+import random
+import threading
+import search_index
+
+def add_texts(texts):
+    '''
+    Indexes a list of message texts with message_ids starting at 1
+    '''
+    search_index.clear()
+    for message_id, text in enumerate(texts, 1):
+        search_index.add_message(make_message(message_id, text), 1)
+
+def make_message(message_id, text, u_id=1, time_created=0):
+    '''
+    Returns the fields of a message that are indexed
+    '''
+    return {
+        'message_id': message_id,
+        'u_id': u_id,
+        'message': text,
+        'time_created': time_created,
+    }
+
+def test_candidates_whole_and_partial_tokens():
+    '''
+    Tests that candidates follow substring matching for whole and cut off tokens
+    '''
+    add_texts(['key', 'Monkey', 'Keyboard', 'My keyboard', 'Lock', 'my key ring'])
+
+    assert search_index.candidates('key') == {1, 2, 4, 6}
+    assert search_index.candidates('y k') == {4, 6}
+    assert search_index.candidates(' key ') == {6}
+    assert search_index.candidates('eyb') == {3, 4}
+
+    # short queries go through the token index, whose candidates
+    # may include messages that don't contain the whole query
+    assert search_index.token_candidates('y k') == {1, 2, 4, 6}
+    assert search_index.token_candidates(' key ') == {1, 6}
+    assert search_index.candidates('ke') == {1, 2, 4, 6}
+    assert search_index.candidates('zebra') == set()
+    assert search_index.candidates('') is None
+    assert search_index.candidates('  ') is None
+
+def test_candidates_after_edit_and_remove():
+    '''
+    Tests that edited and removed messages are reindexed
+    '''
+    add_texts(['Hello World', 'Goodbye World'])
+
+    search_index.update_message(make_message(1, 'Hello there'))
+    assert search_index.candidates('World') == {2}
+    assert search_index.candidates('there') == {1}
+
+    search_index.remove_message(2)
+    assert search_index.candidates('World') == set()
+    assert 'World' not in search_index.postings
+    assert 'Wor' not in search_index.trigram_postings
+
+def test_candidates_filters():
+    '''
+    Tests narrowing candidates by channel, author and time
+    '''
+    search_index.clear()
+    hour = search_index.BUCKET_SECONDS
+    search_index.add_message(make_message(1, 'Hello', 1, 0), 1)
+    search_index.add_message(make_message(2, 'Hello', 2, hour), 1)
+    search_index.add_message(make_message(3, 'Hello', 1, 2 * hour), 2)
+    search_index.add_message(make_message(4, 'Bye', 2, 3 * hour), 2)
+
+    assert search_index.candidates('Hello', channel_id=1) == {1, 2}
+    assert search_index.candidates('Hello', u_id=1) == {1, 3}
+    assert search_index.candidates('', u_id=2) == {2, 4}
+    assert search_index.candidates('Hello', channel_id=2, u_id=2) == set()
+    assert search_index.candidates('', since=hour, until=2 * hour) == {2, 3}
+    assert search_index.candidates('', since=2 * hour) == {3, 4}
+    assert search_index.candidates('', until=10 ** 9 * hour) == {1, 2, 3, 4}
+    assert search_index.candidates('Hello', channel_id=3) == set()
+
+    search_index.update_message(make_message(2, 'Bye', 2, hour))
+    assert search_index.candidates('Bye', channel_id=1) == {2}
+    search_index.remove_message(4)
+    assert search_index.candidates('', u_id=2, since=3 * hour) == set()
+    assert 3 not in search_index.time_buckets
+    search_index.clear()
+
+def test_candidates_include_every_match():
+    '''
+    Tests against a scan that candidates never miss a matching message
+    '''
+    randomiser = random.Random(1531)
+    alphabet = 'ab \n'
+    texts = [''.join(randomiser.choice(alphabet) for _ in range(randomiser.randint(0, 12)))
+             for _ in range(200)]
+    add_texts(texts)
+
+    for _ in range(300):
+        query_str = ''.join(randomiser.choice(alphabet) for _ in range(randomiser.randint(1, 5)))
+        expected = {message_id for message_id, text in enumerate(texts, 1)
+                    if query_str in text}
+        candidates = search_index.candidates(query_str)
+        if candidates is not None:
+            assert expected <= candidates
+    search_index.clear()
+
+def test_candidates_while_indexing():
+    '''
+    Tests that candidates stay correct while another thread indexes and
+    removes messages
+    '''
+    texts = [f'word{num} shared' for num in range(500)]
+    add_texts(texts)
+    stopping = threading.Event()
+
+    def churn():
+        message_id = len(texts) + 1
+        while not stopping.is_set():
+            search_index.add_message(make_message(message_id, f'other{message_id}'), 2)
+            search_index.remove_message(message_id)
+            message_id += 1
+
+    churner = threading.Thread(target=churn)
+    churner.start()
+    try:
+        for _ in range(50):
+            assert search_index.candidates('word1') >= {2, 11, 101}
+            assert search_index.candidates('d4 sha') >= {5}
+            assert search_index.candidates('ared') >= set(range(1, len(texts) + 1))
+    finally:
+        stopping.set()
+        churner.join()
+    search_index.clear()
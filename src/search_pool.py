@@ -0,0 +1,240 @@
+'''
+Process pool for searches the index can't narrow down, such as queries too
+short to look up by trigram, which otherwise scan every message in the
+user's channels on one core.
+
+Each worker process is started once and holds a read-only shard of the
+message text: the channels whose channel_id falls to it. A search sends each
+worker the channels it owns among the user's channels, each worker scans
+its part and returns its matches newest first, and the parts are merged by
+recency here. A channel's text is only sent to its worker in full the first
+time it is searched. After that, the messages added, edited or removed are
+queued by search_index as they change and passed on before the next search,
+and a deleted channel's shard is dropped.
+'''
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import config
+import data
+
+# Number of worker processes, the pool isn't used when this is below 2
+WORKERS = config.SEARCH_WORKERS
+
+# Fewest messages a search has to cover before it is worth sending to the pool
+MIN_MESSAGES = 20000
+
+# One single process executor per worker, so each channel's shard is always
+# sent to and scanned by the same process, the channels whose shards the
+# workers hold, the changes to pass on to them before the next search, and
+# whether the shards were dropped since
+pool = {
+    'workers': None,
+    'loaded': set(),
+    'changes': [],
+    'stale': False,
+}
+
+# Most changes queued between searches, past which they are dropped and the
+# shards are sent again in full
+MAX_CHANGES = 100000
+
+# Held while sending shards and scans to the workers, since searches run at
+# the same time and each worker runs what it is sent in order
+sending = threading.Lock()
+
+# Held while queueing changes, which happens while sending to any channel
+changing = threading.Lock()
+
+# In a worker process, channel_id -> {message_id: (time_created, text)} for
+# the channel's messages, and message_id -> channel_id of every message held
+shards = {}
+held = {}
+
+def is_worthwhile(channel_ids):
+    '''
+    Checks if scanning the given channels should be done by the pool
+    '''
+    if WORKERS < 2:
+        return False
+    total = sum(data.count_messages(data.get_channel(channel_id)) for channel_id in channel_ids)
+    return total >= MIN_MESSAGES
+
+def scan(channel_ids, query_str, count=None, before=None):
+    '''
+    Returns the (time_created, message_id) keys of messages in the given
+    channels containing query_str, newest first.
+    Only keys below "before" are returned, and at most "count" of them.
+    '''
+    with sending:
+        workers = get_workers()
+        with changing:
+            changes, pool['changes'] = pool['changes'], []
+            stale, pool['stale'] = pool['stale'], False
+            unloaded = set(channel_ids) - pool['loaded']
+            pool['loaded'] |= unloaded
+        parts = partition(channel_ids, len(workers))
+        for worker, part in zip(workers, parts):
+            if stale:
+                worker.submit(drop_shards)
+            if changes:
+                worker.submit(apply_changes, changes)
+            # The caller holds the locks of these channels to read
+            load = {channel_id: shard(data.get_channel(channel_id))
+                    for channel_id in part if channel_id in unloaded}
+            if load:
+                worker.submit(load_shards, load)
+        futures = [worker.submit(scan_shards, part, query_str, count, before)
+                   for worker, part in zip(workers, parts) if part]
+    merged = heapq.merge(*[future.result() for future in futures], reverse=True)
+    return list(itertools.islice(merged, count))
+
+def partition(channel_ids, parts):
+    '''
+    Splits channels between the workers holding their shards
+    '''
+    split = [[] for _ in range(parts)]
+    for channel_id in channel_ids:
+        split[channel_id % parts].append(channel_id)
+    return split
+
+def get_workers():
+    '''
+    Returns the workers, starting them if they aren't running yet
+    '''
+    if pool['workers'] is None:
+        pool['workers'] = [ProcessPoolExecutor(1) for _ in range(WORKERS)]
+    return pool['workers']
+
+# The changes below are sent while holding the lock of their channel to
+# write, and a channel is only loaded while holding its lock to read, so
+# whether a channel is loaded can be checked before taking changing. Sends
+# don't wait on each other for channels the workers don't hold.
+
+def add_message(message, channel_id):
+    '''
+    Queues a message added to a channel for the worker holding its shard
+    '''
+    if channel_id in pool['loaded']:
+        queue_change(('add', channel_id, message['message_id'],
+                      message['time_created'], message['message']))
+
+def update_message(message):
+    '''
+    Queues the new text of an edited message for the workers
+    '''
+    if pool['loaded']:
+        queue_change(('edit', message['message_id'], message['message']))
+
+def remove_message(message_id):
+    '''
+    Queues a removed message to be dropped by the workers
+    '''
+    if pool['loaded']:
+        queue_change(('remove', message_id))
+
+def forget_channel(channel_id):
+    '''
+    Queues the shard of a deleted channel to be dropped by its worker
+    '''
+    if channel_id in pool['loaded']:
+        with changing:
+            pool['loaded'].discard(channel_id)
+        queue_change(('forget', channel_id))
+
+def queue_change(change):
+    '''
+    Queues a change for the workers. Once too many are queued, they are
+    dropped along with every shard, which are sent again in full as they are
+    searched
+    '''
+    with changing:
+        pool['changes'].append(change)
+        if len(pool['changes']) > MAX_CHANGES:
+            pool['changes'] = []
+            pool['loaded'] = set()
+            pool['stale'] = True
+
+def shard(channel):
+    '''
+    Returns the text of a channel's messages in the form workers hold it
+    '''
+    return {message['message_id']: (message['time_created'], message['message'])
+            for message in data.iter_channel_messages(channel)}
+
+def load_shards(channel_texts):
+    '''
+    Runs in a worker, storing its copy of some channels' message text
+    '''
+    for channel_id, channel_text in channel_texts.items():
+        drop_shard(channel_id)
+        shards[channel_id] = channel_text
+        for message_id in channel_text:
+            held[message_id] = channel_id
+
+def apply_changes(changes):
+    '''
+    Runs in a worker, applying the changes made since the last search to the
+    shards it holds
+    '''
+    for change in changes:
+        kind = change[0]
+        if kind == 'add':
+            _, channel_id, message_id, time_created, text = change
+            if channel_id in shards:
+                shards[channel_id][message_id] = (time_created, text)
+                held[message_id] = channel_id
+        elif kind == 'edit':
+            _, message_id, text = change
+            if message_id in held:
+                channel_text = shards[held[message_id]]
+                channel_text[message_id] = (channel_text[message_id][0], text)
+        elif kind == 'remove':
+            channel_id = held.pop(change[1], None)
+            if channel_id is not None:
+                del shards[channel_id][change[1]]
+        else:
+            drop_shard(change[1])
+
+def drop_shard(channel_id):
+    '''
+    Runs in a worker, dropping its copy of a channel's message text
+    '''
+    for message_id in shards.pop(channel_id, {}):
+        held.pop(message_id, None)
+
+def drop_shards():
+    '''
+    Runs in a worker, dropping every shard it holds
+    '''
+    shards.clear()
+    held.clear()
+
+def scan_shards(channel_ids, query_str, count, before):
+    '''
+    Runs in a worker, returning the newest matching keys from some channels
+    '''
+    found = []
+    for channel_id in channel_ids:
+        matches = [(time_created, message_id)
+                   for message_id, (time_created, text) in shards[channel_id].items()
+                   if query_str in text
+                   and (before is None or (time_created, message_id) < before)]
+        matches.sort(reverse=True)
+        found.append(matches)
+    return list(itertools.islice(heapq.merge(*found, reverse=True), count))
+
+def close():
+    '''
+    Shuts the workers down
+    '''
+    workers = pool['workers'] or []
+    for worker in workers:
+        worker.shutdown()
+    with changing:
+        pool['workers'] = None
+        pool['loaded'] = set()
+        pool['changes'] = []
+        pool['stale'] = False
@@ -1,7 +1,7 @@
 '''Server side of implementation'''
 
 from json import dumps
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory
 from flask_cors import CORS
 import auth
 import channel
@@ -10,7 +10,11 @@ import message
 import user
 import other
 import standup
-from error import InputError
+import scheduler
+import snapshot
+import replica
+import config
+from error import InputError, AccessError
 
 def default_handler(err):
     '''Handles errors'''
@@ -30,6 +34,14 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, default_handler)
 
+@APP.before_request
+def read_only():
+    '''Turns away requests that change state, or need state only the
+    primary has, when this server is a follower'''
+    if replica.is_follower() and (request.method != 'GET'
+                                  or request.path in replica.PRIMARY_ONLY_ROUTES):
+        raise AccessError(description='This server is a read-only follower')
+
 @APP.route('/auth/login', methods=['POST'])
 def login():
     '''Calls the login function from auth.py'''
@@ -102,14 +114,39 @@ def channel_details_flask():
 @APP.route("/channel/messages", methods=['GET'])
 def channel_messages_flask():
     '''Calls the messages function from channel.py'''
+    before_message_id = request.args.get('before_message_id')
+    after_message_id = request.args.get('after_message_id')
     return dumps(
         channel.channel_messages(
             request.args.get('token'),
             int(request.args.get('channel_id')),
-            int(request.args.get('start'))
+            int(request.args.get('start', 0)),
+            int(request.args.get('limit', channel.PAGE_SIZE)),
+            None if before_message_id is None else int(before_message_id),
+            None if after_message_id is None else int(after_message_id),
         )
     )
 
+@APP.route("/channel/messages/range", methods=['GET'])
+def channel_messages_range_flask():
+    '''Streams the result of the messages_range function from channel.py'''
+    messages = channel.iter_messages_range(
+        request.args.get('token'),
+        int(request.args.get('channel_id')),
+        float(request.args.get('time_start')),
+        float(request.args.get('time_end')),
+    )
+
+    def generate():
+        yield '{"messages": ['
+        separator = ''
+        for msg in messages:
+            yield separator + dumps(msg)
+            separator = ', '
+        yield ']}'
+
+    return Response(generate(), content_type='application/json')
+
 @APP.route("/channel/leave", methods=['POST'])
 def leave():
     '''Calls the leave function from channel.py'''
@@ -210,6 +247,49 @@ def message_sendlater_flask():
         )
     )
 
+@APP.route("/message/sendlater/list", methods=['GET'])
+def message_sendlater_list_flask():
+    '''Calls the sendlater_list function from message.py'''
+    return dumps(
+        message.message_sendlater_list(
+            request.args.get('token'), int(request.args.get('channel_id'))
+        )
+    )
+
+@APP.route("/message/sendlater/cancel", methods=['DELETE'])
+def message_sendlater_cancel_flask():
+    '''Calls the sendlater_cancel function from message.py'''
+    data = request.get_json()
+    return dumps(
+        message.message_sendlater_cancel(
+            data['token'], data['message_id']
+        )
+    )
+
+@APP.route("/message/sendlater/reschedule", methods=['PUT'])
+def message_sendlater_reschedule_flask():
+    '''Calls the sendlater_reschedule function from message.py'''
+    data = request.get_json()
+    return dumps(
+        message.message_sendlater_reschedule(
+            data['token'], data['message_id'], data['time_sent']
+        )
+    )
+
+@APP.route("/scheduler/metrics", methods=['GET'])
+def scheduler_metrics():
+    '''Returns the depth and lag of the message_sendlater scheduler'''
+    return dumps(
+        scheduler.metrics()
+    )
+
+@APP.route("/snapshot/metrics", methods=['GET'])
+def snapshot_metrics():
+    '''Returns the duration, size and server stall of the last snapshot'''
+    return dumps(
+        snapshot.metrics()
+    )
+
 @APP.route("/message/pin", methods=['POST'])
 def message_pin_flask():
     '''Calls the message_pin function from message.py'''
@@ -356,12 +436,37 @@ def search():
     '''Calls the admin user permission change function from other.py'''
     token = request.args.get('token')
     query_str = request.args.get('query_str')
+    limit = request.args.get('limit')
+    channel_id = request.args.get('channel_id')
+    u_id = request.args.get('u_id')
+    since = request.args.get('since')
+    until = request.args.get('until')
     return dumps(
         other.search(
-            token, query_str
+            token, query_str,
+            None if limit is None else int(limit),
+            request.args.get('cursor'),
+            None if channel_id is None else int(channel_id),
+            None if u_id is None else int(u_id),
+            None if since is None else float(since),
+            None if until is None else float(until),
         )
     )
 
+@APP.route('/replica/status', methods=['GET'])
+def replica_status():
+    '''Returns whether this server is a follower and how far behind the primary it is'''
+    return dumps(
+        replica.status()
+    )
+
+@APP.route('/search/metrics', methods=['GET'])
+def search_metrics():
+    '''Returns the hit rate and eviction count of the search result cache'''
+    return dumps(
+        other.search_metrics()
+    )
+
 # Example
 @APP.route("/echo", methods=['GET'])
 def echo():
@@ -374,4 +479,13 @@ def echo():
     })
 
 if __name__ == "__main__":
+    if config.FOLLOW_WAL:
+        replica.follow(config.FOLLOW_WAL, config.FOLLOW_INTERVAL_MS, config.SNAPSHOT_PATH)
+    elif config.STORAGE_BACKEND == 'sqlite':
+        other.open_storage(config.STORAGE_DB)
+    elif config.WAL_PATH:
+        other.load(config.WAL_PATH, config.WAL_FSYNC, config.WAL_FSYNC_INTERVAL_MS,
+                   config.SNAPSHOT_PATH, config.SNAPSHOT_INTERVAL)
+    if config.SCHEDULE_LOG and not config.FOLLOW_WAL:
+        scheduler.load(config.SCHEDULE_LOG)
     APP.run(port=0) # Do not edit this port
@@ -168,6 +168,52 @@ def test_server_search(url):
     search_data = response.json()
     assert 'messages' in search_data
 
+def test_server_search_limit(url):
+    '''Tests the calling of other.search with a limit and cursor'''
+
+    other.clear()
+
+    test_user_in = {
+        'email': 'test@email.com',
+        'password': 'test_pass',
+        'name_first': 'test_first',
+        'name_last': 'test_last',
+    }
+    test_user_data = requests.post(url + 'auth/register', json=test_user_in).json()
+
+    channel_in = {
+        'token': test_user_data['token'],
+        'name': 'channel1',
+        'is_public': True,
+    }
+    channel_id = requests.post(url + 'channels/create', json=channel_in).json()['channel_id']
+    for text in ['key 1', 'key 2', 'key 3']:
+        message_in = {
+            'token': test_user_data['token'],
+            'channel_id': channel_id,
+            'message': text,
+        }
+        requests.post(url + 'message/send', json=message_in)
+
+    data_in = {
+        'token': test_user_data['token'],
+        'query_str': 'key',
+        'limit': 2,
+    }
+    search_data = requests.get(url + 'search', params=data_in).json()
+    assert [msg['message'] for msg in search_data['messages']] == ['key 3', 'key 2']
+
+    data_in['cursor'] = search_data['next_cursor']
+    search_data = requests.get(url + 'search', params=data_in).json()
+    assert [msg['message'] for msg in search_data['messages']] == ['key 1']
+    assert search_data['next_cursor'] is None
+
+    # the same page again comes from the cache
+    requests.get(url + 'search', params=data_in)
+    metrics = requests.get(url + 'search/metrics').json()
+    assert metrics['hits'] == 1
+    assert metrics['misses'] == 2
+
 def test_server_search_error(url):
     '''Tests the error raising of other.search'''
 
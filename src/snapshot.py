@@ -0,0 +1,218 @@
+'''
+Binary snapshots of the whole data model in data.py, so that startup loads
+one file and only replays the part of the write-ahead log written after it.
+
+A snapshot is a pickle (protocol 5) of data's state, indexes included so
+nothing has to be rebuilt, along with the size the write-ahead log had when
+it was taken. It is read through mmap, so it is unpickled straight from the
+page cache instead of being read into a bytes object first.
+
+In "fork" mode, like Redis' BGSAVE, the process forks and the child writes
+the snapshot from its copy-on-write view of the state, so the server only
+stalls for as long as the fork takes rather than for the whole snapshot.
+'''
+
+import gc
+import mmap
+import os
+import pickle
+import threading
+import time
+import config
+import data
+import wal
+
+# Version of the snapshot layout, snapshots of another version are ignored
+FORMAT = 2
+
+# "fork" to write periodic snapshots from a forked child, "inline" to write
+# them from the server process
+MODE = config.SNAPSHOT_MODE
+
+# Counters reported by metrics()
+stats = {
+    'taken': 0,
+    'failed': 0,
+    'duration': 0.0,
+    'bytes': 0,
+    'stall': 0.0,
+    'wal_offset': 0,
+}
+
+# Child process writing a snapshot in fork mode and the thread waiting for it
+forked = {
+    'pid': None,
+    'waiter': None,
+}
+
+# Stops the periodic snapshot thread when set
+stopping = threading.Event()
+worker = None
+
+def take(path):
+    '''
+    Writes a snapshot of the current state to path and returns its metrics.
+    Changes wait while the state is serialised.
+    '''
+    started = time.perf_counter()
+    gc.disable()
+    try:
+        with wal.lock:
+            offset = wal.position()
+            blob = dumps(offset)
+    finally:
+        gc.enable()
+    write(path, blob)
+
+    duration = time.perf_counter() - started
+    stats['taken'] += 1
+    stats['duration'] = duration
+    stats['bytes'] = len(blob)
+    stats['stall'] = duration
+    stats['wal_offset'] = offset
+    return metrics()
+
+def take_forked(path):
+    '''
+    Forks a child that writes a snapshot of the state as it was at the fork,
+    while this process carries on. Returns False without forking if a
+    snapshot is still being written. Metrics are updated once the child exits.
+    '''
+    if forked['pid'] is not None:
+        return False
+
+    started = time.perf_counter()
+    # Keeps the collector from touching, and so copying, every page in the child
+    gc.freeze()
+    with wal.lock:
+        offset = wal.position()
+        pid = os.fork()
+        if pid == 0:
+            write_from_child(path, offset)
+    stall = time.perf_counter() - started
+    gc.unfreeze()
+
+    forked['pid'] = pid
+    forked['waiter'] = threading.Thread(target=wait_for_child,
+                                        args=(pid, path, offset, started, stall),
+                                        name='snapshot-waiter', daemon=True)
+    forked['waiter'].start()
+    return True
+
+def write_from_child(path, offset):
+    '''
+    Runs in the forked child, writing the snapshot then exiting without
+    running any of the parent's cleanup
+    '''
+    status = 1
+    try:
+        gc.disable()
+        write(path, dumps(offset))
+        status = 0
+    finally:
+        os._exit(status) # pylint: disable=protected-access
+
+def wait_for_child(pid, path, offset, started, stall):
+    '''
+    Waits for a forked child to finish its snapshot and records how it went
+    '''
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) == 0:
+        stats['taken'] += 1
+        stats['duration'] = time.perf_counter() - started
+        stats['bytes'] = os.path.getsize(path)
+        stats['wal_offset'] = offset
+    else:
+        stats['failed'] += 1
+    stats['stall'] = stall
+    forked['pid'] = None
+
+def wait_forked():
+    '''
+    Waits for a snapshot being written by a forked child to finish
+    '''
+    waiter = forked['waiter']
+    if waiter is not None:
+        waiter.join()
+
+def dumps(offset):
+    '''
+    Serialises the state, which must not change while this runs
+    '''
+    return pickle.dumps({
+        'format': FORMAT,
+        'wal_offset': offset,
+        'state': data.export_state(),
+    }, protocol=5)
+
+def write(path, blob):
+    '''
+    Replaces the file at path with blob, so a crash leaves either the old
+    snapshot or the new one
+    '''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as snapshot_file:
+        snapshot_file.write(blob)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+def restore(path):
+    '''
+    Loads the snapshot at path into data and returns the offset of the
+    write-ahead log to replay from, or 0 if there is no usable snapshot
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    # The collector would otherwise keep scanning the objects being unpickled
+    gc.disable()
+    try:
+        with open(path, 'rb') as snapshot_file:
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                saved = pickle.loads(mapped)
+    finally:
+        gc.enable()
+    if saved.get('format') != FORMAT:
+        return 0
+    data.import_state(saved['state'])
+    stats['wal_offset'] = saved['wal_offset']
+    return saved['wal_offset']
+
+def start(path, interval):
+    '''
+    Takes a snapshot every interval seconds while changes are being logged
+    '''
+    global worker # pylint: disable=global-statement
+    stop()
+    stopping.clear()
+    worker = threading.Thread(target=run, args=(path, interval),
+                              name='snapshot', daemon=True)
+    worker.start()
+
+def run(path, interval):
+    '''
+    Periodic snapshot loop, skipping snapshots when nothing has changed
+    '''
+    while not stopping.wait(interval):
+        if wal.is_open() and wal.position() != stats['wal_offset']:
+            if MODE == 'fork':
+                take_forked(path)
+            else:
+                take(path)
+
+def stop():
+    '''
+    Stops taking periodic snapshots
+    '''
+    global worker # pylint: disable=global-statement
+    if worker is not None:
+        stopping.set()
+        worker.join()
+        worker = None
+    wait_forked()
+
+def metrics():
+    '''
+    Returns the number of snapshots taken and the cost of the last one
+    '''
+    return dict(stats)
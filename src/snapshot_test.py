@@ -0,0 +1,184 @@
+'''
+Tests for snapshots of the data model
+'''
+
+import threading
+import time
+import auth
+import channel
+import channels
+import message
+import other
+import search_index
+import snapshot
+import data
+import wal
+
+def state(token):
+    '''
+    Returns everything a user can see, to compare before and after a restart
+    '''
+    return {
+        'users': other.users_all(token),
+        'channels': [
+            (channel.channel_details(token, listed['channel_id']),
+             channel.channel_messages(token, listed['channel_id'], 0))
+            for listed in channels.channels_listall(token)['channels']
+        ],
+        'search': other.search(token, 'o'),
+        'max_ids': (data.MAX_MESSAGE_ID, data.MAX_CHANNEL_ID),
+    }
+
+def restart(log_path, snapshot_path, snapshot_interval=None):
+    '''
+    Drops the in-memory state and reloads it from the snapshot and log
+    '''
+    snapshot.stop()
+    wal.close()
+    other.clear()
+    other.load(log_path, 'always', 10, snapshot_path, snapshot_interval)
+
+def test_snapshot_and_wal_tail(tmp_path, monkeypatch):
+    '''
+    Tests that a restart loads the snapshot and only replays the log after it
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    snapshot_path = str(tmp_path / 'flockr.snapshot')
+    other.load(log_path, 'always', 10, snapshot_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    channel.channel_join(user2['token'], c_id1)
+    for num in range(20):
+        message.message_send(token1, c_id1, f'Hello {num}')
+
+    metrics = snapshot.take(snapshot_path)
+    assert metrics['taken'] == 1
+    assert metrics['bytes'] > 0
+    assert metrics['wal_offset'] == wal.position()
+
+    m_id = message.message_send(user2['token'], c_id1, 'After the snapshot')['message_id']
+    message.message_react(token1, m_id, 1)
+    channel.channel_leave(user2['token'], c_id1)
+    before = state(token1)
+
+    applied = []
+    apply = data.apply
+    monkeypatch.setattr(data, 'apply', lambda record: applied.append(record) or apply(record))
+    restart(log_path, snapshot_path)
+    assert [record[0] for record in applied] == ['add_message', 'add_react', 'remove_member']
+    assert state(token1) == before
+
+    # changes after the restart are logged after the replayed tail
+    message.message_send(token1, c_id1, 'Hello again')
+    before = state(token1)
+    restart(log_path, snapshot_path)
+    assert state(token1) == before
+    wal.close()
+    other.clear()
+
+def test_periodic_snapshot(tmp_path):
+    '''
+    Tests that snapshots are taken periodically, only when something changed
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    snapshot_path = str(tmp_path / 'flockr.snapshot')
+    other.load(log_path, 'always', 10, snapshot_path, 0.05)
+    taken = snapshot.metrics()['taken']
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    channels.channels_create(user1['token'], 'channel1', True)
+    time.sleep(0.2)
+    assert snapshot.metrics()['taken'] == taken + 1
+    assert snapshot.metrics()['wal_offset'] == wal.position()
+
+    before = state(user1['token'])
+    restart(log_path, snapshot_path, 0.05)
+    assert state(user1['token']) == before
+    snapshot.stop()
+    wal.close()
+    other.clear()
+
+def test_forked_snapshot(tmp_path):
+    '''
+    Tests that a forked child writes the state as it was when it forked
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    snapshot_path = str(tmp_path / 'flockr.snapshot')
+    other.load(log_path, 'always', 10, snapshot_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    for num in range(50):
+        message.message_send(token1, c_id1, f'Hello {num}')
+    taken = snapshot.metrics()['taken']
+    offset = wal.position()
+
+    assert snapshot.take_forked(snapshot_path)
+    # changes made while the child writes are left to the log
+    message.message_send(token1, c_id1, 'While forked')
+    snapshot.wait_forked()
+
+    metrics = snapshot.metrics()
+    assert metrics['taken'] == taken + 1
+    assert metrics['failed'] == 0
+    assert metrics['wal_offset'] == offset
+    assert metrics['bytes'] > 0
+    assert 0 <= metrics['stall'] <= metrics['duration']
+
+    before = state(token1)
+    restart(log_path, snapshot_path)
+    assert state(token1) == before
+    wal.close()
+    other.clear()
+
+def test_restart_searches_while_indexing(tmp_path, monkeypatch):
+    '''
+    Tests that a restart doesn't wait for the search index to be rebuilt, and
+    that searches find the same messages before and after it is
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    snapshot_path = str(tmp_path / 'flockr.snapshot')
+    other.load(log_path, 'always', 10, snapshot_path)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(token1, 'channel2', True)['channel_id']
+    channel.channel_join(user2['token'], c_id1)
+    channel.channel_join(user2['token'], c_id2)
+    for num in range(20):
+        sender = user2 if num % 3 else user1
+        message.message_send(sender['token'], c_id2 if num % 2 else c_id1, f'Hello {num}')
+    snapshot.take(snapshot_path)
+    message.message_send(token1, c_id1, 'Hello after')
+
+    searches = [('Hello', {}), ('Hello 1', {}), ('lo', {'u_id': user2['u_id']}),
+                ('Hello', {'channel_id': c_id2}), ('', {'since': 0})]
+    before = [other.search(token1, query_str, **filters) for query_str, filters in searches]
+
+    started = threading.Event()
+    run_rebuild = search_index.run_rebuild
+    monkeypatch.setattr(search_index, 'run_rebuild',
+                        lambda *args: started.wait(5) and run_rebuild(*args))
+    restart(log_path, snapshot_path)
+    assert not search_index.ready.is_set()
+    assert search_index.candidates('Hello') is None
+    assert [other.search(token1, query_str, **filters)
+            for query_str, filters in searches] == before
+
+    started.set()
+    assert search_index.ready.wait(5)
+    assert search_index.candidates('Hello 1') is not None
+    assert [other.search(token1, query_str, **filters)
+            for query_str, filters in searches] == before
+    wal.close()
+    other.clear()
@@ -6,9 +6,11 @@ import time
 from datetime import datetime
 import error
 import data
+import locks
 from channel import find_user, find_channel, check_member
 from message import check_token_channel, send_to_channel
 
+@locks.channel_writes
 def standup_start(token, channel_id, length):
     '''
     Start standup session
@@ -18,39 +20,37 @@ def standup_start(token, channel_id, length):
     if not check_member(user['u_id'], detail):
         raise error.AccessError(description="This user is not a member of this channel")
 
-    if 'standup' in detail:
+    if data.get_standup(detail) is not None:
         raise error.InputError(description="Active standup already in session")
 
     finish = time.time() + length
-    detail['standup'] = {'finish' : finish, 'messages': []}
+    data.start_standup(detail, finish, token)
 
     session = threading.Timer(length, function=standup_end, \
-    args=(token, channel_id))
+    args=(token, channel_id, finish))
     session.start()
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
     return {'time_finish' : finish}
 
-def standup_end(token, channel_id):
+@locks.channel_writes
+def standup_end(token, channel_id, finish=None):
     '''
-    End standup session
+    End standup session, unless the session that finishes at finish
+    has already ended
     '''
     find_user(token)
     detail = find_channel(channel_id)
+    log = data.end_standup(detail, finish)
+    if log is None:
+        return
 
-    log = detail['standup']['messages']
     string = ''
     for entry in log:
         entry = entry.items()
         for item in entry:
             string = string + str(item[0]) + ' : ' + ''.join(item[1]) + '\n'
-    del detail['standup']
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
     send_log(token, channel_id, string)
 
+@locks.channel_reads
 def standup_active(token, channel_id):
     '''
     Return the finish time for standup active session
@@ -62,12 +62,14 @@ def standup_active(token, channel_id):
 
     active = False
     time_end = None
-    if 'standup' in detail:
+    standup = data.get_standup(detail)
+    if standup is not None:
         active = True
-        time_end = detail['standup']['finish']
+        time_end = standup['finish']
 
     return {'is_active' : active, 'time_finish' : time_end}
 
+@locks.channel_writes
 def standup_send(token, channel_id, message):
     '''
     Send message to active standup session
@@ -77,7 +79,7 @@ def standup_send(token, channel_id, message):
     if not check_member(user['u_id'], detail):
         raise error.AccessError(description="This user is not a member of this channel")
 
-    if 'standup' not in detail:
+    if data.get_standup(detail) is None:
         raise error.InputError(description="No active standup session")
 
     if '/standup' in message[:8]:
@@ -85,15 +87,23 @@ def standup_send(token, channel_id, message):
     if len(message) > 1000:
         raise error.InputError(description="Message is too large")
 
-    send = {user['handle_str']: {message}}
-    detail['standup']['messages'].append(send)
-
-    for channel in data.channels:
-        if channel['channel_id'] == channel_id:
-            channel = detail
+    data.add_standup_message(detail, user['handle_str'], message)
 
     return {}
 
+def resume_standups():
+    '''
+    Restarts the timers of standups that were active when the server stopped,
+    ending the ones that are already over straight away
+    '''
+    for detail in data.iter_channels():
+        standup = data.get_standup(detail)
+        if standup is not None:
+            length = max(standup['finish'] - time.time(), 0)
+            session = threading.Timer(length, function=standup_end, \
+            args=(standup['token'], detail['channel_id'], standup['finish']))
+            session.start()
+
 def send_log(token, channel_id, message):
     '''
     This returns a log of all the messages sent in standup.
@@ -101,8 +111,7 @@ def send_log(token, channel_id, message):
     '''
     u_id = check_token_channel(token, channel_id)
 
-    new_message_id = data.MAX_MESSAGE_ID + 1
-    data.MAX_MESSAGE_ID = new_message_id
+    new_message_id = data.new_message_id()
 
     time_created = datetime.now().timestamp()
     send_to_channel(channel_id, new_message_id, u_id, message, time_created)
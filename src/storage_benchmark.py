@@ -0,0 +1,103 @@
+'''
+Benchmark of the storage backends, running the same users, channels and
+messages through the in-memory lists and through the SQLite database.
+
+    python3 src/storage_benchmark.py [messages]
+
+prints the operations per second of each backend for sending messages,
+paging through a channel, reading a time range, looking users up by email
+and handle, and reacting to messages.
+'''
+
+import os
+import sys
+import tempfile
+import time
+import auth
+import channel
+import channels
+import message
+import other
+import data
+
+# Messages sent to the benchmarked channel when no number is given
+MESSAGES = 20000
+
+# Users taking turns sending the messages
+USERS = 50
+
+# Times each read is repeated
+READS = 500
+
+def timed(results, name, calls):
+    '''
+    Runs each call and records how many ran per second under name
+    '''
+    started = time.perf_counter()
+    for call in calls:
+        call()
+    results[name] = len(calls) / (time.perf_counter() - started)
+
+def run(backend, messages=MESSAGES, path=None):
+    '''
+    Runs every benchmarked operation on a backend, with the SQLite database
+    kept at path, and returns the operations per second of each
+    '''
+    if backend == 'sqlite':
+        other.open_storage(path)
+    other.clear()
+    results = {}
+    reads = min(READS, messages)
+    try:
+        users = [auth.auth_register(f'user{num}@email.com', 'password', 'User', f'Number{num}')
+                 for num in range(USERS)]
+        token = users[0]['token']
+        c_id = channels.channels_create(token, 'benchmark', True)['channel_id']
+        for registered in users[1:]:
+            channel.channel_join(registered['token'], c_id)
+
+        timed(results, 'message_send', [
+            lambda num=num: message.message_send(users[num % USERS]['token'], c_id,
+                                                 f'Message number {num}')
+            for num in range(messages)])
+        timed(results, 'channel_messages newest page', [
+            lambda: channel.channel_messages(token, c_id, 0)] * reads)
+        timed(results, 'channel_messages before cursor', [
+            lambda num=num: channel.channel_messages(token, c_id, before_message_id=num)
+            for num in range(messages, messages - reads, -1)])
+
+        sent = channel.channel_messages(token, c_id, messages // 2, 2)['messages']
+        timed(results, 'channel_messages_range', [
+            lambda: channel.channel_messages_range(token, c_id, sent[1]['time_created'],
+                                                   sent[0]['time_created'])] * reads)
+        timed(results, 'get_user_by_email', [
+            lambda num=num: data.get_user_by_email(f'user{num % USERS}@email.com')
+            for num in range(reads)])
+        timed(results, 'get_user_by_handle', [
+            lambda num=num: data.get_user_by_handle(f'UserNumber{num % USERS}')
+            for num in range(reads)])
+        timed(results, 'message_react', [
+            lambda num=num: message.message_react(token, num, 1)
+            for num in range(messages, messages - reads, -1)])
+        other.clear()
+    finally:
+        data.use_backend('memory')
+    return results
+
+def main():
+    '''
+    Benchmarks both backends and prints their results side by side
+    '''
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    memory = run('memory', messages)
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite = run('sqlite', messages, os.path.join(directory, 'benchmark.db'))
+
+    print(f'{messages} messages from {USERS} users, operations per second')
+    print(f'{"operation":<34}{"memory":>12}{"sqlite":>12}{"ratio":>8}')
+    for name, per_second in memory.items():
+        print(f'{name:<34}{per_second:>12.0f}{sqlite[name]:>12.0f}'
+              f'{per_second / sqlite[name]:>8.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+'''
+Tests for the storage benchmark
+'''
+
+import storage_benchmark
+import data
+
+def test_benchmark(tmp_path):
+    '''
+    Tests that both backends run every benchmarked operation
+    '''
+    memory = storage_benchmark.run('memory', 20)
+    sqlite = storage_benchmark.run('sqlite', 20, str(tmp_path / 'benchmark.db'))
+    assert list(memory) == list(sqlite)
+    assert all(per_second > 0 for per_second in memory.values())
+    assert all(per_second > 0 for per_second in sqlite.values())
+    assert data.BACKEND == 'memory'
@@ -0,0 +1,777 @@
+'''
+SQLite backend for the repository API in data.py, used instead of the
+in-memory lists when config.STORAGE_BACKEND is "sqlite", so that users,
+channels and messages are kept on disk rather than in memory.
+
+The database is in WAL journal mode, so reads don't wait for a write being
+committed. Each thread uses its own connection, which keeps its prepared
+statements cached, and connections of threads that have finished are reused
+by new ones. Writes are serialised by a lock and each one is a transaction.
+
+Every function here has the same name and arguments as the one it stands in
+for in data.py and returns dicts of the same shape. The dicts are read fresh
+from the database, so a change has to go through the functions here, which
+also apply it to the dict they are given so the caller keeps seeing it.
+'''
+
+import contextlib
+import json
+import sqlite3
+import threading
+import weakref
+
+# Messages read at a time by iter_newest
+PAGE_SIZE = 100
+
+# Prepared statements each connection keeps cached
+STATEMENT_CACHE = 256
+
+# Seconds a connection waits for another process' write before giving up
+BUSY_TIMEOUT = 5.0
+
+# Tables and indexes of the database. message_id, u_id and channel_id are
+# each their table's rowid, so lookups by them need no other index, and
+# channels.message_count keeps count_messages from counting rows
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    handle_str TEXT NOT NULL,
+    details TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_public INTEGER NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    standup TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, u_id)
+);
+CREATE TABLE IF NOT EXISTS owners (
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, u_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    time_created REAL NOT NULL,
+    body TEXT NOT NULL,
+    is_pinned INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reacts (
+    message_id INTEGER NOT NULL,
+    react_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS reset_codes (
+    reset_code TEXT PRIMARY KEY,
+    email TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('message_id', 0), ('channel_id', 0);
+CREATE INDEX IF NOT EXISTS users_by_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_by_handle ON users (handle_str);
+CREATE INDEX IF NOT EXISTS members_by_user ON members (u_id);
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages (channel_id, time_created, message_id);
+CREATE INDEX IF NOT EXISTS reacts_by_message ON reacts (message_id);
+CREATE INDEX IF NOT EXISTS reset_codes_by_email ON reset_codes (email);
+'''
+
+# Columns of the messages table read into message dicts
+MESSAGE_COLUMNS = 'message_id, channel_id, u_id, time_created, body, is_pinned'
+
+# Path of the open database, and a number bumped every time one is opened
+# so connections to a database that was closed aren't used again
+db = {
+    'path': None,
+    'generation': 0,
+}
+
+# Connections of threads that have finished, as (generation, connection)
+idle = []
+
+# The connection of the current thread, and the generation it was opened in
+local = threading.local()
+
+# Counters bumped like data.channel_versions and data.membership_versions.
+# They only tell this process' caches that something changed, so they are
+# kept in memory
+versions = {
+    'channels': {},
+    'memberships': {},
+}
+
+lock = threading.RLock()
+
+def open_db(path):
+    '''
+    Opens the database at path in WAL journal mode, creating its tables and
+    indexes if they don't exist
+    '''
+    close()
+    with lock:
+        db['path'] = path
+        db['generation'] += 1
+        connection = connect()
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.executescript(SCHEMA)
+
+def close():
+    '''
+    Closes the database. Connections to it are closed as the threads holding
+    them next use or finish with them.
+    '''
+    with lock:
+        db['path'] = None
+        db['generation'] += 1
+        while idle:
+            idle.pop()[1].close()
+
+def connect():
+    '''
+    Returns the current thread's connection, taking an idle one or opening a
+    new one the first time the thread uses the database
+    '''
+    connection = getattr(local, 'connection', None)
+    if connection is not None and local.generation == db['generation']:
+        return connection
+    if connection is not None:
+        connection.close()
+        connection = None
+
+    with lock:
+        generation = db['generation']
+        while idle and connection is None:
+            idle_generation, connection = idle.pop()
+            if idle_generation != generation:
+                connection.close()
+                connection = None
+    if connection is None:
+        path = db['path']
+        connection = sqlite3.connect(path, uri=path.startswith('file:'), timeout=BUSY_TIMEOUT,
+                                     isolation_level=None, check_same_thread=False,
+                                     cached_statements=STATEMENT_CACHE)
+        # In WAL mode this only syncs at checkpoints, and a crash can only
+        # lose the last transactions, never corrupt the database
+        connection.execute('PRAGMA synchronous = NORMAL')
+    local.connection = connection
+    local.generation = generation
+    # Hands the connection on once this thread is gone
+    weakref.finalize(threading.current_thread(), release, generation, connection)
+    return connection
+
+def release(generation, connection):
+    '''
+    Keeps the connection of a finished thread for the next thread to use
+    '''
+    with lock:
+        if generation == db['generation']:
+            idle.append((generation, connection))
+        else:
+            connection.close()
+
+def read(sql, params=()):
+    '''
+    Runs a query and returns every row it finds
+    '''
+    return connect().execute(sql, params).fetchall()
+
+def read_one(sql, params=()):
+    '''
+    Runs a query and returns its first row, or None
+    '''
+    rows = read(sql, params)
+    return rows[0] if rows else None
+
+@contextlib.contextmanager
+def writing():
+    '''
+    Holds the lock for one transaction, which is committed when the block
+    ends or rolled back if it raises
+    '''
+    with lock:
+        connection = connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+def load_user(row):
+    '''
+    Turns a users row into a user dict, or None if there is no row
+    '''
+    return None if row is None else json.loads(row[0])
+
+def add_user(user):
+    '''
+    Stores a new user
+    '''
+    with writing() as connection:
+        connection.execute('INSERT INTO users (u_id, email, handle_str, details) '
+                           'VALUES (?, ?, ?, ?)',
+                           (user['u_id'], user['email'], user['handle_str'], json.dumps(user)))
+
+def get_user(u_id):
+    '''
+    Returns the user with the given u_id, or None
+    '''
+    return load_user(read_one('SELECT details FROM users WHERE u_id = ?', (u_id,)))
+
+def get_user_by_email(email):
+    '''
+    Returns the user with the given email, or None
+    '''
+    return load_user(read_one('SELECT details FROM users WHERE email = ?', (email,)))
+
+def get_user_by_handle(handle_str):
+    '''
+    Returns the user with the given handle, or None
+    '''
+    return load_user(read_one('SELECT details FROM users WHERE handle_str = ?', (handle_str,)))
+
+def update_user(user, changes):
+    '''
+    Changes some of a user's details
+    '''
+    user.update(changes)
+    with writing() as connection:
+        stored = load_user(connection.execute('SELECT details FROM users WHERE u_id = ?',
+                                              (user['u_id'],)).fetchone())
+        stored.update(changes)
+        connection.execute('UPDATE users SET email = ?, handle_str = ?, details = ? '
+                           'WHERE u_id = ?',
+                           (stored['email'], stored['handle_str'], json.dumps(stored),
+                            stored['u_id']))
+
+def set_user_email(user, email):
+    '''
+    Changes a user's email
+    '''
+    update_user(user, {'email': email})
+
+def set_user_handle(user, handle_str):
+    '''
+    Changes a user's handle
+    '''
+    update_user(user, {'handle_str': handle_str})
+
+def count_users():
+    '''
+    Returns the number of registered users
+    '''
+    return read_one('SELECT COUNT(*) FROM users')[0]
+
+def iter_users():
+    '''
+    Yields every user in the order they registered
+    '''
+    for row in read('SELECT details FROM users ORDER BY u_id'):
+        yield load_user(row)
+
+def load_channel(row):
+    '''
+    Turns a channels row into a channel dict, or None if there is no row
+    '''
+    if row is None:
+        return None
+    return {
+        'channel_id': row[0],
+        'name': row[1],
+        'is_public': bool(row[2]),
+    }
+
+def add_channel(channel):
+    '''
+    Stores a new channel along with its initial members, owners and messages
+    '''
+    channel_id = channel['channel_id']
+    with writing() as connection:
+        connection.execute('INSERT INTO channels (channel_id, name, is_public) VALUES (?, ?, ?)',
+                           (channel_id, channel['name'], channel['is_public']))
+        for member in channel['all_members']:
+            connection.execute('INSERT OR IGNORE INTO members VALUES (?, ?)',
+                               (channel_id, member['u_id']))
+            bump_membership(member['u_id'])
+        for owner in channel['owner_members']:
+            connection.execute('INSERT OR IGNORE INTO owners VALUES (?, ?)',
+                               (channel_id, owner['u_id']))
+        for message in channel.get('messages', []):
+            insert_message(connection, channel_id, message)
+
+def get_channel(channel_id):
+    '''
+    Returns the channel with the given channel_id, or None
+    '''
+    return load_channel(read_one('SELECT channel_id, name, is_public FROM channels '
+                                 'WHERE channel_id = ?', (channel_id,)))
+
+def count_channels():
+    '''
+    Returns the number of channels
+    '''
+    return read_one('SELECT COUNT(*) FROM channels')[0]
+
+def iter_channels():
+    '''
+    Yields every channel in the order they were created
+    '''
+    for row in read('SELECT channel_id, name, is_public FROM channels ORDER BY channel_id'):
+        yield load_channel(row)
+
+def next_counter(name):
+    '''
+    Adds one to a counter and returns its new value
+    '''
+    with writing() as connection:
+        connection.execute('UPDATE counters SET value = value + 1 WHERE name = ?', (name,))
+        return connection.execute('SELECT value FROM counters WHERE name = ?',
+                                  (name,)).fetchone()[0]
+
+def new_channel_id():
+    '''
+    Returns an unused channel_id for a new channel
+    '''
+    return next_counter('channel_id')
+
+def get_user_channels(u_id):
+    '''
+    Returns the set of channel_ids the user is a member of
+    '''
+    return {row[0] for row in read('SELECT channel_id FROM members WHERE u_id = ?', (u_id,))}
+
+def is_member(channel_id, u_id):
+    '''
+    Checks if the user is a member of the channel
+    '''
+    return read_one('SELECT 1 FROM members WHERE channel_id = ? AND u_id = ?',
+                    (channel_id, u_id)) is not None
+
+def is_owner(channel_id, u_id):
+    '''
+    Checks if the user is an owner of the channel
+    '''
+    return read_one('SELECT 1 FROM owners WHERE channel_id = ? AND u_id = ?',
+                    (channel_id, u_id)) is not None
+
+def get_members(channel):
+    '''
+    Returns the users who are members of a channel, in the order they joined
+    '''
+    return [load_user(row) for row in read(
+        'SELECT users.details FROM members JOIN users USING (u_id) '
+        'WHERE members.channel_id = ? ORDER BY members.rowid', (channel['channel_id'],))]
+
+def get_owners(channel):
+    '''
+    Returns the users who are owners of a channel, in the order they became one
+    '''
+    return [load_user(row) for row in read(
+        'SELECT users.details FROM owners JOIN users USING (u_id) '
+        'WHERE owners.channel_id = ? ORDER BY owners.rowid', (channel['channel_id'],))]
+
+def add_member(channel, user):
+    '''
+    Adds a user to a channel's members, doing nothing if they already are one
+    '''
+    with writing() as connection:
+        added = connection.execute('INSERT OR IGNORE INTO members VALUES (?, ?)',
+                                   (channel['channel_id'], user['u_id'])).rowcount
+        if added:
+            bump_membership(user['u_id'])
+
+def add_owner(channel, user):
+    '''
+    Adds a user to a channel's owners, doing nothing if they already are one
+    '''
+    with writing() as connection:
+        connection.execute('INSERT OR IGNORE INTO owners VALUES (?, ?)',
+                           (channel['channel_id'], user['u_id']))
+
+def remove_member(channel, u_id):
+    '''
+    Removes a user from a channel's members
+    '''
+    with writing() as connection:
+        connection.execute('DELETE FROM members WHERE channel_id = ? AND u_id = ?',
+                           (channel['channel_id'], u_id))
+        bump_membership(u_id)
+
+def remove_owner(channel, u_id):
+    '''
+    Removes a user from a channel's owners
+    '''
+    with writing() as connection:
+        connection.execute('DELETE FROM owners WHERE channel_id = ? AND u_id = ?',
+                           (channel['channel_id'], u_id))
+
+def remove_channel(channel):
+    '''
+    Deletes a channel along with its messages and membership entries
+    '''
+    channel_id = channel['channel_id']
+    with writing() as connection:
+        members = connection.execute('SELECT u_id FROM members WHERE channel_id = ?',
+                                     (channel_id,)).fetchall()
+        connection.execute('DELETE FROM reacts WHERE message_id IN '
+                           '(SELECT message_id FROM messages WHERE channel_id = ?)', (channel_id,))
+        for table in ('messages', 'members', 'owners', 'channels'):
+            connection.execute(f'DELETE FROM {table} WHERE channel_id = ?', (channel_id,))
+        for (u_id,) in members:
+            bump_membership(u_id)
+        versions['channels'].pop(channel_id, None)
+
+def new_message_id():
+    '''
+    Returns an unused message_id for a new message
+    '''
+    return next_counter('message_id')
+
+def reserve_message_id(message_id):
+    '''
+    Keeps new_message_id from handing out a message_id that is already used
+    '''
+    with writing() as connection:
+        connection.execute("UPDATE counters SET value = MAX(value, ?) WHERE name = 'message_id'",
+                           (message_id,))
+
+def last_message_id():
+    '''
+    Returns the message_id new_message_id last handed out
+    '''
+    return read_one("SELECT value FROM counters WHERE name = 'message_id'")[0]
+
+def insert_message(connection, channel_id, message):
+    '''
+    Stores a message and its reacts, and counts it in its channel
+    '''
+    connection.execute('UPDATE channels SET message_count = message_count + 1 '
+                       'WHERE channel_id = ?', (channel_id,))
+    connection.execute(f'INSERT INTO messages ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                       (message['message_id'], channel_id, message['u_id'],
+                        message['time_created'], message['message'], message['is_pinned']))
+    for react in message['reacts']:
+        for u_id in react['u_ids']:
+            connection.execute('INSERT INTO reacts VALUES (?, ?, ?)',
+                               (message['message_id'], react['react_id'], u_id))
+
+def load_messages(rows):
+    '''
+    Turns messages rows into message dicts, along with their reacts
+    '''
+    messages = {
+        row[0]: {
+            'message_id': row[0],
+            'u_id': row[2],
+            'message': row[4],
+            'time_created': row[3],
+            'reacts': [],
+            'is_pinned': bool(row[5]),
+        }
+        for row in rows
+    }
+    if messages:
+        reacts = {}
+        for message_id, react_id, u_id in read(
+                'SELECT message_id, react_id, u_id FROM reacts '
+                'WHERE message_id IN (SELECT value FROM json_each(?)) ORDER BY rowid',
+                (json.dumps(list(messages)),)):
+            react = reacts.get((message_id, react_id))
+            if react is None:
+                react = reacts[message_id, react_id] = {'react_id': react_id, 'u_ids': []}
+                messages[message_id]['reacts'].append(react)
+            react['u_ids'].append(u_id)
+    return [messages[row[0]] for row in rows]
+
+def add_message(channel, message):
+    '''
+    Stores a message in a channel
+    '''
+    with writing() as connection:
+        insert_message(connection, channel['channel_id'], message)
+        bump_version(channel['channel_id'])
+
+def update_message(message, changes):
+    '''
+    Changes some fields of a message, such as its text or whether it is pinned
+    '''
+    message.update(changes)
+    with writing() as connection:
+        connection.execute('UPDATE messages SET body = ?, is_pinned = ? WHERE message_id = ?',
+                           (message['message'], message['is_pinned'], message['message_id']))
+        if 'message' in changes:
+            channel_id, = connection.execute('SELECT channel_id FROM messages '
+                                             'WHERE message_id = ?',
+                                             (message['message_id'],)).fetchone()
+            bump_version(channel_id)
+
+def add_react(message, react_id, u_id):
+    '''
+    Records that a user reacted to a message
+    '''
+    for react in message['reacts']:
+        if react['react_id'] == react_id:
+            react['u_ids'].append(u_id)
+            break
+    else:
+        message['reacts'].append({
+            'react_id': react_id,
+            'u_ids': [u_id],
+        })
+    with writing() as connection:
+        connection.execute('INSERT INTO reacts VALUES (?, ?, ?)',
+                           (message['message_id'], react_id, u_id))
+
+def remove_react(message, react_id, u_id):
+    '''
+    Removes a user's react from a message, dropping the react once nobody has it
+    '''
+    for react in message['reacts']:
+        if react['react_id'] == react_id:
+            react['u_ids'].remove(u_id)
+            if not react['u_ids']:
+                message['reacts'].remove(react)
+            break
+    with writing() as connection:
+        connection.execute('DELETE FROM reacts WHERE message_id = ? AND react_id = ? AND u_id = ?',
+                           (message['message_id'], react_id, u_id))
+
+def remove_message(message_id):
+    '''
+    Removes a message from its channel
+    '''
+    with writing() as connection:
+        channel_id, = connection.execute('SELECT channel_id FROM messages WHERE message_id = ?',
+                                         (message_id,)).fetchone()
+        connection.execute('DELETE FROM reacts WHERE message_id = ?', (message_id,))
+        connection.execute('DELETE FROM messages WHERE message_id = ?', (message_id,))
+        connection.execute('UPDATE channels SET message_count = message_count - 1 '
+                           'WHERE channel_id = ?', (channel_id,))
+        bump_version(channel_id)
+
+def get_message(message_id):
+    '''
+    Returns the (channel, message) pair for a message_id, or (None, None)
+    '''
+    row = read_one(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE message_id = ?', (message_id,))
+    if row is None:
+        return None, None
+    return get_channel(row[1]), load_messages([row])[0]
+
+def count_messages(channel):
+    '''
+    Returns the number of messages in a channel
+    '''
+    return read_one('SELECT message_count FROM channels WHERE channel_id = ?',
+                    (channel['channel_id'],))[0]
+
+def iter_channel_messages(channel, start=0, stop=None):
+    '''
+    Yields a channel's messages oldest first, from index start up to but
+    not including index stop. A range nearer the newest end is read
+    backwards from there, so paging through recent messages doesn't step
+    over every older one.
+    '''
+    total = count_messages(channel)
+    stop = total if stop is None else min(stop, total)
+    if start >= stop:
+        return
+    if start < total - stop:
+        rows = read(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ? '
+                    'ORDER BY time_created, message_id LIMIT ? OFFSET ?',
+                    (channel['channel_id'], stop - start, start))
+    else:
+        rows = read(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ? '
+                    'ORDER BY time_created DESC, message_id DESC LIMIT ? OFFSET ?',
+                    (channel['channel_id'], stop - start, total - stop))
+        rows.reverse()
+    yield from load_messages(rows)
+
+def message_position(channel, message):
+    '''
+    Returns the index of a message within its channel's messages, counting
+    the newer messages since the messages paged from are usually recent
+    '''
+    newer = read_one('SELECT COUNT(*) FROM messages WHERE channel_id = ? '
+                     'AND (time_created, message_id) >= (?, ?)',
+                     (channel['channel_id'], message['time_created'],
+                      message['message_id']))[0]
+    return count_messages(channel) - newer
+
+def iter_messages_between(channel, time_start, time_end, after=None):
+    '''
+    Yields a channel's messages created between time_start and time_end
+    inclusive, oldest first, starting above the key "after" if it is given,
+    a page at a time
+    '''
+    if after is None or after < (time_start, -1):
+        after = (time_start, -1)
+    while True:
+        rows = read(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ? '
+                    'AND (time_created, message_id) > (?, ?) AND time_created <= ? '
+                    'ORDER BY time_created, message_id LIMIT ?',
+                    (channel['channel_id'], after[0], after[1], time_end, PAGE_SIZE))
+        yield from load_messages(rows)
+        if len(rows) < PAGE_SIZE:
+            return
+        after = (rows[-1][3], rows[-1][0])
+
+def iter_newest(channel, before=None):
+    '''
+    Yields (key, message) for a channel's messages from newest to oldest,
+    starting below the key "before" if it is given, a page at a time
+    '''
+    while True:
+        if before is None:
+            rows = read(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ? '
+                        'ORDER BY time_created DESC, message_id DESC LIMIT ?',
+                        (channel['channel_id'], PAGE_SIZE))
+        else:
+            rows = read(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ? '
+                        'AND (time_created, message_id) < (?, ?) '
+                        'ORDER BY time_created DESC, message_id DESC LIMIT ?',
+                        (channel['channel_id'], before[0], before[1], PAGE_SIZE))
+        for message in load_messages(rows):
+            yield (message['time_created'], message['message_id']), message
+        if len(rows) < PAGE_SIZE:
+            return
+        before = (rows[-1][3], rows[-1][0])
+
+def bump_version(channel_id):
+    '''
+    Records that message text in a channel has changed, so copies of it are
+    out of date
+    '''
+    versions['channels'][channel_id] = versions['channels'].get(channel_id, 0) + 1
+
+def bump_membership(u_id):
+    '''
+    Records that the set of channels a user is a member of has changed
+    '''
+    versions['memberships'][u_id] = versions['memberships'].get(u_id, 0) + 1
+
+def get_channel_version(channel_id):
+    '''
+    Returns the counter bumped whenever message text in a channel changes
+    '''
+    return versions['channels'].get(channel_id, 0)
+
+def get_membership_version(u_id):
+    '''
+    Returns the counter bumped whenever a user joins or leaves a channel
+    '''
+    return versions['memberships'].get(u_id, 0)
+
+def has_token(token):
+    '''
+    Checks if a token was issued and is still valid
+    '''
+    return read_one('SELECT 1 FROM tokens WHERE token = ?', (token,)) is not None
+
+def add_token(token):
+    '''
+    Records a token that was issued, doing nothing if it is already valid
+    '''
+    with writing() as connection:
+        connection.execute('INSERT OR IGNORE INTO tokens VALUES (?)', (token,))
+
+def remove_token(token):
+    '''
+    Invalidates a token
+    '''
+    with writing() as connection:
+        connection.execute('DELETE FROM tokens WHERE token = ?', (token,))
+
+def get_reset_email(reset_code):
+    '''
+    Returns the email a password reset code was sent to, or None
+    '''
+    row = read_one('SELECT email FROM reset_codes WHERE reset_code = ?', (reset_code,))
+    return None if row is None else row[0]
+
+def find_reset_code(email):
+    '''
+    Returns the unused password reset code sent to an email, or None
+    '''
+    row = read_one('SELECT reset_code FROM reset_codes WHERE email = ?', (email,))
+    return None if row is None else row[0]
+
+def add_reset_code(reset_code, email):
+    '''
+    Stores a password reset code for an email
+    '''
+    with writing() as connection:
+        connection.execute('INSERT OR REPLACE INTO reset_codes VALUES (?, ?)', (reset_code, email))
+
+def remove_reset_code(reset_code):
+    '''
+    Removes a password reset code once it is used or replaced
+    '''
+    with writing() as connection:
+        connection.execute('DELETE FROM reset_codes WHERE reset_code = ?', (reset_code,))
+
+def start_standup(channel, finish, token):
+    '''
+    Starts a standup in a channel, to be ended at time finish with the token
+    of the user who started it
+    '''
+    with writing() as connection:
+        connection.execute('UPDATE channels SET standup = ? WHERE channel_id = ?',
+                           (json.dumps({'finish': finish, 'token': token, 'messages': []}),
+                            channel['channel_id']))
+
+def get_standup(channel):
+    '''
+    Returns a channel's active standup, or None
+    '''
+    row = read_one('SELECT standup FROM channels WHERE channel_id = ?', (channel['channel_id'],))
+    return None if row is None or row[0] is None else json.loads(row[0])
+
+def add_standup_message(channel, handle_str, message):
+    '''
+    Adds a message to a channel's active standup
+    '''
+    with writing() as connection:
+        standup = get_standup(channel)
+        standup['messages'].append({handle_str: message})
+        connection.execute('UPDATE channels SET standup = ? WHERE channel_id = ?',
+                           (json.dumps(standup), channel['channel_id']))
+
+def end_standup(channel, finish=None):
+    '''
+    Ends a channel's active standup and returns its messages, or returns None
+    if there is no active standup, or the one finishing at finish has ended
+    '''
+    with writing() as connection:
+        standup = get_standup(channel)
+        if standup is None or finish not in (None, standup['finish']):
+            return None
+        connection.execute('UPDATE channels SET standup = NULL WHERE channel_id = ?',
+                           (channel['channel_id'],))
+        return standup['messages']
+
+def clear():
+    '''
+    Resets every user, channel, message, token and reset code
+    '''
+    with writing() as connection:
+        for table in ('users', 'channels', 'members', 'owners', 'messages', 'reacts',
+                      'tokens', 'reset_codes'):
+            connection.execute(f'DELETE FROM {table}')
+        connection.execute('UPDATE counters SET value = 0')
+        versions['channels'].clear()
+        versions['memberships'].clear()
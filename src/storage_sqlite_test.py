@@ -0,0 +1,177 @@
+'''
+Tests for the SQLite storage backend, which should behave like the in-memory one
+'''
+
+import gc
+import threading
+import time
+import auth
+import channel
+import channels
+import message
+import other
+import search_cache
+import search_index
+import standup
+import storage_sqlite
+import user
+import data
+
+def without_times(value):
+    '''
+    Drops the times messages were created at, which differ between runs
+    '''
+    if isinstance(value, dict):
+        return {key: without_times(item) for key, item in value.items()
+                if key not in ('time_created', 'next_cursor')}
+    if isinstance(value, (list, tuple)):
+        return [without_times(item) for item in value]
+    return value
+
+def visible_state(token):
+    '''
+    Returns everything a user can see
+    '''
+    return without_times({
+        'users': other.users_all(token),
+        'channels': [
+            (channel.channel_details(token, listed['channel_id']),
+             channel.channel_messages(token, listed['channel_id'], 0),
+             channel.channel_messages(token, listed['channel_id'], 0, 1),
+             channel.channel_messages_range(token, listed['channel_id'], 0, time.time() + 60))
+            for listed in channels.channels_listall(token)['channels']
+        ],
+        'search': other.search(token, 'e'),
+        'page': other.search(token, 'e', 2),
+    })
+
+def scenario():
+    '''
+    Makes one of each kind of change and returns what the first user sees
+    '''
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    user3 = auth.auth_register('third@email.com', 'third_password', 'Alex', 'Lee')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(user2['token'], 'channel2', False)['channel_id']
+    c_id3 = channels.channels_create(user3['token'], 'channel3', True)['channel_id']
+    channel.channel_join(user2['token'], c_id1)
+    channel.channel_join(user3['token'], c_id1)
+    channel.channel_invite(user2['token'], c_id2, user1['u_id'])
+    channel.channel_addowner(token1, c_id1, user2['u_id'])
+    channel.channel_removeowner(token1, c_id1, user2['u_id'])
+    channel.channel_leave(user3['token'], c_id1)
+    channel.delete_entire_channel(c_id3)
+
+    m_id1 = message.message_send(token1, c_id1, 'Hello there')['message_id']
+    m_id2 = message.message_send(user2['token'], c_id1, 'Edit me')['message_id']
+    m_id3 = message.message_send(user2['token'], c_id2, 'Remove me')['message_id']
+    message.message_send(token1, c_id1, 'Goodbye')
+    message.message_edit(token1, m_id2, 'Edited')
+    message.message_remove(user2['token'], m_id3)
+    message.message_pin(token1, m_id1)
+    message.message_react(token1, m_id1, 1)
+    message.message_react(user2['token'], m_id1, 1)
+    message.message_unreact(token1, m_id1, 1)
+    before = channel.channel_messages(token1, c_id1, before_message_id=m_id2)['messages']
+    assert [msg['message_id'] for msg in before] == [m_id1]
+
+    user.user_profile_setname(user2['token'], 'Samuel', 'Smithers')
+    user.user_profile_setemail(user2['token'], 'changed@email.com')
+    user.user_profile_sethandle(user2['token'], 'samsmith')
+    other.admin_userpermission_change(token1, user3['u_id'], 1)
+    auth.auth_logout(user3['token'])
+    return token1, visible_state(token1)
+
+def test_sqlite_backend(tmp_path):
+    '''
+    Tests that the SQLite backend gives the same results as the in-memory one
+    and keeps them after a restart
+    '''
+    _, expected = scenario()
+    other.clear()
+
+    db_path = str(tmp_path / 'flockr.db')
+    other.open_storage(db_path)
+    try:
+        assert data.BACKEND == 'sqlite'
+        token1, state = scenario()
+        assert state == expected
+
+        # reopening the database finds everything where it was left
+        search_index.clear()
+        search_cache.clear()
+        other.open_storage(db_path)
+        assert visible_state(token1) == expected
+        assert auth.auth_login('changed@email.com', 'another_password')['u_id'] == 2
+        assert channels.channels_create(token1, 'channel4', True)['channel_id'] == 4
+        other.clear()
+    finally:
+        data.use_backend('memory')
+    assert data.BACKEND == 'memory'
+    assert data.count_channels() == 0
+
+def test_sqlite_standup(tmp_path):
+    '''
+    Tests that a standup kept in the database is ended after a restart
+    '''
+    other.clear()
+    db_path = str(tmp_path / 'flockr.db')
+    other.open_storage(db_path)
+    try:
+        user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+        c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+        standup.standup_start(user1['token'], c_id1, 0.3)
+        standup.standup_send(user1['token'], c_id1, 'Hello')
+
+        search_index.clear()
+        other.open_storage(db_path)
+        assert standup.standup_active(user1['token'], c_id1)['is_active']
+
+        time.sleep(0.5)
+        assert not standup.standup_active(user1['token'], c_id1)['is_active']
+        messages = channel.channel_messages(user1['token'], c_id1, 0)['messages']
+        assert [msg['message'] for msg in messages] == ['HaydenJacobs : Hello\n']
+        other.clear()
+    finally:
+        data.use_backend('memory')
+
+def test_sqlite_threads(tmp_path):
+    '''
+    Tests that threads each use their own connection, which is reused by a
+    later thread once they finish
+    '''
+    other.clear()
+    other.open_storage(str(tmp_path / 'flockr.db'))
+    try:
+        user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+        c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+        used = []
+
+        def send():
+            for num in range(20):
+                message.message_send(user1['token'], c_id1, f'Hello {num}')
+            used.append(storage_sqlite.connect())
+
+        senders = [threading.Thread(target=send) for _ in range(8)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        assert len({id(connection) for connection in used}) == 8
+        messages = channel.channel_messages(user1['token'], c_id1, 0, 200)['messages']
+        assert len({msg['message_id'] for msg in messages}) == 160
+
+        del senders, sender
+        gc.collect()
+        assert len(storage_sqlite.idle) == 8
+        reader = threading.Thread(target=lambda: used.append(storage_sqlite.connect()))
+        reader.start()
+        reader.join()
+        assert used[-1] in used[:-1]
+        assert len(storage_sqlite.idle) == 7
+        other.clear()
+    finally:
+        data.use_backend('memory')
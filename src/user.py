@@ -11,7 +11,9 @@ from PIL import Image
 from flask import request
 from error import InputError, AccessError
 import data
+import locks
 
+@locks.users_reads
 def user_profile(token, u_id):
     '''
     Return user profile with a given token and user ID
@@ -26,21 +28,21 @@ def user_profile(token, u_id):
     if not valid_u_id:
         raise InputError(description='Cannot find user with provided u_id')
 
-    for user in data.users:
-        if user['u_id'] == u_id:
-            profile = {
-                'user': { \
-                    'u_id': user['u_id'], \
-                    'email': user['email'], \
-                    'name_first': user['name_first'], \
-                    'name_last': user['name_last'], \
-                    'handle_str': user['handle_str'], \
-                },
-            }
-            if 'profile_img_url' in user: # pragma: no cover
-                profile['user']['profile_img_url'] = user['profile_img_url']
+    user = valid_u_id
+    profile = {
+        'user': { \
+            'u_id': user['u_id'], \
+            'email': user['email'], \
+            'name_first': user['name_first'], \
+            'name_last': user['name_last'], \
+            'handle_str': user['handle_str'], \
+        },
+    }
+    if 'profile_img_url' in user: # pragma: no cover
+        profile['user']['profile_img_url'] = user['profile_img_url']
     return profile
 
+@locks.users_writes
 def user_profile_setname(token, name_first, name_last):
     '''
     Change user's first and last name
@@ -52,16 +54,12 @@ def user_profile_setname(token, name_first, name_last):
 
     name_validity(name_first, name_last)
 
-    change['name_first'] = name_first
-    change['name_last'] = name_last
-
-    for user in data.users:
-        if user['u_id'] == change['u_id']:
-            user = change
+    data.update_user(change, {'name_first': name_first, 'name_last': name_last})
 
     return {
     }
 
+@locks.users_writes
 def user_profile_setemail(token, email):
     '''
     Change user's email
@@ -73,15 +71,12 @@ def user_profile_setemail(token, email):
 
     email_validity(email)
 
-    change['email'] = email
-
-    for user in data.users:
-        if user['u_id'] == change['u_id']:
-            user = change
+    data.set_user_email(change, email)
 
     return {
     }
 
+@locks.users_writes
 def user_profile_sethandle(token, handle_str):
     '''
     Change user's handle
@@ -93,12 +88,7 @@ def user_profile_sethandle(token, handle_str):
 
     handle_validity(handle_str)
 
-
-    change['handle_str'] = handle_str
-
-    for user in data.users:
-        if user['u_id'] == change['u_id']:
-            user = change
+    data.set_user_handle(change, handle_str)
 
     return {}
 
@@ -107,7 +97,10 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end): #
     '''
     Upload a photo for user
     '''
-    change = token_validity(token)
+    # The users are only locked around reading and updating the user, not
+    # while the image is downloaded
+    with locks.users_reading():
+        change = token_validity(token)
     if not change:
         raise AccessError(description='Cannot find user with provided token')
 
@@ -129,36 +122,36 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end): #
     image_object = image_object.crop((x_start, y_start, x_end, y_end))
     image_object.save(fullpath)
 
-    for user in data.users:
-        if user['u_id'] == change['u_id']:
-            #Link saves in user profile
-            user['profile_img_url'] = request.host_url + 'static/' + file_name
+    #Link saves in user profile
+    with locks.users_writing():
+        # The user may have logged out while the image was downloading
+        change = token_validity(token)
+        if not change:
+            raise AccessError(description='Cannot find user with provided token')
+        data.update_user(change, {'profile_img_url': request.host_url + 'static/' + file_name})
     return {}
 
 def u_id_validity(u_id):
     '''
     Checks if the u_id is a valid u_id
     '''
-    for user in data.users:
-        if  user['u_id'] == u_id:
-            return user
+    user = data.get_user(u_id)
+    if user is None:
+        return False
 
-    return False
+    return user
 
 def token_validity(token):
     '''
     Checks if the token is a valid token
     '''
-    if token not in data.tokens:
+    if not data.has_token(token):
         return False
 
     decoded_info = jwt.decode(token, data.SECRET, algorithms=['HS256'])
     u_id = decoded_info['u_id']
 
-    for user in data.users:
-        if  user['u_id'] == u_id:
-            associated_user = user
-    return associated_user
+    return data.get_user(u_id)
 
 def name_validity(name_first, name_last):
     '''
@@ -180,9 +173,8 @@ def email_validity(email):
     if not re.search(r"^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$", email):
         raise InputError(description='Email is invalid')
 
-    for user in data.users:
-        if user['email'] == email:
-            raise InputError(description='Email is already in use')
+    if data.get_user_by_email(email) is not None:
+        raise InputError(description='Email is already in use')
 
     return True
 
@@ -193,9 +185,8 @@ def handle_validity(handle_str):
     if not 3 <= len(handle_str) <= 20:
         raise InputError(description='Handle name must be between 3 - 20 characters')
 
-    for user in data.users:
-        if user['handle_str'] == handle_str:
-            raise InputError(description='Handle is already in use')
+    if data.get_user_by_handle(handle_str) is not None:
+        raise InputError(description='Handle is already in use')
     return True
 def size_validity(width, height, x_start, y_start, x_end, y_end): # pragma: no cover #pylint: disable=too-many-arguments
 
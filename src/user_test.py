@@ -303,3 +303,35 @@ def test_user_profile_sethandle_inputerror_invalid_handle():
 
     with pytest.raises(InputError):
         assert user.user_profile_sethandle(token2, 'a')
+
+def test_user_profile_setemail_frees_old_email():
+    '''
+    Test user_profile set email releases the old email and logs in with the new one
+    '''
+    other.clear()
+
+    auth.auth_register("test@email.com", "test_pass", "First", "Last")
+    user1 = auth.auth_login("test@email.com", "test_pass")
+    user.user_profile_setemail(user1['token'], "bob.builder@yahoo.com")
+
+    with pytest.raises(InputError):
+        assert auth.auth_login("test@email.com", "test_pass")
+    assert auth.auth_login("bob.builder@yahoo.com", "test_pass")['u_id'] == user1['u_id']
+
+    user2 = auth.auth_register("test@email.com", "password2", "First2", "Last2")
+    assert user2['u_id'] != user1['u_id']
+
+def test_user_profile_sethandle_frees_old_handle():
+    '''
+    Test user_profile set handle releases the old handle for other users
+    '''
+    other.clear()
+
+    user1 = auth.auth_register("test@email.com", "test_pass", "First", "Last")
+    handle1 = user.user_profile(user1['token'], user1['u_id'])['user']['handle_str']
+    user.user_profile_sethandle(user1['token'], "creativename")
+
+    user2 = auth.auth_register("user2@email.com", "password2", "First2", "Last2")
+    user.user_profile_sethandle(user2['token'], handle1)
+    with pytest.raises(InputError):
+        assert user.user_profile_sethandle(user2['token'], "creativename")
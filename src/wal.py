@@ -0,0 +1,187 @@
+'''
+Write-ahead log of every change made to the state in data.py, so the
+server can be restarted without losing users, channels or messages.
+
+Each change is appended as one JSON line before it is applied, for example
+
+    ["add_member", channel_id, u_id]
+
+and data.load() applies the logged records again in order on startup.
+While a log is open, a change is applied while the log's lock is held, so
+holding the lock gives a state with no change half applied, as snapshots
+need. Snapshots are only taken while a log is open.
+How often the log is synced to disk is set by the fsync policy:
+
+    always      fsync after every record, nothing is lost on a crash
+    interval    a flusher thread syncs every FSYNC_INTERVAL_MS, committing
+                the records written since as one group without holding up
+                the changes made meanwhile, so a crash can lose the changes
+                made in the last interval
+    off         never fsync, so a crash of the machine can lose whatever
+                the operating system hadn't written out yet
+
+Under every policy a record is flushed out of the file buffer as soon as it
+is appended, so a follower reading the log sees it straight away.
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+FSYNC_POLICIES = ('always', 'interval', 'off')
+
+# Open log file, its path and fsync policy, the sync interval in seconds,
+# whether records were written since the last sync, the number of records
+# written since the log was opened, and the size of the log in bytes
+log = {
+    'file': None,
+    'path': None,
+    'policy': None,
+    'interval': 0.0,
+    'dirty': False,
+    'records': 0,
+    'offset': 0,
+}
+
+lock = threading.RLock()
+flusher = None
+
+def open_log(path, policy='interval', interval_ms=50):
+    '''
+    Starts appending records to the log at path
+    '''
+    global flusher # pylint: disable=global-statement
+    if policy not in FSYNC_POLICIES:
+        raise ValueError(f'Unknown fsync policy {policy!r}')
+    close()
+    with lock:
+        log['file'] = open(path, 'a', encoding='utf-8') # pylint: disable=consider-using-with
+        log['path'] = path
+        log['policy'] = policy
+        log['interval'] = interval_ms / 1000
+        log['dirty'] = False
+        log['records'] = 0
+        log['offset'] = os.path.getsize(path)
+    if policy == 'interval':
+        flusher = threading.Thread(target=run_flusher, args=(log['file'],),
+                                   name='wal-flusher', daemon=True)
+        flusher.start()
+
+def is_open():
+    '''
+    Checks if records are being logged
+    '''
+    return log['file'] is not None
+
+@contextlib.contextmanager
+def record(entry):
+    '''
+    Logs a change, then holds the lock while the change is applied. With no
+    log open there is nothing to keep in order with the change, so the lock
+    isn't taken and changes to different channels don't wait for each other.
+    '''
+    if log['file'] is None:
+        yield
+        return
+    with lock:
+        append(entry)
+        yield
+
+def append(entry):
+    '''
+    Writes a record to the log if one is open and flushes it, syncing it to
+    disk straight away under the "always" policy
+    '''
+    if log['file'] is None:
+        return
+    line = json.dumps(entry, separators=(',', ':')) + '\n'
+    with lock:
+        log['file'].write(line)
+        log['records'] += 1
+        log['offset'] += len(line.encode('utf-8'))
+        if log['policy'] == 'always':
+            sync()
+        else:
+            log['file'].flush()
+            log['dirty'] = True
+
+def sync():
+    '''
+    Flushes the log and fsyncs it, the lock must be held
+    '''
+    log['file'].flush()
+    os.fsync(log['file'].fileno())
+    log['dirty'] = False
+
+def run_flusher(log_file):
+    '''
+    Flusher loop for the "interval" policy, syncs the records written since
+    the last sync until the log file it was started for is closed
+    '''
+    while True:
+        time.sleep(log['interval'])
+        with lock:
+            if log['file'] is not log_file:
+                return
+            if not log['dirty']:
+                continue
+            log_file.flush()
+            log['dirty'] = False
+            # A copy of the descriptor stays valid if the log is closed meanwhile
+            descriptor = os.dup(log_file.fileno())
+        # Changes go on being logged while the records flushed so far are synced
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+def position():
+    '''
+    Returns the size in bytes of the log written so far
+    '''
+    with lock:
+        return log['offset']
+
+def read(path, offset=0):
+    '''
+    Yields the records logged at path in order, starting offset bytes in.
+    A record cut short by a crash ends the log, so it is cut off the file
+    before more are appended.
+    '''
+    if not os.path.exists(path):
+        return
+    good_bytes = offset
+    torn = False
+    with open(path, 'rb') as log_file:
+        log_file.seek(offset)
+        for line in log_file:
+            try:
+                entry = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                torn = True
+                break
+            good_bytes += len(line)
+            yield entry
+    if torn:
+        os.truncate(path, good_bytes)
+
+def close():
+    '''
+    Syncs and closes the log
+    '''
+    global flusher # pylint: disable=global-statement
+    with lock:
+        if log['file'] is not None:
+            if log['policy'] != 'off':
+                sync()
+            log['file'].close()
+        log['file'] = None
+        log['path'] = None
+        log['dirty'] = False
+    if flusher is not None:
+        flusher.join()
+        flusher = None
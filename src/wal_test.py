@@ -0,0 +1,210 @@
+'''
+Tests for the write-ahead log
+'''
+
+import threading
+import time
+import pytest
+import auth
+import channel
+import channels
+import message
+import other
+import standup
+import user
+import data
+import wal
+
+def snapshot(token):
+    '''
+    Returns everything a user can see, to compare before and after a restart
+    '''
+    return {
+        'users': other.users_all(token),
+        'channels': [
+            (channel.channel_details(token, listed['channel_id']),
+             channel.channel_messages(token, listed['channel_id'], 0))
+            for listed in channels.channels_listall(token)['channels']
+        ],
+        'search': other.search(token, 'e'),
+        'tokens': sorted(data.tokens),
+        'max_ids': (data.MAX_MESSAGE_ID, data.MAX_CHANNEL_ID),
+    }
+
+def restart(log_path, fsync='always'):
+    '''
+    Drops the in-memory state and reloads it from the log
+    '''
+    wal.close()
+    other.clear()
+    other.load(log_path, fsync, 10)
+
+def test_wal_replay(tmp_path):
+    '''
+    Tests that every kind of change is back after a restart
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'always', 10)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    user2 = auth.auth_register('another@email.com', 'another_password', 'Sam', 'Smith')
+    user3 = auth.auth_register('third@email.com', 'third_password', 'Alex', 'Lee')
+    token1 = user1['token']
+    c_id1 = channels.channels_create(token1, 'channel1', True)['channel_id']
+    c_id2 = channels.channels_create(user2['token'], 'channel2', False)['channel_id']
+    c_id3 = channels.channels_create(user3['token'], 'channel3', True)['channel_id']
+    channel.channel_join(user2['token'], c_id1)
+    channel.channel_join(user3['token'], c_id1)
+    channel.channel_invite(user2['token'], c_id2, user1['u_id'])
+    channel.channel_addowner(token1, c_id1, user2['u_id'])
+    channel.channel_removeowner(token1, c_id1, user2['u_id'])
+    channel.channel_leave(user3['token'], c_id1)
+    channel.delete_entire_channel(c_id3)
+
+    m_id1 = message.message_send(token1, c_id1, 'Hello there')['message_id']
+    m_id2 = message.message_send(user2['token'], c_id1, 'Edit me')['message_id']
+    m_id3 = message.message_send(user2['token'], c_id2, 'Remove me')['message_id']
+    message.message_edit(token1, m_id2, 'Edited')
+    message.message_remove(user2['token'], m_id3)
+    message.message_pin(token1, m_id1)
+    message.message_react(token1, m_id1, 1)
+    message.message_react(user2['token'], m_id1, 1)
+    message.message_unreact(token1, m_id1, 1)
+
+    user.user_profile_setname(user2['token'], 'Samuel', 'Smithers')
+    user.user_profile_setemail(user2['token'], 'changed@email.com')
+    user.user_profile_sethandle(user2['token'], 'samsmith')
+    other.admin_userpermission_change(token1, user3['u_id'], 1)
+    auth.auth_logout(user3['token'])
+
+    before = snapshot(token1)
+    restart(log_path)
+    assert snapshot(token1) == before
+
+    # the reloaded state keeps working and keeps being logged
+    assert auth.auth_login('changed@email.com', 'another_password')['u_id'] == user2['u_id']
+    with pytest.raises(Exception):
+        auth.auth_login('another@email.com', 'another_password')
+    m_id4 = message.message_send(token1, c_id1, 'After restart')['message_id']
+    assert m_id4 == m_id3 + 1
+    assert channels.channels_create(token1, 'channel4', True)['channel_id'] == c_id3 + 1
+
+    before = snapshot(token1)
+    restart(log_path, 'interval')
+    assert snapshot(token1) == before
+    wal.close()
+    other.clear()
+
+def test_wal_clear_and_standup(tmp_path):
+    '''
+    Tests that clearing is logged and that a standup is ended after a restart
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'off', 10)
+
+    auth.auth_register('old@email.com', 'test_password', 'Old', 'User')
+    other.clear()
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    standup.standup_start(user1['token'], c_id1, 0.3)
+    standup.standup_send(user1['token'], c_id1, 'Hello')
+
+    restart(log_path)
+    assert [u['email'] for u in other.users_all(user1['token'])['users']] == ['test@email.com']
+    assert standup.standup_active(user1['token'], c_id1)['is_active']
+
+    time.sleep(0.5)
+    messages = channel.channel_messages(user1['token'], c_id1, 0)['messages']
+    assert [msg['message'] for msg in messages] == ['HaydenJacobs : Hello\n']
+    wal.close()
+    other.clear()
+
+def test_wal_torn_record(tmp_path):
+    '''
+    Tests that a record cut short by a crash is dropped and later records are kept
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'always', 10)
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    wal.close()
+
+    with open(log_path, 'a', encoding='utf-8') as log_file:
+        log_file.write('["add_user",{"u_id":2,')
+
+    restart(log_path)
+    c_id1 = channels.channels_create(user1['token'], 'channel1', True)['channel_id']
+    restart(log_path)
+    assert [u['u_id'] for u in other.users_all(user1['token'])['users']] == [user1['u_id']]
+    assert channels.channels_list(user1['token'])['channels'][0]['channel_id'] == c_id1
+    wal.close()
+    other.clear()
+
+def test_wal_fsync_policy():
+    '''
+    Tests that an unknown fsync policy is rejected
+    '''
+    with pytest.raises(ValueError):
+        wal.open_log('unused.wal', 'sometimes')
+
+def test_wal_flushed_without_fsync(tmp_path):
+    '''
+    Tests that records can be read from the log before it is synced or closed
+    under the "off" policy
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'off', 10)
+    auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    assert [record[0] for record in wal.read(log_path)] == ['add_token', 'add_user']
+    wal.close()
+    other.clear()
+
+def test_wal_reset_codes(tmp_path):
+    '''
+    Tests that reset codes can be found by email before and after a restart
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'always', 10)
+    data.add_reset_code('code1', 'test@email.com')
+    data.add_reset_code('code2', 'another@email.com')
+    data.remove_reset_code('code1')
+    data.add_reset_code('code3', 'test@email.com')
+    assert data.find_reset_code('test@email.com') == 'code3'
+    assert data.find_reset_code('another@email.com') == 'code2'
+
+    restart(log_path)
+    assert data.find_reset_code('test@email.com') == 'code3'
+    assert data.get_reset_email('code2') == 'another@email.com'
+    data.remove_reset_code('code2')
+    assert data.find_reset_code('another@email.com') is None
+    wal.close()
+    other.clear()
+
+def test_wal_sync_outside_lock(tmp_path, monkeypatch):
+    '''
+    Tests that changes go on being logged while the interval flusher syncs
+    '''
+    other.clear()
+    log_path = str(tmp_path / 'flockr.wal')
+    other.load(log_path, 'interval', 10)
+    syncing = threading.Event()
+    synced = threading.Event()
+    def slow_fsync(_):
+        syncing.set()
+        synced.wait(5)
+    monkeypatch.setattr(wal.os, 'fsync', slow_fsync)
+
+    user1 = auth.auth_register('test@email.com', 'test_password', 'Hayden', 'Jacobs')
+    assert syncing.wait(5)
+    creator = threading.Thread(target=channels.channels_create,
+                               args=(user1['token'], 'channel1', True))
+    creator.start()
+    creator.join(1)
+    assert not creator.is_alive()
+    synced.set()
+    wal.close()
+    other.clear()